@@ -1,27 +1,38 @@
 import io
 import os
-import cv2
+import json
+import time
 import base64
+import asyncio
+import zipfile
+from typing import List, Optional
 import torch
 import torch.nn.functional as F
-import numpy as np
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from torchvision import models, transforms
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from PIL import Image
 from dotenv import load_dotenv
 
 load_dotenv() # Charge le fichier .env
 
-# Import pytorch-grad-cam pour l'explicabilité (Bonus)
-from pytorch_grad_cam import GradCAM
-from pytorch_grad_cam.utils.image import show_cam_on_image
-
-# Imports pour le ChatBot IA (Gemini)
-import google.generativeai as genai
+# Imports lourds différés (voir profile_imports.py) : pytorch_grad_cam est importé à la première
+# heatmap (_encode_heatmap), le SDK Gemini pendant le préchauffage (llm.py), cv2 par utils.py
 from pydantic import BaseModel
 
-from utils import is_image_blurry, get_advice
+from utils import get_advice, get_rss_mb, get_pss_mb
+from batcher import MicroBatcher
+from imaging import decode_upload
+from modeling import ARTIFACT_PATH, load_serving_model, load_artifact
+from cache import ResultCache, model_version
+from gradcam import forward_with_cam
+from backends import load_backend
+from cascade import Cascade, resize_batch
+from sessions import SessionStore
+import precision
+import llm
+import execution
+import metrics
 
 # ==========================================
 # CONFIGURATION DE L'API
@@ -39,88 +50,562 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# En-tête Server-Timing optionnel (durées de chaque étape, lisibles par le frontend)
+if metrics.SERVER_TIMING:
+    app.add_middleware(metrics.ServerTimingMiddleware)
+
 # Variables globales du modèle
 MODEL_PATH = "plantdoc_mobilenetv2.pth"
 CLASSES_PATH = "classes.txt"
+# Artefact versionné (poids + classes + pré-traitement), prioritaire s'il existe (voir modeling.py)
+MODEL_ARTIFACT = ARTIFACT_PATH
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Backend d'inférence de /predict (eager, fused, int8_dynamic, int8, torchscript, onnx : voir backends.py)
+INFERENCE_BACKEND = os.environ.get("PLANTDOC_BACKEND", "eager")
+# bfloat16 pour /predict (auto : si le CPU le supporte, voir precision.py). Grad-CAM reste en fp32.
+INFERENCE_BF16 = precision.use_bf16() and DEVICE.type == "cpu"
+
+# Cascade (voir cascade.py) : artefact du modèle rapide ('' = désactivée), seuil de confiance sous
+# lequel l'image passe au modèle complet (à régler avec tune_cascade.py), TTA du modèle complet
+CASCADE_ARTIFACT = os.environ.get("PLANTDOC_CASCADE_ARTIFACT", "")
+CASCADE_THRESHOLD = float(os.environ.get("PLANTDOC_CASCADE_THRESHOLD", "0.8"))
+CASCADE_TTA = os.environ.get("PLANTDOC_CASCADE_TTA", "0") == "1"
+
+# Micro-batching de /predict : taille max d'un lot et attente max après la première requête
+BATCH_MAX_SIZE = int(os.environ.get("PLANTDOC_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("PLANTDOC_BATCH_MAX_WAIT_MS", "5"))
+
+# Grad-CAM : lots de heatmaps (une passe forward/backward pour B images) sur une voie
+# d'exécution dédiée et bornée, pour que les heatmaps ne privent jamais /predict de threads
+EXPLAIN_BATCH_MAX_SIZE = int(os.environ.get("PLANTDOC_EXPLAIN_BATCH_MAX_SIZE", "4"))
+EXPLAIN_BATCH_MAX_WAIT_MS = float(os.environ.get("PLANTDOC_EXPLAIN_BATCH_MAX_WAIT_MS", "10"))
+EXPLAIN_WORKERS = int(os.environ.get("PLANTDOC_EXPLAIN_WORKERS", "1"))
+EXPLAIN_MAX_PENDING = int(os.environ.get("PLANTDOC_EXPLAIN_MAX_PENDING", "64"))
+
+# /predict/batch : taille des lots d'inférence, nombre max d'images et taille max d'une image d'archive
+BATCH_CHUNK_SIZE = int(os.environ.get("PLANTDOC_BATCH_CHUNK_SIZE", "32"))
+BATCH_MAX_FILES = int(os.environ.get("PLANTDOC_BATCH_MAX_FILES", "500"))
+BATCH_MAX_IMAGE_MB = float(os.environ.get("PLANTDOC_BATCH_MAX_IMAGE_MB", "30"))
+
+# Cache des résultats (hash de l'image + version du modèle) : taille du LRU mémoire (0 = désactivé),
+# base SQLite optionnelle conservée entre redémarrages (ex: PLANTDOC_CACHE_DB=results_cache.db),
+# et mise en cache des heatmaps
+CACHE_SIZE = int(os.environ.get("PLANTDOC_CACHE_SIZE", "1024"))
+CACHE_DB_PATH = os.environ.get("PLANTDOC_CACHE_DB", "")
+CACHE_HEATMAPS = os.environ.get("PLANTDOC_CACHE_HEATMAPS", "1") == "1"
+
+# Préchauffage au démarrage : nombre de passes factices à chaque taille de lot (0 = désactivé),
+# et préchauffage optionnel de Grad-CAM (import de pytorch_grad_cam, passe backward, superposition ;
+# désactivé par défaut : il retarderait /ready pour un chemin secondaire). /ready renvoie 503 d'ici là.
+WARMUP_ROUNDS = int(os.environ.get("PLANTDOC_WARMUP", "1"))
+WARMUP_EXPLAIN = os.environ.get("PLANTDOC_WARMUP_EXPLAIN", "0") == "1"
+
 model = None
 classes = []
-cam = None # Grad-CAM instance
+backend = None # Variante du modèle utilisée pour /predict (Grad-CAM garde le modèle eager)
+cascade = None # Modèle rapide + modèle complet si PLANTDOC_CASCADE_ARTIFACT est défini
+batcher = None # Regroupe les requêtes /predict concurrentes
+explain_batcher = None # Regroupe les calculs de heatmaps Grad-CAM
+result_cache = None # Résultats déjà calculés pour des images identiques
+input_size = None # (resize, crop) du modèle servi, lu dans l'artefact (ex: (183, 160) pour un élève distillé)
+ready = False # Passe à True une fois le préchauffage terminé (voir /ready)
+warmup_task = None
+chat_connect_task = None
+chat_client = None # Client LLM de /chat (None : pas de GEMINI_API_KEY, réponse de démonstration)
+session_store = SessionStore() # Dernier diagnostic et historique du chatbot par session (voir sessions.py)
 
-# Pré-traitement identique à l'entraînement (sans data-augmentation)
-preprocess = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+fast_model = None # Modèle rapide de la cascade et sa taille d'entrée
+fast_size = None
+cache_version = None
+
+def load_weights():
+    """
+    Lecture des poids (modèle servi et modèle rapide de la cascade).
+    serve.py l'appelle une seule fois dans le processus parent : les workers forkés partagent ces tenseurs.
+    """
+    global model, classes, input_size, cache_version, fast_model, fast_size
+    # 1-3. Charger l'artefact (une seule lecture), ou à défaut classes.txt + poids MobileNetV2
+    model, classes, weights_path, preprocess_meta = load_serving_model(DEVICE, MODEL_ARTIFACT, MODEL_PATH, CLASSES_PATH)
+    input_size = (preprocess_meta["resize"], preprocess_meta["crop"])
+    cache_version = model_version(weights_path)
+
+    if CASCADE_ARTIFACT:
+        fast_model, fast_classes, artifact = load_artifact(CASCADE_ARTIFACT, DEVICE)
+        if fast_classes != classes:
+            raise ValueError(f"Classes du modèle rapide {fast_classes} différentes de celles du modèle complet {classes}")
+        fast_size = artifact["preprocess"]["crop"]
+
+def build_backends():
+    """Backend d'inférence (et cascade) construits sur les modèles chargés par load_weights."""
+    global backend, cascade
+    # 4. Backend d'inférence pour /predict
+    backend = load_backend(INFERENCE_BACKEND, model, version=cache_version, bf16=INFERENCE_BF16)
+    print(f"Backend d'inférence : {backend.name}")
+
+    # 4 bis. Cascade optionnelle : le modèle rapide répond seul quand il est sûr de lui
+    if fast_model is not None:
+        fast_backend = load_backend("eager", fast_model, bf16=INFERENCE_BF16)
+        cascade = Cascade(fast_backend, backend, CASCADE_THRESHOLD, fast_size, CASCADE_TTA, on_batch=_count_cascade)
+        print(f"Cascade activée : {cascade.name}")
 
 @app.on_event("startup")
 def load_model():
-    global model, classes, cam
-    
-    # 1. Charger les classes
-    if os.path.exists(CLASSES_PATH):
-        with open(CLASSES_PATH, "r") as f:
-            classes = [line.strip() for line in f.readlines()]
+    global batcher, explain_batcher, result_cache
+    load_start = time.perf_counter()
+
+    # 0. Pools d'exécution (threads torch/OpenCV, processus optionnels)
+    execution.start()
+
+    # 1-4. Poids et backends, sauf s'ils ont déjà été chargés avant le fork (serve.py)
+    if model is None:
+        load_weights()
+    if backend is None:
+        build_backends()
+
+    # 5. Cache des résultats, invalidé dès que le fichier de poids change
+    version = f"{cache_version}-{backend.name}"
+    if cascade is not None:
+        version = f"{version}-{model_version(CASCADE_ARTIFACT)}-{cascade.name}"
+    result_cache = ResultCache(max_entries=CACHE_SIZE, db_path=CACHE_DB_PATH or None, version=version)
+
+    # 6. Micro-batching : le worker démarre à la première requête
+    batcher = MicroBatcher(_infer_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                           executor=execution.thread_pool())
+    explain_batcher = MicroBatcher(_explain_batch, max_batch_size=EXPLAIN_BATCH_MAX_SIZE,
+                                   max_wait_ms=EXPLAIN_BATCH_MAX_WAIT_MS, name="explain",
+                                   executor=execution.lane("explain", EXPLAIN_WORKERS),
+                                   max_pending=EXPLAIN_MAX_PENDING)
+
+    metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start)
+    metrics.REGISTRY.add_collector(_collect_runtime_metrics)
+
+@app.on_event("startup")
+def start_chat():
+    global chat_client
+    chat_client = llm.create_client(on_first_token=metrics.CHAT_TTFT_SECONDS.observe)
+    print(f"Chatbot : {chat_client.backend.name if chat_client is not None else 'démonstration (pas de GEMINI_API_KEY)'}")
+
+@app.on_event("startup")
+async def start_warm_up():
+    # En tâche de fond : uvicorn répond déjà aux sondes de vivacité, /ready attend la fin
+    global warmup_task, chat_connect_task
+    warmup_task = asyncio.create_task(_warm_up())
+    if chat_client is not None:
+        chat_connect_task = asyncio.create_task(_connect_chat())
+
+def _synthetic_jpeg(width=640, height=480):
+    """Photo factice (bruit) encodée en JPEG, pour exercer le vrai chemin de décodage."""
+    buffered = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+def _warm_up_sync(sample):
+    """
+    Passes factices à chaque taille de lot que les batchers peuvent produire : allocations,
+    noyaux (oneDNN, TorchScript, ONNX Runtime) et superposition initialisés avant le trafic réel.
+    """
+    decoded = decode_upload(sample, 100.0, WARMUP_EXPLAIN, input_size)
+    sizes = sorted(set(range(1, BATCH_MAX_SIZE + 1)) | {BATCH_CHUNK_SIZE})
+    for _ in range(WARMUP_ROUNDS):
+        for size in sizes:
+            batch = decoded.tensor.unsqueeze(0).expand(size, -1, -1, -1).contiguous().to(DEVICE)
+            if cascade is not None:
+                # Appels directs des deux étages : les compteurs de la cascade restent à zéro
+                cascade.fast(resize_batch(batch, cascade.fast_size))
+                cascade.full(batch)
+            else:
+                backend(batch)
+
+        if WARMUP_EXPLAIN:
+            for size in range(1, EXPLAIN_BATCH_MAX_SIZE + 1):
+                batch = decoded.tensor.unsqueeze(0).expand(size, -1, -1, -1).contiguous().to(DEVICE)
+                _, grayscale_cams = forward_with_cam(model, batch)
+            _encode_heatmap(decoded.overlay, grayscale_cams[0])
+
+async def _warm_up():
+    global ready
+    start = time.perf_counter()
+    if WARMUP_ROUNDS > 0:
+        try:
+            sample = _synthetic_jpeg()
+            await execution.run_in_thread(_warm_up_sync, sample)
+            # Processus de décodage (spawn) : leurs imports se font ici plutôt qu'à la première requête
+            await asyncio.gather(*[execution.run_cpu_bound(decode_upload, sample, 100.0, False, input_size)
+                                   for _ in range(execution.PROCESS_WORKERS)])
+        except Exception as e:
+            # Le préchauffage n'est qu'une optimisation : l'API reste servie, à froid
+            print(f"Attention : préchauffage interrompu ({e}).")
+    elapsed = time.perf_counter() - start
+    metrics.WARMUP_SECONDS.set(elapsed)
+    ready = True
+    print(f"Prêt : préchauffage terminé en {elapsed:.2f}s.")
+
+async def _connect_chat():
+    """Import du SDK et création du modèle Gemini hors du chemin de la première question (et de /ready)."""
+    try:
+        await execution.run_in_thread(chat_client.backend.connect)
+    except Exception as e:
+        # /chat réessaiera à la première question
+        print(f"Attention : connexion au LLM différée ({e}).")
+
+def _infer_batch(tensors, source="predict"):
+    """
+    Une seule passe forward pour tout le lot, renvoie un vecteur de probabilités par image.
+    `source` : étiquette de la métrique de taille de lot (batcher /predict ou lots de /predict/batch).
+    """
+    metrics.BATCH_SIZE.observe(len(tensors), batcher=source)
+    batch = torch.stack(tensors).to(DEVICE)
+    if cascade is not None:
+        probabilities = cascade(batch)
     else:
-        # Fallback pour la démo si non entraîné
-        classes = ["Tomato_healthy", "Tomato_Late_blight", "Tomato_Early_blight", "Potato_healthy", "Potato_Late_blight", "Tomato_Leaf_Mold"]
-        print("Info : Utilisation des classes par défaut.")
-    
-    # 2. Charger l'architecture MobileNetV2
-    model = models.mobilenet_v2(pretrained=False)
-    model.classifier[1] = torch.nn.Linear(model.last_channel, len(classes))
-    
-    # 3. Charger les poids (si disponibles)
-    if os.path.exists(MODEL_PATH):
-        model.load_state_dict(torch.load(MODEL_PATH, map_location=DEVICE))
-        print(f"Modèle chargé avec succès sur {DEVICE}.")
+        probabilities = F.softmax(backend(batch).float(), dim=1)
+    return list(probabilities.cpu())
+
+def _count_cascade(images, escalated):
+    metrics.CASCADE_IMAGES.inc(images - escalated, stage="fast")
+    metrics.CASCADE_IMAGES.inc(escalated, stage="escalated")
+
+def _explain_batch(jobs):
+    """
+    Une passe forward/backward Grad-CAM pour tout le lot.
+    Chaque job est (tenseur, classe cible ou None pour la classe prédite) ;
+    renvoie (probabilités, heatmap HxW) par image.
+    """
+    metrics.BATCH_SIZE.observe(len(jobs), batcher="explain")
+    batch = torch.stack([tensor for tensor, _ in jobs]).to(DEVICE)
+    probabilities, grayscale_cams = forward_with_cam(model, batch, targets=[target for _, target in jobs])
+    return list(zip(probabilities.cpu(), grayscale_cams))
+
+@app.on_event("shutdown")
+async def stop_workers():
+    for b in (batcher, explain_batcher):
+        if b is not None:
+            await b.stop()
+    for task in (warmup_task, chat_connect_task):
+        if task is not None and not task.done():
+            task.cancel()
+    execution.shutdown()
+
+@app.get("/ready")
+def get_ready():
+    """Sonde de disponibilité : 503 tant que le modèle n'est pas chargé et préchauffé."""
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "backend": cascade.name if cascade is not None else backend.name}
+
+@app.get("/stats")
+def get_stats():
+    """Métriques du micro-batching (taux de remplissage des lots, attente en file), de Grad-CAM, du cache et de la cascade."""
+    return {
+        "batching": batcher.stats() if batcher is not None else None,
+        "explain": explain_batcher.stats() if explain_batcher is not None else None,
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "cascade": cascade.stats() if cascade is not None else None,
+        "chat": chat_client.stats() if chat_client is not None else None,
+        "sessions": session_store.stats(),
+        "pid": os.getpid(),
+        "rss_mb": round(get_rss_mb(), 1),
+        "pss_mb": round(get_pss_mb(), 1),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """Métriques au format texte Prometheus."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _collect_runtime_metrics():
+    """Métriques lues au moment du scrape : cache, files d'attente des batchers, mémoire."""
+    cache_lookups = metrics.Counter("plantdoc_cache_lookups_total", "Consultations du cache par résultat.", ["result"])
+    cache_stats = result_cache.stats()
+    for result in ("hits", "disk_hits", "misses"):
+        cache_lookups.inc(cache_stats[result], result=result)
+    cache_entries = metrics.Gauge("plantdoc_cache_entries", "Entrées dans le cache mémoire.")
+    cache_entries.set(cache_stats["entries"])
+
+    queue_depth = metrics.Gauge("plantdoc_batch_queue_depth", "Requêtes en attente de lot.", ["batcher"])
+    queue_wait = metrics.Gauge("plantdoc_batch_queue_wait_mean_seconds", "Attente moyenne en file avant un lot.", ["batcher"])
+    fill_rate = metrics.Gauge("plantdoc_batch_fill_rate", "Remplissage moyen des lots (taille / taille max).", ["batcher"])
+    for b in (batcher, explain_batcher):
+        stats = b.stats()
+        queue_depth.set(stats["queue_depth"], batcher=b.name)
+        queue_wait.set(stats["mean_queue_wait_ms"] / 1000.0, batcher=b.name)
+        fill_rate.set(stats["batch_fill_rate"], batcher=b.name)
+
+    rss = metrics.Gauge("plantdoc_process_resident_memory_mb", "Mémoire résidente du processus (Mo).")
+    rss.set(round(get_rss_mb(), 1))
+    return [cache_lookups, cache_entries, queue_depth, queue_wait, fill_rate, rss]
+
+def _record_decode(endpoint, decoded):
+    """Reporte les durées mesurées pendant le décodage (éventuellement dans un autre processus)."""
+    for stage, seconds in decoded.timings.items():
+        metrics.record_stage(endpoint, stage, seconds)
+
+def _count_prediction(endpoint, response):
+    status = response.get("status", "error")
+    if status == "success":
+        predicted = response["primary_diagnosis"]
+    elif status == "uncertain":
+        predicted = response["top_predictions"][0]["class"]
     else:
-        print("ATTENTION : Fichier de poids '.pth' non trouvé. Le modèle fera des prédictions aléatoires.")
-        
-    model = model.to(DEVICE)
-    model.eval() # Mode inférence
+        predicted = "none"
+    metrics.PREDICTIONS.inc(endpoint=endpoint, status=status, predicted_class=predicted)
+
+async def _cache_lookup(image_bytes, *fields):
+    """Calcule la clé de cache (hash hors boucle d'événements) et renvoie (clé, [valeur en cache ou None par champ])."""
+    if not result_cache.enabled:
+        return None, [None] * len(fields)
+    return await execution.run_in_thread(_cache_lookup_sync, image_bytes, fields)
 
-    # 4. Initialisation de Grad-CAM sur la dernière couche convolutive
-    # Sur MobileNetV2, la dernière couche "features" avant le classifier
-    target_layers = [model.features[-1]]
-    cam = GradCAM(model=model, target_layers=target_layers)
+def _cache_lookup_sync(image_bytes, fields):
+    key = result_cache.key_for(image_bytes)
+    return key, [result_cache.get(key, field) for field in fields]
+
+async def _cache_store(key, **fields):
+    if key is not None:
+        await execution.run_in_thread(result_cache.put, key, **fields)
+
+BLURRY_RESPONSE = {
+    "status": "error", 
+    "message": "L'image est trop floue. Veuillez prendre une photo plus nette pour un bon diagnostic."
+}
 
 @app.post("/predict")
-async def predict_plant(file: UploadFile = File(...)):
+async def predict_plant(file: UploadFile = File(...), explain: bool = False, session_id: Optional[str] = None,
+                        session: bool = False):
     """
     Endpoint principal : Analyse une photo de feuille et renvoie un diagnostic.
+    Avec `?explain=true`, la réponse contient aussi la heatmap Grad-CAM (voir /diagnose).
+    Avec `?session=true` (ou un `session_id`), le diagnostic est mémorisé pour le chatbot :
+    la réponse contient le `session_id` à lui renvoyer.
     """
     if not file.content_type.startswith("image/"):
          raise HTTPException(status_code=400, detail="Veuillez uploader un fichier image valide.")
          
-    image_bytes = await file.read()
-    
-    # --- CONTRÔLE QUALITÉ ---
-    if is_image_blurry(image_bytes, threshold=100.0):
-        return {
-            "status": "error", 
-            "message": "L'image est trop floue. Veuillez prendre une photo plus nette pour un bon diagnostic."
-        }
+    with metrics.stage("predict", "read"):
+        image_bytes = await file.read()
+    if explain:
+        return await _diagnose(image_bytes, "predict", session_id, session)
 
-    # --- LECTURE & PRÉ-TRAITEMENT ---
+    # --- CACHE : même photo déjà analysée par ce modèle ---
+    with metrics.stage("predict", "cache_lookup"):
+        cache_key, (cached,) = await _cache_lookup(image_bytes, "payload")
+    if cached is not None:
+        _count_prediction("predict", cached)
+        return await _with_session(cached, session_id, session)
+    
+    # --- LECTURE (un seul décodage), CONTRÔLE QUALITÉ & PRÉ-TRAITEMENT (hors boucle d'événements) ---
     try:
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        decoded = await execution.run_cpu_bound(decode_upload, image_bytes, 100.0, False, input_size)
     except Exception:
+        metrics.PREDICTIONS.inc(endpoint="predict", status="error", predicted_class="none")
         raise HTTPException(status_code=400, detail="Impossible de lire l'image. Fichier corrompu ?")
-        
-    input_tensor = preprocess(image).unsqueeze(0).to(DEVICE)
+    _record_decode("predict", decoded)
+
+    if decoded.blurry:
+        _count_prediction("predict", BLURRY_RESPONSE)
+        await _cache_store(cache_key, payload=BLURRY_RESPONSE)
+        return BLURRY_RESPONSE
 
     # --- INFÉRENCE ---
-    with torch.no_grad():
-        output = model(input_tensor)
-        # Convertir les logits en probabilités (softmax)
-        probabilities = F.softmax(output, dim=1)[0]
-        
+    # La passe forward est mutualisée avec les autres requêtes en cours (micro-batching)
+    with metrics.stage("predict", "inference"):
+        probabilities = await batcher.submit(decoded.tensor)
+
+    with metrics.stage("predict", "postprocess"):
+        response = _build_diagnosis(probabilities, "predict")
+    _count_prediction("predict", response)
+    await _cache_store(cache_key, payload=response, probabilities=probabilities.tolist())
+    return await _with_session(response, session_id, session)
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    """
+    Diagnostic d'un lot de photos (plusieurs fichiers, ou une seule archive ZIP).
+    Les images sont décodées en parallèle puis classées par lots de BATCH_CHUNK_SIZE ;
+    les résultats sont renvoyés en NDJSON (une ligne JSON par image) au fur et à mesure.
+    """
+    items = []
+    for upload in files:
+        data = await upload.read()
+        if upload.filename and upload.filename.lower().endswith(".zip") or zipfile.is_zipfile(io.BytesIO(data)):
+            try:
+                items.extend(_zip_members(data))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Archive ZIP illisible : {upload.filename}")
+        elif upload.content_type.startswith("image/"):
+            items.append((upload.filename, data))
+        else:
+            raise HTTPException(status_code=400, detail=f"Fichier non supporté : {upload.filename}")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Aucune image trouvée dans l'envoi.")
+    if len(items) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Trop d'images ({len(items)}), maximum {BATCH_MAX_FILES}.")
+
+    return StreamingResponse(_stream_batch(items), media_type="application/x-ndjson")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def _zip_members(data):
+    """Liste les images d'une archive ZIP ; elles ne sont décompressées qu'au moment de leur lot."""
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    members = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if info.file_size > BATCH_MAX_IMAGE_MB * 1024 * 1024:
+            raise HTTPException(status_code=400, detail=f"Image trop volumineuse dans l'archive : {name}")
+        members.append((name, (archive, info)))
+    return members
+
+def _read_and_decode(source):
+    """Décompresse (si besoin) puis décode une image du lot, contrôle du flou compris."""
+    if isinstance(source, tuple):
+        archive, info = source
+        source = archive.read(info)
+    return decode_upload(source, 100.0, False, input_size)
+
+async def _decode_chunk(chunk):
+    """Décode toutes les images d'un lot en parallèle ; une image illisible donne une exception à sa place."""
+    return await asyncio.gather(
+        *[execution.run_in_thread(_read_and_decode, source) for _, source in chunk],
+        return_exceptions=True,
+    )
+
+async def _stream_batch(items):
+    chunks = [items[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(items), BATCH_CHUNK_SIZE)]
+    # Le décodage du lot suivant tourne pendant l'inférence du lot courant
+    next_decode = asyncio.ensure_future(_decode_chunk(chunks[0]))
+    try:
+        for index, chunk in enumerate(chunks):
+            decoded_chunk = await next_decode
+            if index + 1 < len(chunks):
+                next_decode = asyncio.ensure_future(_decode_chunk(chunks[index + 1]))
+
+            results = [None] * len(chunk)
+            ready = []
+            for i, decoded in enumerate(decoded_chunk):
+                if isinstance(decoded, Exception):
+                    results[i] = {"status": "error", "message": "Impossible de lire l'image. Fichier corrompu ?"}
+                elif decoded.blurry:
+                    results[i] = BLURRY_RESPONSE
+                else:
+                    ready.append(i)
+
+            # Une seule passe forward pour toutes les images nettes du lot
+            if ready:
+                try:
+                    with metrics.stage("predict_batch", "inference"):
+                        probabilities = await execution.run_in_thread(
+                            _infer_batch, [decoded_chunk[i].tensor for i in ready], "predict_batch")
+                    for i, probs in zip(ready, probabilities):
+                        results[i] = _build_diagnosis(probs, "predict_batch")
+                except Exception as e:
+                    # Une ligne d'erreur par image du lot, puis on passe au lot suivant
+                    print(f"Erreur d'inférence /predict/batch : {e!r}")
+                    for i in ready:
+                        if results[i] is None:
+                            results[i] = {"status": "error", "message": "Erreur lors de l'analyse de l'image."}
+
+            for decoded in decoded_chunk:
+                if not isinstance(decoded, Exception):
+                    _record_decode("predict_batch", decoded)
+            for result in results:
+                _count_prediction("predict_batch", result)
+
+            yield "".join(json.dumps({"filename": name, **result}) + "\n"
+                          for (name, _), result in zip(chunk, results))
+    finally:
+        # Client déconnecté en cours de flux : le décodage anticipé du lot suivant est abandonné
+        if not next_decode.done():
+            next_decode.cancel()
+            await asyncio.gather(next_decode, return_exceptions=True)
+
+@app.post("/diagnose")
+async def diagnose_plant(file: UploadFile = File(...), session_id: Optional[str] = None, session: bool = False):
+    """
+    Diagnostic + heatmap Grad-CAM en un seul upload : même diagnostic que /predict (modèle servi),
+    heatmap du modèle eager pour la classe prédite. Avec le backend eager sans cascade, une seule
+    passe forward (activations conservées) sert aux probabilités et à la heatmap.
+    """
+    if not file.content_type.startswith("image/"):
+         raise HTTPException(status_code=400, detail="Veuillez uploader un fichier image valide.")
+
+    with metrics.stage("diagnose", "read"):
+        image_bytes = await file.read()
+    return await _diagnose(image_bytes, session_id=session_id, new_session=session)
+
+async def _diagnose(image_bytes, endpoint="diagnose", session_id=None, new_session=False):
+    with metrics.stage(endpoint, "cache_lookup"):
+        cache_key, (cached, cached_probabilities, heatmap) = await _cache_lookup(
+            image_bytes, "payload", "probabilities", "heatmap")
+    if cached is not None and (heatmap is not None or cached["status"] == "error"):
+        _count_prediction(endpoint, cached)
+        return _with_heatmap(await _with_session(cached, session_id, new_session), heatmap)
+
+    try:
+        decoded = await execution.run_cpu_bound(decode_upload, image_bytes, 100.0, True, input_size)
+    except Exception:
+        metrics.PREDICTIONS.inc(endpoint=endpoint, status="error", predicted_class="none")
+        raise HTTPException(status_code=400, detail="Impossible de lire l'image. Fichier corrompu ?")
+    _record_decode(endpoint, decoded)
+
+    if decoded.blurry:
+        _count_prediction(endpoint, BLURRY_RESPONSE)
+        await _cache_store(cache_key, payload=BLURRY_RESPONSE)
+        return BLURRY_RESPONSE
+
+    probabilities, heatmap = await _served_diagnosis(decoded, cached_probabilities, endpoint)
+
+    with metrics.stage(endpoint, "postprocess"):
+        response = _build_diagnosis(probabilities, endpoint)
+    _count_prediction(endpoint, response)
+    await _cache_store(cache_key, payload=response, probabilities=probabilities.tolist(),
+                       **({"heatmap": heatmap} if CACHE_HEATMAPS else {}))
+    return _with_heatmap(await _with_session(response, session_id, new_session), heatmap)
+
+def _eager_is_served():
+    """Le modèle eager de Grad-CAM est-il aussi celui de /predict (mêmes probabilités) ?"""
+    return cascade is None and backend.name == "eager"
+
+async def _served_diagnosis(decoded, cached_probabilities=None, endpoint="diagnose"):
+    """
+    Probabilités du modèle servi (backend et cascade de /predict, même clé de cache) et heatmap
+    Grad-CAM du modèle eager pour la classe qu'il a prédite. Une seule passe forward quand le
+    modèle servi est le modèle eager lui-même ; sinon le batcher de /predict donne la prédiction.
+    """
+    if cached_probabilities is not None:
+        probabilities = torch.tensor(cached_probabilities)
+    elif _eager_is_served():
+        return await _forward_and_render(decoded, endpoint=endpoint)
+    else:
+        with metrics.stage(endpoint, "inference"):
+            probabilities = await batcher.submit(decoded.tensor)
+    _, heatmap = await _forward_and_render(decoded, target=int(probabilities.argmax()), endpoint=endpoint)
+    return probabilities, heatmap
+
+async def _with_session(response, session_id, new_session=False):
+    """
+    Si le client le demande (`session_id` fourni ou `session=true`), mémorise le diagnostic pour le
+    chatbot (hors boucle d'événements : base SQLite possible) et ajoute l'identifiant à la réponse.
+    """
+    if not (session_id or new_session):
+        return response
+    session_id = await execution.run_in_thread(session_store.record_diagnosis, session_id, response)
+    return {**response, "session_id": session_id} if session_id else response
+
+def _with_heatmap(response, heatmap):
+    if heatmap is None:
+        return response
+    return {**response, "heatmap_base64": f"data:image/jpeg;base64,{heatmap}"}
+
+def _build_diagnosis(probabilities, endpoint="predict"):
+    """Transforme le vecteur de probabilités en réponse de diagnostic (succès ou incertain)."""
     # Extraire le Top-1 (la meilleure probabilité)
     top1_prob, top1_catid = torch.topk(probabilities, 1)
     
@@ -146,7 +631,8 @@ async def predict_plant(file: UploadFile = File(...)):
         {"class": best_class, "confidence": round(best_confidence * 100, 2)}
     ]
 
-    advice = get_advice(best_class)
+    with metrics.stage(endpoint, "advice"):
+        advice = get_advice(best_class)
 
     return {
         "status": "success",
@@ -163,28 +649,22 @@ async def explain_prediction(file: UploadFile = File(...)):
     Renvoie l'image traitée en base64 pour être affichée directement par le frontend.
     """
     try:
-        image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # Préparer l'image pour l'affichage (taille de l'entrée du modèle)
-        img_resized = image.resize((224, 224))
-        rgb_img = np.float32(img_resized) / 255
-        
-        # Pré-traitement et tenseur
-        input_tensor = preprocess(image).unsqueeze(0).to(DEVICE)
-        
-        # Générer la heatmap avec Grad-CAM (cible = None -> prend la classe prédite Max)
-        grayscale_cam = cam(input_tensor=input_tensor, targets=None)
-        grayscale_cam = grayscale_cam[0, :] # On prend la première image du batch
-        
-        # Superposition avec l'image d'origine
-        visualization = show_cam_on_image(rgb_img, grayscale_cam, use_rgb=True)
-        pil_vis = Image.fromarray(visualization)
-        
-        # Encodage en Base64
-        buffered = io.BytesIO()
-        pil_vis.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        with metrics.stage("explain", "read"):
+            image_bytes = await file.read()
+
+        with metrics.stage("explain", "cache_lookup"):
+            cache_key, (img_str, cached_probabilities) = await _cache_lookup(image_bytes, "heatmap", "probabilities")
+        if img_str is None:
+            # Un seul décodage pour le tenseur et l'image de superposition (pool de processus si activé)
+            decoded = await execution.run_cpu_bound(decode_upload, image_bytes, None, True, input_size)
+            _record_decode("explain", decoded)
+
+            # Heatmap de la classe prédite par le modèle servi : cohérente avec /predict sur la même clé
+            probabilities, img_str = await _served_diagnosis(decoded, cached_probabilities, "explain")
+            fields = {"probabilities": probabilities.tolist()}
+            if CACHE_HEATMAPS:
+                fields["heatmap"] = img_str
+            await _cache_store(cache_key, **fields)
         
         return {
             "status": "success",
@@ -193,62 +673,130 @@ async def explain_prediction(file: UploadFile = File(...)):
     except Exception as e:
         return {"status": "error", "message": f"Erreur de génération heatmap: {str(e)}"}
 
+async def _forward_and_render(decoded, target=None, endpoint="explain"):
+    """
+    Passe forward + backward Grad-CAM (regroupée avec les autres heatmaps en attente),
+    puis superposition et encodage dans le pool de threads principal.
+    Renvoie (probabilités, heatmap superposée à l'image en JPEG base64).
+    """
+    with metrics.stage(endpoint, "gradcam"):
+        probabilities, grayscale_cam = await explain_batcher.submit((decoded.tensor, target))
+    with metrics.stage(endpoint, "heatmap_encode"):
+        heatmap = await execution.run_in_thread(_encode_heatmap, decoded.overlay, grayscale_cam)
+    return probabilities, heatmap
+
+def _encode_heatmap(overlay, grayscale_cam):
+    """Superpose la heatmap à l'image d'origine et l'encode en JPEG base64."""
+    # pytorch-grad-cam (et cv2) : seule la superposition est utilisée, la heatmap est calculée
+    # par gradcam.forward_with_cam sur les activations de la passe forward
+    from pytorch_grad_cam.utils.image import show_cam_on_image
+    visualization = show_cam_on_image(overlay, grayscale_cam, use_rgb=True)
+    pil_vis = Image.fromarray(visualization)
+
+    # Encodage en Base64
+    buffered = io.BytesIO()
+    pil_vis.save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
 # ==========================================
 # CHATBOT INTELLIGENT (LLM)
 # ==========================================
 
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None # Renvoyé par /predict, /diagnose ou /chat : diagnostic et historique
 
 @app.post("/chat")
 async def chat_with_bot(req: ChatRequest):
     """
     Assistant IA expert en botanique. 
-    Fonctionne avec l'API Google Gemini si GEMINI_API_KEY est dans les variables d'environnement.
+    Fonctionne avec l'API Google Gemini si GEMINI_API_KEY est dans les variables d'environnement
+    (ou avec le remplaçant local, PLANTDOC_LLM_BACKEND=local : voir llm.py).
+    Avec un `session_id`, la réponse tient compte du dernier diagnostic et des échanges précédents.
     """
     user_message = req.message.strip()
     if not user_message:
         raise HTTPException(status_code=400, detail="Le message est vide.")
 
-    api_key = os.environ.get("GEMINI_API_KEY", "")
-    
     # 1. Si aucune clé API n'est configurée, on utilise un comportement de démonstration
-    if not api_key:
+    if chat_client is None:
         return {
             "status": "success",
             "response": "Bonjour ! Le mode IA complet est désactivé. Veuillez configurer `GEMINI_API_KEY` côté Backend pour que je puisse répondre intelligemment."
         }
 
-    # 2. Si la clé est présente, on interroge Gemini
+    # 2. Sinon, client LLM asynchrone partagé (délai max, concurrence bornée, cache des questions fréquentes)
+    session = await _chat_session(req.session_id)
     try:
-        genai.configure(api_key=api_key)
-        # L'API Key de l'utilisateur ne supporte que les tout derniers modèles comme 2.5
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Le System Prompt pour forcer l'IA à rester dans son rôle
-        system_prompt = (
-            "Tu es 'Dr Plant', un expert agronome et botaniste. "
-            "Ton but est d'aider les utilisateurs avec leurs plantes de manière chaleureuse, courte et concise ("
-            "maximum 3 phrases). N'utilise jamais de markdown complexe, garde le texte pur. "
-            "Si la question ne concerne pas du tout la nature, les plantes ou l'agriculture, dis poliment que tu n'es qu'un expert végétal.\n\n"
-            f"Utilisateur: {user_message}"
-        )
-
-        response = model.generate_content(system_prompt)
-        ai_text = response.text.replace('*', '') # Nettoyage basique
-
+        with metrics.stage("chat", "llm"):
+            ai_text = await chat_client.ask(user_message, session)
+        metrics.CHAT_REQUESTS.inc(status="success")
+        if session is not None:
+            await execution.run_in_thread(session_store.add_turn, session, user_message, ai_text)
         return {
             "status": "success",
-            "response": ai_text
+            "response": ai_text,
+            **({"session_id": session.id} if session is not None else {}),
         }
         
     except Exception as e:
-        print(f"Erreur LLM : {str(e)}")
+        status = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+        metrics.CHAT_REQUESTS.inc(status=status)
+        print(f"Erreur LLM ({status}) : {e!r}")
         return {
             "status": "error",
             "response": "Désolé, j'éprouve des difficultés de connexion avec mon cerveau IA actuellement."
         }
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Variante de /chat en Server-Sent Events : chaque morceau de réponse est envoyé dès que le LLM
+    le produit (`data: {"delta": "..."}`), puis un événement `done` (ou `error`) clôt le flux.
+    """
+    user_message = req.message.strip()
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Le message est vide.")
+    session = await _chat_session(req.session_id)
+    return StreamingResponse(_stream_chat(user_message, session), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _chat_session(session_id):
+    """Session du chatbot (diagnostic et historique), lue hors boucle d'événements ; None sans `session_id`."""
+    if not session_id:
+        return None
+    return await execution.run_in_thread(session_store.get_or_create, session_id)
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _stream_chat(user_message, session=None):
+    if chat_client is None:
+        yield _sse({"delta": "Bonjour ! Le mode IA complet est désactivé. Veuillez configurer `GEMINI_API_KEY` côté Backend pour que je puisse répondre intelligemment."})
+        yield _sse({"status": "success"}, event="done")
+        return
+
+    start = time.perf_counter()
+    parts = []
+    try:
+        async for delta in chat_client.stream(user_message, session):
+            parts.append(delta)
+            yield _sse({"delta": delta})
+    except Exception as e:
+        status = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+        metrics.CHAT_REQUESTS.inc(status=status)
+        print(f"Erreur LLM ({status}) : {e!r}")
+        yield _sse({"status": "error",
+                    "response": "Désolé, j'éprouve des difficultés de connexion avec mon cerveau IA actuellement."},
+                   event="error")
+        return
+    metrics.record_stage("chat_stream", "llm", time.perf_counter() - start)
+    metrics.CHAT_REQUESTS.inc(status="success")
+    if session is not None:
+        await execution.run_in_thread(session_store.add_turn, session, user_message, "".join(parts))
+    yield _sse({"status": "success", **({"session_id": session.id} if session is not None else {})}, event="done")
+
 # ==========================================
 # INSTRUCTIONS D'EXÉCUTION (POUR LE DEV)
 # ==========================================
@@ -0,0 +1,162 @@
+import os
+import copy
+import json
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+import precision
+from imaging import CROP_SIZE
+
+# ==========================================
+# BACKENDS D'INFÉRENCE (choix via PLANTDOC_BACKEND)
+# ==========================================
+# - eager       : modèle PyTorch fp32 tel qu'entraîné (référence)
+# - fused       : Conv+BN fusionnés, tenseurs en channels_last
+# - int8_dynamic: quantification dynamique INT8 (couches Linear, sans calibration)
+# - int8        : quantification statique INT8 (FX graph mode, calibrée sur data/val)
+# - torchscript : modèle TorchScript figé (torch.jit.freeze)
+# - onnx        : ONNX Runtime (CPU)
+#
+# Les variantes int8 / torchscript / onnx sont produites par export_models.py dans EXPORT_DIR.
+# Grad-CAM a besoin des gradients : il utilise toujours le modèle eager.
+#
+# bf16=True (eager / fused) : passe forward sous autocast bfloat16 (voir precision.py) ;
+# le nom du backend prend le suffixe '-bf16' (les caches de résultats restent séparés).
+
+BACKENDS = ("eager", "fused", "int8_dynamic", "int8", "torchscript", "onnx")
+EXPORT_DIR = "exports"
+EXPORT_FILES = {
+    "int8": "plantdoc_int8.pt",
+    "torchscript": "plantdoc_torchscript.pt",
+    "onnx": "plantdoc_mobilenetv2.onnx",
+}
+MANIFEST_FILE = "manifest.json"
+
+
+def fuse_conv_bn(model):
+    """Copie du modèle où chaque BatchNorm qui suit une Conv2d est replié dans la convolution."""
+    model = copy.deepcopy(model).eval()
+    for module in list(model.modules()):
+        children = list(module.named_children())
+        for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+                setattr(module, bn_name, nn.Identity())
+    return model
+
+
+def quantized_engine():
+    """Moteur de quantification disponible sur cette machine (x86/fbgemm sur Intel-AMD, qnnpack sur ARM)."""
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    return None
+
+
+def quantize_static(model, calibration_batches):
+    """Quantification statique INT8 en FX graph mode, calibrée sur quelques lots d'images."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+    example_inputs = (calibration_batches[0][:1],)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(engine), example_inputs)
+    with torch.no_grad():
+        for inputs in calibration_batches:
+            prepared(inputs)
+    return convert_fx(prepared)
+
+
+def quantize_dynamic(model):
+    """Quantification dynamique INT8 : seules les couches Linear (le classifieur) sont concernées."""
+    torch.backends.quantized.engine = quantized_engine()
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def freeze_torchscript(model, channels_last=False, input_size=CROP_SIZE):
+    """Trace puis fige le modèle (poids en constantes, BN repliées par torch.jit.freeze)."""
+    example = torch.randn(1, 3, input_size, input_size)
+    if channels_last:
+        example = example.to(memory_format=torch.channels_last)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    return torch.jit.freeze(traced)
+
+
+class TorchBackend:
+    """Module PyTorch (eager, fusionné, quantifié ou TorchScript) appelé en mode inférence."""
+
+    def __init__(self, name, module, channels_last=False, bf16=False):
+        self.name = f"{name}-bf16" if bf16 else name
+        self.module = module
+        self.channels_last = channels_last
+        self.bf16 = bf16
+
+    def __call__(self, batch):
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode(), precision.autocast(self.bf16):
+            return self.module(batch).float()
+
+
+class OnnxBackend:
+    """Session ONNX Runtime sur CPU, un thread intra-op par thread torch configuré."""
+
+    def __init__(self, path, intra_op_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("Backend 'onnx' : installez onnxruntime (pip install onnxruntime).")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.name = "onnx"
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def check_manifest(export_dir, version):
+    """Prévient si les exports ont été produits à partir d'un autre fichier de poids."""
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("model_version") != version:
+        print(f"ATTENTION : les exports de '{export_dir}' ne correspondent pas aux poids actuels. Relancez export_models.py.")
+
+
+def load_backend(name, model, export_dir=EXPORT_DIR, version=None, bf16=False):
+    """
+    Construit le backend `name` à partir du modèle eager chargé (ou de son export).
+    Renvoie un callable : tenseur Bx3xCxC (C = taille d'entrée du modèle) -> logits BxC.
+    `bf16` ne s'applique qu'aux backends eager et fused (les autres sont déjà optimisés à l'export).
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend inconnu '{name}'. Choix possibles : {', '.join(BACKENDS)}")
+
+    if name == "eager":
+        return TorchBackend(name, model, bf16=bf16)
+    if name == "fused":
+        return TorchBackend(name, fuse_conv_bn(model).to(memory_format=torch.channels_last), channels_last=True,
+                            bf16=bf16)
+    if name == "int8_dynamic":
+        return TorchBackend(name, quantize_dynamic(model))
+
+    path = os.path.join(export_dir, EXPORT_FILES[name])
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Backend '{name}' : fichier '{path}' introuvable. Lancez d'abord export_models.py.")
+    if version is not None:
+        check_manifest(export_dir, version)
+
+    if name == "onnx":
+        return OnnxBackend(path)
+    if name == "int8":
+        torch.backends.quantized.engine = quantized_engine()
+    return TorchBackend(name, torch.jit.load(path, map_location="cpu"))
@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """
+    Regroupe les requêtes d'inférence concurrentes en mini-batchs.
+
+    Chaque appel à `submit` dépose un élément dans une file. Un worker asyncio
+    récupère jusqu'à `max_batch_size` éléments (ou attend au plus `max_wait_ms`
+    après le premier), exécute `infer_fn` une seule fois sur le lot, puis
+    renvoie à chaque appelant le résultat qui lui correspond.
+
+    `infer_fn` reçoit une liste d'éléments et doit renvoyer une liste de
+    résultats de même longueur, dans le même ordre. Elle est exécutée dans
+    `executor` (pool par défaut de la boucle si None) pour ne pas bloquer
+    la boucle d'événements pendant la passe forward.
+
+    `max_pending` (> 0) borne la file : au-delà, `submit` attend qu'une place se libère.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=5.0, executor=None, name="predict", max_pending=0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size doit être >= 1")
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self.name = name
+        self.max_pending = max_pending
+
+        self._queue = None
+        self._worker = None
+        self._current = [] # Lot en cours de calcul (à faire échouer si le worker est arrêté)
+
+        # Métriques (lues par /stats)
+        self.batches = 0
+        self.items = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.total_batch_time = 0.0
+        self.last_batch_time = 0.0
+
+    def start(self):
+        """Démarre le worker. Doit être appelé depuis la boucle d'événements."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Arrête le worker et fait échouer les requêtes encore en attente."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        pending = [fut for _, fut, _ in self._current]
+        self._current = []
+        while not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            pending.append(fut)
+        for fut in pending:
+            if not fut.done():
+                fut.set_exception(RuntimeError("Batcher arrêté"))
+        self._worker = None
+
+    async def submit(self, item):
+        """Ajoute un élément à la file et attend son résultat."""
+        if self._worker is None or self._worker.done():
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, fut, time.perf_counter()))
+        return await fut
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _collect(self):
+        """Attend le premier élément puis remplit le lot jusqu'à la taille max ou l'échéance."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self._current = batch
+
+            now = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                wait = now - enqueued_at
+                self.total_queue_wait += wait
+                self.max_queue_wait = max(self.max_queue_wait, wait)
+            self.batches += 1
+            self.items += len(batch)
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.infer_fn, [b[0] for b in batch])
+                if len(results) != len(batch):
+                    # zip() tronquerait en silence : les derniers appelants n'auraient jamais de réponse
+                    raise RuntimeError(f"infer_fn a renvoyé {len(results)} résultats pour {len(batch)} éléments")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            finally:
+                self.last_batch_time = time.perf_counter() - now
+                self.total_batch_time += self.last_batch_time
+
+            for (_, fut, _), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+            self._current = []
+
+    def stats(self):
+        """Résumé des métriques : taux de remplissage des lots et attente en file."""
+        batches = max(self.batches, 1)
+        items = max(self.items, 1)
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "images": self.items,
+            "mean_batch_size": round(self.items / batches, 3),
+            "batch_fill_rate": round(self.items / (batches * self.max_batch_size), 3),
+            "mean_queue_wait_ms": round(self.total_queue_wait / items * 1000.0, 3),
+            "max_queue_wait_ms": round(self.max_queue_wait * 1000.0, 3),
+            "mean_batch_time_ms": round(self.total_batch_time / batches * 1000.0, 3),
+            "last_batch_time_ms": round(self.last_batch_time * 1000.0, 3),
+            "queue_depth": self.queue_depth(),
+        }
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+# ==========================================
+# BENCHMARK DE CHARGE DE L'API
+# ==========================================
+# Rejoue des images de data/val (ou Kaggle_PlantVillage) contre /predict, /explain et /chat :
+# - boucle fermée : --concurrency clients qui enchaînent les requêtes
+# - boucle ouverte : --rate requêtes/s (arrivées de Poisson), indépendamment des réponses
+# Mesure p50/p95/p99, débit, taux d'erreur et d'incertitude, RSS du serveur (via /stats),
+# et écrit un histogramme de latence log-linéaire (style HDR) en JSON.
+#
+# Exemples :
+#   python bench_api.py --concurrency 16 --duration 30 --mix predict=7,explain=2,chat=1
+#   python bench_api.py --rate 50 --duration 60 --output bench.json
+#   python bench_api.py --in-process --concurrency 8   (sans serveur ni réseau, Gemini simulé)
+
+BASE_URL = "http://127.0.0.1:8000"
+
+CHAT_QUESTIONS = [
+    "Comment traiter le mildiou de la tomate ?",
+    "Pourquoi les feuilles de ma pomme de terre jaunissent ?",
+    "Quel fongicide bio utiliser contre l'alternariose ?",
+    "À quelle fréquence arroser mes tomates ?",
+]
+
+def list_images(data_dir):
+    images = []
+    for root, _, files in os.walk(data_dir):
+        images.extend(os.path.join(root, f) for f in files if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return images
+
+def parse_mix(mix):
+    """'predict=7,explain=2,chat=1' -> liste pondérée d'endpoints."""
+    endpoints = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        endpoints.extend([name.strip()] * int(weight or 1))
+    return endpoints
+
+
+class LatencyHistogram:
+    """
+    Histogramme log-linéaire (à la HdrHistogram) : chaque puissance de 2 de millisecondes
+    est découpée en SUB_BUCKETS intervalles égaux, soit une précision relative ~ 1/SUB_BUCKETS.
+    """
+
+    SUB_BUCKETS = 32
+
+    def __init__(self):
+        self.counts = {}
+        self.values = []
+
+    def record(self, ms):
+        self.values.append(ms)
+        self.counts[self._bucket(ms)] = self.counts.get(self._bucket(ms), 0) + 1
+
+    def _bucket(self, ms):
+        if ms < 1.0:
+            return (0, int(ms * self.SUB_BUCKETS))
+        exponent = int(math.log2(ms))
+        base = 2 ** exponent
+        return (exponent + 1, int((ms - base) / base * self.SUB_BUCKETS))
+
+    def _bounds(self, bucket):
+        exponent, sub = bucket
+        if exponent == 0:
+            return sub / self.SUB_BUCKETS, (sub + 1) / self.SUB_BUCKETS
+        base = 2 ** (exponent - 1)
+        return base + sub * base / self.SUB_BUCKETS, base + (sub + 1) * base / self.SUB_BUCKETS
+
+    def percentile(self, q):
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        return values[min(len(values) - 1, int(math.ceil(q / 100.0 * len(values))) - 1)]
+
+    def to_json(self):
+        return [
+            {"from_ms": round(lo, 4), "to_ms": round(hi, 4), "count": self.counts[b]}
+            for b in sorted(self.counts)
+            for lo, hi in [self._bounds(b)]
+        ]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.uncertain = 0
+
+    def summary(self, duration):
+        h = self.histogram
+        return {
+            "requests": self.requests,
+            "throughput_rps": round(self.requests / duration, 2),
+            "error_rate": round(self.errors / max(self.requests, 1), 4),
+            "uncertain_rate": round(self.uncertain / max(self.requests, 1), 4),
+            "p50_ms": round(h.percentile(50), 2),
+            "p95_ms": round(h.percentile(95), 2),
+            "p99_ms": round(h.percentile(99), 2),
+            "max_ms": round(max(h.values), 2) if h.values else 0.0,
+            "histogram": h.to_json(),
+        }
+
+
+class Bench:
+    def __init__(self, client, images, endpoints):
+        self.client = client
+        self.images = images
+        self.endpoints = endpoints
+        self.stats = {}
+        self.rss_samples = []
+        self._image_cache = {}
+
+    def _image_bytes(self, path):
+        if path not in self._image_cache:
+            with open(path, "rb") as f:
+                self._image_cache[path] = f.read()
+        return self._image_cache[path]
+
+    async def one_request(self):
+        endpoint = random.choice(self.endpoints)
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        start = time.perf_counter()
+        try:
+            if endpoint == "chat":
+                response = await self.client.post("/chat", json={"message": random.choice(CHAT_QUESTIONS)})
+            else:
+                path = random.choice(self.images)
+                files = {"file": (os.path.basename(path), self._image_bytes(path), "image/jpeg")}
+                response = await self.client.post(f"/{endpoint}", files=files)
+            body = response.json() if response.status_code == 200 else {}
+            ok = response.status_code == 200 and body.get("status") != "error"
+            if body.get("status") == "uncertain":
+                stats.uncertain += 1
+        except Exception:
+            ok = False
+        stats.histogram.record((time.perf_counter() - start) * 1000.0)
+        stats.requests += 1
+        if not ok:
+            stats.errors += 1
+
+    async def closed_loop(self, concurrency, deadline):
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                await self.one_request()
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+
+    async def open_loop(self, rate, deadline, max_in_flight):
+        # Arrivées de Poisson : la charge ne ralentit pas quand le serveur sature
+        in_flight = set()
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(random.expovariate(rate))
+            if len(in_flight) >= max_in_flight:
+                self.stats.setdefault("dropped", EndpointStats()).requests += 1
+                continue
+            task = asyncio.ensure_future(self.one_request())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def sample_rss(self, deadline, interval=1.0):
+        while time.perf_counter() < deadline:
+            try:
+                response = await self.client.get("/stats")
+                self.rss_samples.append(response.json().get("rss_mb", 0.0))
+            except Exception:
+                pass
+            await asyncio.sleep(interval)
+
+
+def in_process_client():
+    """Client httpx branché directement sur l'application ASGI, avec le LLM local de llm.py (sans réseau)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["PLANTDOC_LLM_BACKEND"] = "local"
+    import api
+
+    api.load_model()
+    api.start_chat()
+    transport = httpx.ASGITransport(app=api.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0), api
+
+
+async def run(args):
+    images = list_images(args.data_dir)
+    if not images:
+        print(f"Erreur: aucune image trouvée dans {args.data_dir}.")
+        return None
+
+    app_module = None
+    if args.in_process:
+        client, app_module = in_process_client()
+    else:
+        limits = httpx.Limits(max_connections=max(args.concurrency, args.max_in_flight))
+        client = httpx.AsyncClient(base_url=args.url, timeout=120.0, limits=limits)
+
+    bench = Bench(client, images, parse_mix(args.mix))
+    mode = f"{args.rate} req/s (boucle ouverte)" if args.rate else f"{args.concurrency} clients (boucle fermée)"
+    print(f"=== Benchmark : {mode}, {args.duration}s, mix {args.mix} ===")
+
+    try:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        sampler = asyncio.ensure_future(bench.sample_rss(deadline))
+        if args.rate:
+            await bench.open_loop(args.rate, deadline, args.max_in_flight)
+        else:
+            await bench.closed_loop(args.concurrency, deadline)
+        await sampler
+        elapsed = time.perf_counter() - start
+    finally:
+        await client.aclose()
+        if app_module is not None:
+            await app_module.stop_workers()
+
+    results = {
+        "mode": "open" if args.rate else "closed",
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration_s": round(elapsed, 2),
+        "mix": args.mix,
+        "server_rss_mb": {
+            "max": max(bench.rss_samples) if bench.rss_samples else None,
+            "last": bench.rss_samples[-1] if bench.rss_samples else None,
+        },
+        "endpoints": {name: s.summary(elapsed) for name, s in sorted(bench.stats.items())},
+    }
+
+    for name, r in results["endpoints"].items():
+        print(f"/{name:<8} n={r['requests']:<6} débit={r['throughput_rps']:7.1f} req/s "
+              f"p50={r['p50_ms']:7.1f}ms p95={r['p95_ms']:7.1f}ms p99={r['p99_ms']:7.1f}ms "
+              f"erreurs={r['error_rate'] * 100:.1f}% incertain={r['uncertain_rate'] * 100:.1f}%")
+    print(f"RSS serveur max : {results['server_rss_mb']['max']} Mo")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de charge et de latence de l'API PlantDoc")
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--data-dir", default="data/val", help="data/val ou Kaggle_PlantVillage")
+    parser.add_argument("--mix", default="predict=7,explain=3", help="ex: predict=7,explain=2,chat=1")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients en boucle fermée")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requêtes/s en boucle ouverte (0 = boucle fermée)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Requêtes simultanées max en boucle ouverte")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--in-process", action="store_true", help="Démarre l'API dans ce processus (Gemini simulé)")
+    parser.add_argument("--output", default=None, help="Fichier JSON (résultats + histogrammes)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if results and args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Résultats écrits dans {args.output}")
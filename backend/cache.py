@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def model_version(model_path: str) -> str:
+    """
+    Empreinte du fichier de poids chargé (SHA-256 tronqué).
+    Toute modification de `plantdoc_mobilenetv2.pth` change la version, donc les clés du cache.
+    """
+    if not os.path.exists(model_path):
+        return "untrained"
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Cache des résultats adressé par le contenu : clé = hash des bytes de l'image + version du modèle.
+
+    Chaque entrée peut contenir le vecteur softmax (`probabilities`), la réponse de
+    diagnostic (`payload`) et la heatmap Grad-CAM encodée (`heatmap`). Les champs
+    s'ajoutent au fil des requêtes (/predict puis /explain sur les mêmes bytes).
+
+    - Niveau mémoire : LRU borné à `max_entries` entrées.
+    - Niveau disque (optionnel) : base SQLite `db_path`, conservée entre redémarrages.
+      Les lignes d'une autre version du modèle sont purgées à l'ouverture.
+    """
+
+    FIELDS = ("probabilities", "payload", "heatmap")
+
+    def __init__(self, max_entries=1024, db_path=None, version="", max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.version = version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+        # Compteurs (lus par /stats)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, version TEXT, probabilities TEXT, payload TEXT, heatmap TEXT, updated REAL)"
+            )
+            # Invalidation : les résultats d'un autre fichier de poids ne sont plus valables
+            deleted = self._db.execute("DELETE FROM results WHERE version != ?", (version,)).rowcount
+            self._db.commit()
+            if deleted:
+                print(f"Cache : {deleted} résultats d'une ancienne version du modèle supprimés.")
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self._db is not None
+
+    def key_for(self, image_bytes: bytes) -> str:
+        """Clé de cache d'un upload (à appeler hors boucle d'événements pour les grosses images)."""
+        return f"{self.version}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    def get(self, key: str, field: str):
+        """Renvoie le champ demandé de l'entrée, ou None (compté comme un échec)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.get(field) is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[field]
+
+            entry = self._load(key)
+            if entry is not None and entry.get(field) is not None:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry[field]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, **fields):
+        """Ajoute ou complète l'entrée `key` (ex: put(key, heatmap=...))."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.get(key) or self._load(key) or {}
+            entry.update({k: v for k, v in fields.items() if k in self.FIELDS})
+            self._remember(key, entry)
+            try:
+                self._store(key, entry)
+            except sqlite3.Error as e:
+                # Ex: "database is locked" avec plusieurs workers : le résultat reste servi, seul
+                # le niveau disque est manqué
+                self.disk_errors += 1
+                self._db.rollback()
+                print(f"Cache : écriture disque ignorée ({e}).")
+
+    def _remember(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT probabilities, payload, heatmap FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.disk_errors += 1
+            print(f"Cache : lecture disque ignorée ({e}).")
+            return None
+        if row is None:
+            return None
+        probabilities, payload, heatmap = row
+        return {
+            "probabilities": json.loads(probabilities) if probabilities else None,
+            "payload": json.loads(payload) if payload else None,
+            "heatmap": heatmap,
+        }
+
+    def _store(self, key, entry):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, version, probabilities, payload, heatmap, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                self.version,
+                json.dumps(entry["probabilities"]) if entry.get("probabilities") is not None else None,
+                json.dumps(entry["payload"]) if entry.get("payload") is not None else None,
+                entry.get("heatmap"),
+                time.time(),
+            ),
+        )
+        # Borne du niveau disque : on retire régulièrement les entrées les plus anciennes
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+        self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk": self._db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,73 @@
+import threading
+import torch
+import torch.nn.functional as F
+
+# ==========================================
+# CASCADE DE MODÈLES (rapide d'abord, complet si doute)
+# ==========================================
+# Étage 1 : un modèle compact (ex: élève distillé à 160 px, voir distill.py) répond seul
+# quand sa confiance atteint `threshold`. Sinon l'image "escalade" vers le modèle complet
+# à 224 px, éventuellement avec une TTA (moyenne avec l'image retournée horizontalement).
+# L'étage 1 reçoit le tenseur 224 px réduit à sa taille d'entrée : exactement ce qu'il a vu
+# pendant la distillation, et un seul décodage par requête.
+# Seuils à régler sur data/val avec tune_cascade.py.
+
+
+def resize_batch(batch, size):
+    """Réduit un lot Bx3xHxW (déjà normalisé) à size x size, comme pendant la distillation."""
+    if batch.shape[-1] == size:
+        return batch
+    return F.interpolate(batch, size=(size, size), mode="bilinear", antialias=True, align_corners=False)
+
+
+def full_probabilities(backend, batch, tta=False):
+    """Probabilités du modèle complet, moyennées avec l'image miroir si `tta`."""
+    probabilities = F.softmax(backend(batch).float(), dim=1)
+    if tta:
+        probabilities = (probabilities + F.softmax(backend(torch.flip(batch, dims=[3])).float(), dim=1)) / 2
+    return probabilities
+
+
+class Cascade:
+    """
+    Callable : lot Bx3x224x224 -> probabilités BxC.
+    `fast` et `full` sont des backends (voir backends.py) qui renvoient des logits.
+    """
+
+    def __init__(self, fast, full, threshold=0.8, fast_size=160, tta=False, on_batch=None):
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        self.fast_size = fast_size
+        self.tta = tta
+        self.on_batch = on_batch # on_batch(images, escalated) : ex. compteurs Prometheus
+        self.name = f"cascade-{fast.name}-{full.name}-t{threshold:g}{'-tta' if tta else ''}"
+        self._lock = threading.Lock()
+        self._images = 0
+        self._escalated = 0
+
+    def __call__(self, batch):
+        probabilities = F.softmax(self.fast(resize_batch(batch, self.fast_size)).float(), dim=1)
+        unsure = probabilities.max(dim=1).values < self.threshold
+        escalated = int(unsure.sum())
+        if escalated:
+            probabilities[unsure] = full_probabilities(self.full, batch[unsure], self.tta)
+
+        with self._lock:
+            self._images += batch.shape[0]
+            self._escalated += escalated
+        if self.on_batch is not None:
+            self.on_batch(batch.shape[0], escalated)
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            images, escalated = self._images, self._escalated
+        return {
+            "name": self.name,
+            "threshold": self.threshold,
+            "tta": self.tta,
+            "images": images,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / images, 4) if images else 0.0,
+        }
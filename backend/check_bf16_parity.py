@@ -0,0 +1,67 @@
+import sys
+import argparse
+import torch
+import torch.nn.functional as F
+from torchvision import datasets
+from torch.utils.data import DataLoader
+
+from imaging import get_preprocess
+from modeling import load_serving_model
+from backends import load_backend
+from precision import cpu_supports_bf16
+from export_models import measure_latency
+
+# Vérifie que l'inférence bfloat16 (autocast CPU) donne le même Top-1 que fp32,
+# puis compare la latence des deux précisions pour plusieurs tailles de lot.
+# Usage : python check_bf16_parity.py --data-dir data/val --backend fused
+
+def run(backend, loader):
+    probabilities = []
+    labels = []
+    for inputs, targets in loader:
+        probabilities.append(F.softmax(backend(inputs).float(), dim=1))
+        labels.append(targets)
+    return torch.cat(probabilities), torch.cat(labels)
+
+def check_parity(data_dir, backend_name, batch_sizes, min_agreement):
+    model, classes, _, preprocess_meta = load_serving_model()
+    input_size = preprocess_meta["crop"]
+    dataset = datasets.ImageFolder(data_dir, get_preprocess(preprocess_meta["resize"], input_size))
+    if len(dataset) == 0:
+        print(f"Erreur: aucune image trouvée dans {data_dir}.")
+        return False
+    to_model_idx = torch.tensor([classes.index(c) for c in dataset.classes])
+    loader = DataLoader(dataset, batch_size=32, shuffle=False, num_workers=2)
+
+    fp32 = load_backend(backend_name, model)
+    bf16 = load_backend(backend_name, model, bf16=True)
+    probs_fp32, labels = run(fp32, loader)
+    probs_bf16, _ = run(bf16, loader)
+    labels = to_model_idx[labels]
+
+    preds_fp32 = probs_fp32.argmax(dim=1)
+    preds_bf16 = probs_bf16.argmax(dim=1)
+    agreement = float((preds_fp32 == preds_bf16).float().mean())
+    print(f"=== Parité bf16 / fp32 ({backend_name}) sur {len(labels)} images ===")
+    print(f"Support bf16 natif du CPU : {'oui' if cpu_supports_bf16() else 'non (émulé, lent)'}")
+    print(f"Top-1 fp32 : {float((preds_fp32 == labels).float().mean()) * 100:.2f}%  "
+          f"bf16 : {float((preds_bf16 == labels).float().mean()) * 100:.2f}%")
+    print(f"Accord Top-1 : {agreement * 100:.2f}%  écart max des probabilités : "
+          f"{float((probs_fp32 - probs_bf16).abs().max()):.4f}")
+
+    print("\nLatence médiane par lot :")
+    for batch_size in batch_sizes:
+        t_fp32 = measure_latency(fp32, batch_size, input_size=input_size)
+        t_bf16 = measure_latency(bf16, batch_size, input_size=input_size)
+        print(f"  b{batch_size:<3} fp32 {t_fp32:8.2f} ms ({batch_size / t_fp32 * 1000:7.1f} img/s)  "
+              f"bf16 {t_bf16:8.2f} ms ({batch_size / t_bf16 * 1000:7.1f} img/s)  x{t_fp32 / t_bf16:.2f}")
+    return agreement >= min_agreement
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parité Top-1 et débit de l'inférence bfloat16 vs fp32")
+    parser.add_argument("--data-dir", default="data/val")
+    parser.add_argument("--backend", default="eager", choices=["eager", "fused"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+    sys.exit(0 if check_parity(args.data_dir, args.backend, args.batch_sizes, args.min_agreement) else 1)
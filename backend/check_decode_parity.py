@@ -0,0 +1,116 @@
+import io
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+
+from imaging import BLUR_SCALE_EXPONENT, DecodedImage, blur_threshold_at, open_image
+from modeling import load_serving_model
+from utils import is_image_blurry, laplacian_variance
+
+# Vérifie que le décodage JPEG à résolution réduite (open_image, mode rapide)
+# donne le même Top-1 et la même réponse au contrôle du flou que le décodage complet,
+# et que ce contrôle (sur l'image de travail, seuil ajusté) rejoint la référence
+# historique utils.is_image_blurry(bytes), calculée à pleine résolution.
+# Les images PlantVillage font 256 px : elles sont agrandies (--upscale) et
+# ré-encodées en JPEG pour simuler des photos de téléphone et déclencher draft().
+# L'exposant de mise à l'échelle du seuil le plus proche de la référence est affiché
+# (à reporter dans PLANTDOC_BLUR_SCALE_EXPONENT).
+# Usage : python check_decode_parity.py --data-dir data/val --upscale 8
+
+EXPONENT_CANDIDATES = [e / 4 for e in range(0, 17)] # 0 à 4 par pas de 0.25
+
+def list_images(data_dir):
+    images = []
+    for root, _, files in os.walk(data_dir):
+        images.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return images
+
+def simulate_phone_photo(img_path, upscale):
+    image = Image.open(img_path).convert("RGB")
+    if upscale > 1:
+        image = image.resize((image.width * upscale, image.height * upscale), Image.BICUBIC)
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=95)
+    return buffered.getvalue()
+
+def predict(model, tensor):
+    with torch.no_grad():
+        return int(model(tensor.unsqueeze(0)).argmax(dim=1))
+
+def decode(image_bytes, fast, input_size, blur_threshold):
+    """Même enchaînement que l'API : décodage, contrôle du flou, tenseur."""
+    decoded = DecodedImage.from_bytes(image_bytes, input_size, fast=fast)
+    return decoded.is_blurry(blur_threshold), decoded.tensor, decoded
+
+def best_exponent(samples, blur_threshold):
+    """Exposant dont les décisions (image de travail) s'accordent le mieux avec la référence pleine résolution."""
+    def agreement(exponent):
+        return sum((working < blur_threshold_at(blur_threshold, scale, exponent)) == (full < blur_threshold)
+                   for full, working, scale in samples)
+    return max(EXPONENT_CANDIDATES, key=agreement), agreement
+
+def check_parity(data_dir, upscale, min_agreement, blur_threshold=100.0):
+    model, classes, _, preprocess_meta = load_serving_model()
+    input_size = (preprocess_meta["resize"], preprocess_meta["crop"])
+    images = list_images(data_dir)
+    if not images:
+        print(f"Erreur: aucune image trouvée dans {data_dir}.")
+        return False
+
+    agree = 0
+    blur_agree = 0
+    blurry_full = 0
+    baseline_agree = 0
+    blurry_baseline = 0
+    samples = [] # (variance pleine résolution, variance image de travail, facteur de réduction)
+    time_full = 0.0
+    time_fast = 0.0
+    for img_path in images:
+        image_bytes = simulate_phone_photo(img_path, upscale)
+
+        start = time.perf_counter()
+        blurry_full_path, tensor_full, _ = decode(image_bytes, False, input_size, blur_threshold)
+        time_full += time.perf_counter() - start
+
+        start = time.perf_counter()
+        blurry_fast_path, tensor_fast, decoded = decode(image_bytes, True, input_size, blur_threshold)
+        time_fast += time.perf_counter() - start
+
+        if predict(model, tensor_full) == predict(model, tensor_fast):
+            agree += 1
+        blurry_full += blurry_full_path
+        blur_agree += blurry_full_path == blurry_fast_path
+
+        # Référence : contrôle historique sur l'image complète décodée par OpenCV
+        blurry_reference = is_image_blurry(image_bytes, blur_threshold)
+        blurry_baseline += blurry_reference
+        baseline_agree += blurry_reference == blurry_fast_path
+        samples.append((laplacian_variance(np.asarray(open_image(image_bytes, fast=False))),
+                        laplacian_variance(decoded.rgb), decoded.scale))
+
+    n = len(images)
+    agreement = agree / n
+    print(f"=== Parité décodage rapide / complet sur {n} images (x{upscale}) ===")
+    print(f"Accord Top-1 : {agree}/{n} ({agreement * 100:.2f}%)")
+    print(f"Contrôle du flou (seuil {blur_threshold:g}) : même réponse pour {blur_agree}/{n} images "
+          f"({blurry_full} jugées floues en décodage complet)")
+    print(f"Référence pleine résolution (is_image_blurry) : même réponse pour {baseline_agree}/{n} images "
+          f"({blurry_baseline} jugées floues par la référence, exposant {BLUR_SCALE_EXPONENT:g})")
+    exponent, exponent_agreement = best_exponent(samples, blur_threshold)
+    print(f"Exposant le plus proche de la référence : {exponent:g} ({exponent_agreement(exponent)}/{n} images)")
+    print(f"Décodage + pré-traitement : complet {time_full / n * 1000:.1f} ms/img, rapide {time_fast / n * 1000:.1f} ms/img")
+    return (agreement >= min_agreement and blur_agree / n >= min_agreement
+            and baseline_agree / n >= min_agreement)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parité Top-1 et flou du décodage JPEG réduit (draft) vs décodage complet et référence")
+    parser.add_argument("--data-dir", default="data/val")
+    parser.add_argument("--upscale", type=int, default=8)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--blur-threshold", type=float, default=100.0)
+    args = parser.parse_args()
+    sys.exit(0 if check_parity(args.data_dir, args.upscale, args.min_agreement, args.blur_threshold) else 1)
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import argparse
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import datasets, models
+from torch.utils.data import DataLoader
+
+import train_improved
+from shards import get_shard_loaders
+from imaging import get_preprocess
+from modeling import ARCHITECTURES, PREPROCESS_META, build_model, load_serving_model, load_artifact, save_artifact
+from precision import BF16_MODE, use_bf16, autocast
+from backends import load_backend
+from export_models import measure_latency
+
+# ==========================================
+# DISTILLATION : ÉLÈVE COMPACT POUR LES PASSERELLES ARM
+# ==========================================
+# Le modèle servi actuel (professeur, MobileNetV2 224 px) produit des cibles "douces" ;
+# un élève plus petit (MobileNetV3-Small ou MobileNetV2 x0.5) à 160 px apprend à les imiter.
+# Les deux voient la même image augmentée (224 px pour le professeur, réduite à 160 px pour l'élève).
+# L'élève est exporté comme artefact, servi avec :
+#   PLANTDOC_ARTIFACT=plantdoc_student.pt uvicorn api:app
+#   (ou PLANTDOC_ARTIFACT=plantdoc_student.pt python serve.py --workers 2)
+#
+# Usage :
+#   python distill.py --arch mobilenet_v3_small --size 160 --epochs 20
+#   python distill.py --arch mobilenet_v2 --width 0.5 --size 160 --shards shards
+#   python distill.py --report-only --student plantdoc_student.pt
+
+STUDENT_ARCH = "mobilenet_v3_small"
+STUDENT_SIZE = 160
+STUDENT_OUTPUT = "plantdoc_student.pt"
+EPOCHS = 20
+LEARNING_RATE = 0.001
+TEMPERATURE = 4.0
+ALPHA = 0.7 # Poids de la perte de distillation (le reste : entropie croisée sur les vraies étiquettes)
+
+# Poids ImageNet disponibles dans torchvision pour l'initialisation de l'élève
+PRETRAINED = {
+    "mobilenet_v2": models.MobileNet_V2_Weights.DEFAULT,
+    "mobilenet_v3_small": models.MobileNet_V3_Small_Weights.DEFAULT,
+}
+
+def student_preprocess_meta(size):
+    """Même rapport resize/crop que le professeur (256/224), ex: 183/160."""
+    resize = round(size * PREPROCESS_META["resize"] / PREPROCESS_META["crop"])
+    return {**PREPROCESS_META, "resize": resize, "crop": size}
+
+def build_student(num_classes, arch, width_mult):
+    arch_params = {"width_mult": width_mult} if width_mult != 1.0 else {}
+    # Pas de poids ImageNet pour les largeurs réduites : entraînement depuis zéro, guidé par le professeur
+    weights = PRETRAINED.get(arch) if not arch_params else None
+    if weights is not None:
+        student = build_model(1000, arch, weights=weights)
+        head = student.classifier[-1]
+        student.classifier[-1] = nn.Linear(head.in_features, num_classes)
+    else:
+        student = build_model(num_classes, arch, **arch_params)
+    return student, arch_params
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=TEMPERATURE, alpha=ALPHA):
+    """Hinton et al. : KL entre distributions adoucies (x T²) + entropie croisée sur les étiquettes."""
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1), reduction="batchmean")
+    return alpha * temperature ** 2 * soft + (1 - alpha) * F.cross_entropy(student_logits, labels)
+
+def distill(arch=STUDENT_ARCH, width_mult=1.0, size=STUDENT_SIZE, epochs=EPOCHS, lr=LEARNING_RATE,
+            shard_dir=None, output_path=STUDENT_OUTPUT, bf16=BF16_MODE):
+    bf16 = use_bf16(bf16)
+    teacher, teacher_classes, teacher_path, _ = load_serving_model()
+    teacher.eval()
+    print(f"=== Distillation : professeur '{teacher_path}' -> élève {arch} x{width_mult} à {size} px ===")
+
+    if shard_dir:
+        dataloaders, class_names = get_shard_loaders(shard_dir, train_improved.BATCH_SIZE)
+    else:
+        dataloaders, class_names = train_improved.get_data_loaders()
+    if class_names != teacher_classes:
+        raise ValueError(f"Classes du dataset {class_names} différentes de celles du professeur {teacher_classes}")
+
+    student, arch_params = build_student(len(class_names), arch, width_mult)
+    optimizer = optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    best_acc = 0.0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        for phase in ['train', 'val']:
+            student.train(phase == 'train')
+            running_loss = 0.0
+            corrects = 0
+            agree = 0
+            seen = 0
+            for inputs, labels in dataloaders[phase]:
+                with torch.no_grad(), autocast(bf16):
+                    teacher_logits = teacher(inputs).float()
+                # Même recadrage, réduit à la résolution de l'élève
+                small = F.interpolate(inputs, size=(size, size), mode="bilinear", antialias=True, align_corners=False)
+
+                with torch.set_grad_enabled(phase == 'train'):
+                    with autocast(bf16):
+                        outputs = student(small)
+                        loss = distillation_loss(outputs.float(), teacher_logits, labels)
+                    if phase == 'train':
+                        optimizer.zero_grad()
+                        loss.backward()
+                        optimizer.step()
+
+                preds = outputs.argmax(dim=1)
+                running_loss += loss.item() * inputs.size(0)
+                corrects += int((preds == labels).sum())
+                agree += int((preds == teacher_logits.argmax(dim=1)).sum())
+                seen += inputs.size(0)
+
+            print(f"Epoch {epoch + 1}/{epochs} {phase} Loss: {running_loss / seen:.4f} Acc: {corrects / seen:.4f} "
+                  f"Accord professeur: {agree / seen:.4f}")
+
+            if phase == 'val' and corrects / seen > best_acc:
+                best_acc = corrects / seen
+                save_artifact(output_path, student.state_dict(), class_names, arch, arch_params,
+                              student_preprocess_meta(size), val_acc=best_acc, epoch=epoch + 1,
+                              source_path=teacher_path,
+                              temperature=TEMPERATURE, alpha=ALPHA)
+                print(f"🌟 Meilleur élève sauvegardé dans '{output_path}' (Précision: {best_acc:.4f})")
+        scheduler.step()
+        print(f"  ({time.perf_counter() - start:.1f}s)")
+
+    print(f"\n✅ Distillation terminée. Meilleure V-Acc de l'élève : {best_acc:.4f}.")
+    return output_path
+
+def evaluate_model(model, preprocess_meta, classes, data_dir):
+    """Top-1 sur data_dir avec le pré-traitement propre au modèle, plus les prédictions (ordre du dossier)."""
+    dataset = datasets.ImageFolder(data_dir, get_preprocess(preprocess_meta["resize"], preprocess_meta["crop"]))
+    to_model_idx = torch.tensor([classes.index(c) for c in dataset.classes])
+    loader = DataLoader(dataset, batch_size=64, shuffle=False, num_workers=2)
+    predictions = []
+    correct = 0
+    with torch.inference_mode():
+        for inputs, labels in loader:
+            preds = model(inputs).argmax(dim=1)
+            correct += int((preds == to_model_idx[labels]).sum())
+            predictions.append(preds)
+    return correct / max(len(dataset), 1), torch.cat(predictions)
+
+def report(student_path, data_dir, threads):
+    """Compare professeur et élève : précision, accord, taille, paramètres et latence CPU."""
+    if threads:
+        torch.set_num_threads(threads) # ex: 1 ou 2 pour simuler une passerelle ARM
+    teacher, classes, teacher_path, teacher_meta = load_serving_model()
+    student, student_classes, artifact = load_artifact(student_path)
+    if student_classes != classes:
+        raise ValueError(f"Classes de l'élève {student_classes} différentes de celles du professeur {classes}")
+
+    results = {}
+    teacher_preds = None
+    for name, model, meta, path in [("teacher", teacher, teacher_meta, teacher_path),
+                                    ("student", student, artifact["preprocess"], student_path)]:
+        accuracy, preds = evaluate_model(model, meta, classes, data_dir)
+        backend = load_backend("eager", model)
+        if teacher_preds is None:
+            teacher_preds = preds
+        results[name] = {
+            "path": path,
+            "input_size": meta["crop"],
+            "top1": round(accuracy, 4),
+            "agreement_with_teacher": round(float((preds == teacher_preds).float().mean()), 4),
+            "params_m": round(sum(p.numel() for p in model.parameters()) / 1e6, 2),
+            "file_mb": round(os.path.getsize(path) / 1e6, 2) if os.path.exists(path) else None,
+            "latency_ms_b1": round(measure_latency(backend, 1, input_size=meta["crop"]), 2),
+            "latency_ms_b8": round(measure_latency(backend, 8, input_size=meta["crop"]), 2),
+        }
+        r = results[name]
+        print(f"[{name:<7}] {r['input_size']} px  Top-1 {r['top1'] * 100:6.2f}%  accord {r['agreement_with_teacher'] * 100:6.2f}%  "
+              f"{r['params_m']:5.2f} M params  b1 {r['latency_ms_b1']:7.2f} ms  b8 {r['latency_ms_b8']:7.2f} ms")
+
+    speedup = results["teacher"]["latency_ms_b1"] / max(results["student"]["latency_ms_b1"], 1e-9)
+    print(f"\n=> Élève x{speedup:.1f} plus rapide (b1), "
+          f"{(results['student']['top1'] - results['teacher']['top1']) * 100:+.2f} pt de Top-1")
+    return {"threads": torch.get_num_threads(), "speedup_b1": round(speedup, 2), "models": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distillation du modèle servi vers un élève compact")
+    parser.add_argument("--arch", default=STUDENT_ARCH, choices=ARCHITECTURES)
+    parser.add_argument("--width", type=float, default=1.0, help="width_mult (MobileNetV2), ex: 0.5")
+    parser.add_argument("--size", type=int, default=STUDENT_SIZE, help="Taille d'entrée de l'élève")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--shards", default=None, help="Dossier de shards (voir shards.py)")
+    parser.add_argument("--bf16", default=BF16_MODE, choices=["auto", "1", "0"])
+    parser.add_argument("--student", default=STUDENT_OUTPUT, help="Artefact de l'élève")
+    parser.add_argument("--data-dir", default="data/val", help="Données du rapport")
+    parser.add_argument("--threads", type=int, default=0, help="Threads torch pour les mesures de latence (0 = défaut)")
+    parser.add_argument("--report-only", action="store_true")
+    parser.add_argument("--output", default="distill_report.json")
+    args = parser.parse_args()
+
+    if not args.report_only:
+        distill(args.arch, args.width, args.size, args.epochs, args.lr, args.shards, args.student, args.bf16)
+    results = report(args.student, args.data_dir, args.threads)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Rapport écrit dans {args.output}")
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import argparse
+import torch
+import torch.nn.functional as F
+from torchvision import datasets
+from torch.utils.data import DataLoader
+
+from imaging import get_preprocess
+from modeling import MODEL_PATH, CLASSES_PATH, ARTIFACT_PATH, load_serving_model
+from cache import model_version
+from backends import BACKENDS, load_backend
+
+# ==========================================
+# ÉVALUATION HORS-LIGNE (même modèle que l'API)
+# ==========================================
+# Évalue le modèle servi par l'API sur tout un dossier ImageFolder (data/val par défaut),
+# en lots et avec un DataLoader parallèle, sans passer par HTTP.
+# Usage : python evaluate.py --data-dir data/val --output eval_val.json
+
+UNCERTAIN_THRESHOLD = 0.50 # Même seuil que /predict
+
+def evaluate(data_dir, backend_name="eager", batch_size=64, num_workers=4, top_k=3,
+             model_path=MODEL_PATH, classes_path=CLASSES_PATH, bf16=False, artifact_path=ARTIFACT_PATH):
+    model, classes, model_path, preprocess_meta = load_serving_model(artifact_path=artifact_path, model_path=model_path,
+                                                                     classes_path=classes_path)
+    backend = load_backend(backend_name, model, version=model_version(model_path), bf16=bf16)
+
+    dataset = datasets.ImageFolder(data_dir, get_preprocess(preprocess_meta["resize"], preprocess_meta["crop"]))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    # Les indices d'ImageFolder (ordre alphabétique des dossiers) sont ramenés à ceux du modèle
+    missing = [c for c in dataset.classes if c not in classes]
+    if missing:
+        raise ValueError(f"Classes du dossier inconnues du modèle : {missing}")
+    to_model_idx = torch.tensor([classes.index(c) for c in dataset.classes])
+
+    n_classes = len(classes)
+    top_k = min(top_k, n_classes)
+    confusion = torch.zeros(n_classes, n_classes, dtype=torch.long)
+    top1 = 0
+    topk = 0
+    uncertain = 0
+    total = 0
+    inference_time = 0.0
+
+    start = time.perf_counter()
+    for inputs, labels in loader:
+        labels = to_model_idx[labels]
+
+        t0 = time.perf_counter()
+        probabilities = F.softmax(backend(inputs).float(), dim=1)
+        inference_time += time.perf_counter() - t0
+
+        confidence, preds = probabilities.max(dim=1)
+        top1 += int((preds == labels).sum())
+        topk += int((probabilities.topk(top_k, dim=1).indices == labels.unsqueeze(1)).any(dim=1).sum())
+        uncertain += int((confidence < UNCERTAIN_THRESHOLD).sum())
+        total += labels.numel()
+        confusion.index_put_((labels, preds), torch.ones_like(labels), accumulate=True)
+    elapsed = time.perf_counter() - start
+
+    per_class = {}
+    for i, name in enumerate(classes):
+        support = int(confusion[i].sum())
+        predicted = int(confusion[:, i].sum())
+        tp = int(confusion[i, i])
+        per_class[name] = {
+            "support": support,
+            "recall": round(tp / support, 4) if support else None,
+            "precision": round(tp / predicted, 4) if predicted else None,
+        }
+
+    return {
+        "data_dir": data_dir,
+        "model_path": model_path,
+        "model_version": model_version(model_path),
+        "backend": backend.name,
+        "images": total,
+        "top1": round(top1 / max(total, 1), 4),
+        f"top{top_k}": round(topk / max(total, 1), 4),
+        "uncertain_rate": round(uncertain / max(total, 1), 4),
+        "images_per_sec": round(total / elapsed, 1) if elapsed else None,
+        "inference_images_per_sec": round(total / inference_time, 1) if inference_time else None,
+        "classes": classes,
+        "confusion_matrix": confusion.tolist(), # lignes = vraie classe, colonnes = prédiction
+        "per_class": per_class,
+    }
+
+def print_report(results):
+    print(f"=== Évaluation sur {results['data_dir']} ({results['images']} images, backend {results['backend']}) ===")
+    for key in results:
+        if key.startswith("top"):
+            print(f"{key.capitalize():<10}: {results[key] * 100:.2f}%")
+    print(f"Incertain : {results['uncertain_rate'] * 100:.2f}% (confiance < {UNCERTAIN_THRESHOLD:.2f})")
+    print(f"Débit     : {results['images_per_sec']} img/s (inférence seule : {results['inference_images_per_sec']} img/s)")
+    print("\nMatrice de confusion (lignes = vraie classe) :")
+    width = max(len(c) for c in results["classes"])
+    for name, row in zip(results["classes"], results["confusion_matrix"]):
+        print(f"  {name:<{width}} " + " ".join(f"{v:5d}" for v in row))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Évaluation hors-ligne du modèle de l'API sur un dossier ImageFolder")
+    parser.add_argument("--data-dir", default="data/val")
+    parser.add_argument("--backend", default=os.environ.get("PLANTDOC_BACKEND", "eager"), choices=BACKENDS)
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--artifact", default=ARTIFACT_PATH, help="Artefact versionné (prioritaire s'il existe)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--bf16", action="store_true", help="Inférence sous autocast bfloat16 (eager / fused)")
+    parser.add_argument("--output", default=None, help="Fichier JSON de résultats")
+    args = parser.parse_args()
+
+    results = evaluate(args.data_dir, args.backend, args.batch_size, args.num_workers, args.top_k, args.model_path,
+                       bf16=args.bf16, artifact_path=args.artifact)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nRésultats écrits dans {args.output}")
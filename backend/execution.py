@@ -0,0 +1,102 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import torch
+
+# ==========================================
+# COUCHE D'EXÉCUTION (hors boucle asyncio)
+# ==========================================
+# Les étapes lourdes (décodage, pré-traitement, passe forward, Grad-CAM) ne doivent
+# jamais tourner directement dans la boucle d'uvicorn, sinon une seule Grad-CAM lente
+# bloque toutes les autres requêtes (y compris /chat).
+#
+# - Pool de threads : torch et OpenCV relâchent le GIL pendant leurs calculs.
+# - Pool de processus (optionnel) : pour le reste (décodage PIL + transforms).
+#
+# Budget de cœurs : PROCESS_WORKERS cœurs pour les processus (1 thread torch chacun),
+# le reste est partagé entre THREAD_WORKERS threads x TORCH_THREADS threads intra-op.
+
+CPU_COUNT = os.cpu_count() or 1
+PROCESS_WORKERS = int(os.environ.get("PLANTDOC_PROCESS_WORKERS", "0"))
+_THREAD_CORES = max(1, CPU_COUNT - PROCESS_WORKERS)
+THREAD_WORKERS = int(os.environ.get("PLANTDOC_THREAD_WORKERS", str(min(4, _THREAD_CORES))))
+TORCH_THREADS = int(os.environ.get("PLANTDOC_TORCH_THREADS", str(max(1, _THREAD_CORES // max(THREAD_WORKERS, 1)))))
+
+_thread_pool = None
+_process_pool = None
+_lanes = {}
+
+
+def _init_process_worker():
+    """Initialisation de chaque processus : un seul thread pour ne pas sur-souscrire les cœurs."""
+    torch.set_num_threads(1)
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+
+def start():
+    """Crée les pools et fixe le nombre de threads intra-op de torch."""
+    global _thread_pool, _process_pool
+    torch.set_num_threads(TORCH_THREADS)
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix="plantdoc-cpu")
+    if _process_pool is None and PROCESS_WORKERS > 0:
+        # "spawn" : pas de fork d'un processus qui a déjà lancé des threads torch
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+        )
+    print(f"Exécution : {THREAD_WORKERS} threads x {TORCH_THREADS} threads torch, {PROCESS_WORKERS} processus.")
+
+
+def shutdown():
+    global _thread_pool, _process_pool
+    for pool in _lanes.values():
+        pool.shutdown(wait=False)
+    _lanes.clear()
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
+
+
+def thread_pool():
+    if _thread_pool is None:
+        start()
+    return _thread_pool
+
+
+def lane(name, workers=1):
+    """
+    Pool de threads dédié et borné (ex: Grad-CAM), séparé du pool principal :
+    un travail lent sur cette voie ne peut pas occuper les threads de /predict.
+    """
+    if name not in _lanes:
+        _lanes[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"plantdoc-{name}")
+    return _lanes[name]
+
+
+async def run_in_thread(fn, *args, **kwargs):
+    """Exécute `fn` dans le pool de threads (torch / OpenCV)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(thread_pool(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_cpu_bound(fn, *args):
+    """
+    Exécute `fn` dans le pool de processus s'il est activé, sinon dans le pool de threads.
+    `fn` et ses arguments doivent être picklables (fonction définie au niveau d'un module).
+    """
+    if _process_pool is None:
+        return await run_in_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, fn, *args)
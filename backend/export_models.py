@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import argparse
+import statistics
+import torch
+from torchvision import datasets
+from torch.utils.data import DataLoader
+
+from imaging import get_preprocess
+from modeling import load_serving_model
+from cache import model_version
+from backends import (BACKENDS, EXPORT_DIR, EXPORT_FILES, MANIFEST_FILE, load_backend,
+                      quantize_static, freeze_torchscript, fuse_conv_bn)
+
+# Exporte chaque variante du modèle (INT8 statique, TorchScript figé, ONNX) dans EXPORT_DIR,
+# puis compare précision Top-1 et latence CPU de tous les backends à la référence fp32.
+# Usage : python export_models.py --data-dir data/val
+
+def export_all(model, export_dir, calib_loader, calib_batches, input_size):
+    os.makedirs(export_dir, exist_ok=True)
+
+    # 1. TorchScript figé (à partir du modèle fusionné Conv+BN)
+    path = os.path.join(export_dir, EXPORT_FILES["torchscript"])
+    torch.jit.save(freeze_torchscript(fuse_conv_bn(model), input_size=input_size), path)
+    print(f"TorchScript -> {path}")
+
+    # 2. INT8 statique (FX graph mode), calibré sur quelques lots
+    calibration = []
+    for inputs, _ in calib_loader:
+        calibration.append(inputs)
+        if len(calibration) >= calib_batches:
+            break
+    quantized = quantize_static(model, calibration)
+    path = os.path.join(export_dir, EXPORT_FILES["int8"])
+    torch.jit.save(freeze_torchscript(quantized, input_size=input_size), path)
+    print(f"INT8 ({len(calibration)} lots de calibration) -> {path}")
+
+    # 3. ONNX (axe batch dynamique)
+    path = os.path.join(export_dir, EXPORT_FILES["onnx"])
+    torch.onnx.export(
+        model, torch.randn(1, 3, input_size, input_size), path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+    print(f"ONNX -> {path}")
+
+def evaluate_backend(backend, loader, to_model_idx):
+    """Top-1 et prédictions ; `to_model_idx` traduit les étiquettes du dossier en indices du modèle."""
+    correct = 0
+    total = 0
+    predictions = []
+    for inputs, labels in loader:
+        preds = backend(inputs).argmax(dim=1)
+        correct += int((preds == to_model_idx[labels]).sum())
+        total += labels.numel()
+        predictions.append(preds)
+    return correct / max(total, 1), torch.cat(predictions) if predictions else torch.empty(0)
+
+def measure_latency(backend, batch_size, repeats=30, warmup=5, input_size=224):
+    batch = torch.randn(batch_size, 3, input_size, input_size)
+    for _ in range(warmup):
+        backend(batch)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend(batch)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(timings)
+
+def report(model, export_dir, loader, tolerance, input_size, to_model_idx):
+    results = {}
+    reference_preds = None
+    for name in BACKENDS:
+        try:
+            backend = load_backend(name, model, export_dir)
+        except (RuntimeError, FileNotFoundError) as e:
+            print(f"[{name}] ignoré : {e}")
+            continue
+
+        accuracy, preds = evaluate_backend(backend, loader, to_model_idx)
+        if reference_preds is None:
+            reference_preds = preds
+        results[name] = {
+            "top1": round(accuracy, 4),
+            "agreement_with_fp32": round(float((preds == reference_preds).float().mean()), 4),
+            "latency_ms_b1": round(measure_latency(backend, 1, input_size=input_size), 2),
+            "latency_ms_b8": round(measure_latency(backend, 8, input_size=input_size), 2),
+        }
+        print(f"[{name:<12}] Top-1 {accuracy * 100:6.2f}%  b1 {results[name]['latency_ms_b1']:7.2f} ms  "
+              f"b8 {results[name]['latency_ms_b8']:7.2f} ms")
+
+    baseline = results["eager"]["top1"]
+    for name, r in results.items():
+        r["top1_delta"] = round(r["top1"] - baseline, 4)
+        r["within_tolerance"] = baseline - r["top1"] <= tolerance
+
+    eligible = [n for n, r in results.items() if r["within_tolerance"]]
+    best = min(eligible, key=lambda n: results[n]["latency_ms_b8"])
+    print(f"\n=> Backend le plus rapide à moins de {tolerance * 100:.1f} pt de Top-1 : {best} (PLANTDOC_BACKEND={best})")
+    return results, best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export des variantes du modèle + rapport précision/latence")
+    parser.add_argument("--data-dir", default="data/val")
+    parser.add_argument("--calib-dir", default="data/val")
+    parser.add_argument("--calib-batches", type=int, default=10)
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--tolerance", type=float, default=0.005)
+    parser.add_argument("--skip-export", action="store_true", help="Rapport seulement (exports existants)")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model, classes, weights_path, preprocess_meta = load_serving_model()
+    preprocess = get_preprocess(preprocess_meta["resize"], preprocess_meta["crop"])
+    input_size = preprocess_meta["crop"]
+    dataset = datasets.ImageFolder(args.data_dir, preprocess)
+    # L'ordre des dossiers peut différer de celui de classes.txt : correspondance par nom de classe
+    to_model_idx = torch.tensor([classes.index(c) for c in dataset.classes])
+    loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=2)
+
+    if not args.skip_export:
+        calib_loader = DataLoader(datasets.ImageFolder(args.calib_dir, preprocess),
+                                  batch_size=args.batch_size, shuffle=True, num_workers=2)
+        export_all(model, args.export_dir, calib_loader, args.calib_batches, input_size)
+        with open(os.path.join(args.export_dir, MANIFEST_FILE), "w") as f:
+            json.dump({"model_version": model_version(weights_path)}, f)
+
+    results, best = report(model, args.export_dir, loader, args.tolerance, input_size, to_model_idx)
+    report_path = os.path.join(args.export_dir, "report.json")
+    with open(report_path, "w") as f:
+        json.dump({"model_version": model_version(weights_path), "tolerance": args.tolerance,
+                   "recommended": best, "backends": results}, f, indent=2)
+    print(f"Rapport écrit dans {report_path}")
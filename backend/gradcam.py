@@ -0,0 +1,55 @@
+import torch
+import torch.nn.functional as F
+
+
+def forward_with_cam(model, batch, with_cam=True, targets=None):
+    """
+    Passe forward MobileNetV2 avec capture des activations de `model.features`,
+    suivie (si `with_cam`) de la passe backward Grad-CAM sur ces mêmes activations.
+
+    Contrairement à `pytorch_grad_cam.GradCAM`, on ne refait pas de passe forward
+    pour trouver la classe prédite, et on ne pose aucun hook sur le modèle : la
+    fonction peut tourner en même temps que les passes du batcher.
+
+    - batch   : tenseur Bx3xHxW déjà sur le bon device
+    - targets : classe cible par image (None, ou None pour une image -> classe prédite)
+
+    Renvoie (probabilités BxC, heatmaps BxHxW normalisées dans [0, 1] ou None).
+    """
+    if not with_cam:
+        with torch.no_grad():
+            return F.softmax(model(batch), dim=1), None
+
+    with torch.enable_grad():
+        # Même enchaînement que MobileNetV2.forward, en gardant les activations
+        activations = model.features(batch)
+        pooled = torch.flatten(F.adaptive_avg_pool2d(activations, (1, 1)), 1)
+        logits = model.classifier(pooled)
+
+        predicted = logits.argmax(dim=1)
+        if targets is None:
+            targets = predicted
+        else:
+            targets = torch.tensor([int(p) if t is None else int(t) for t, p in zip(targets, predicted)],
+                                   device=logits.device)
+        targets = targets.view(-1, 1)
+
+        # Les images du lot sont indépendantes (BatchNorm en mode eval) : le gradient de la
+        # somme des scores cibles donne le gradient de chaque image par rapport à ses activations
+        score = logits.gather(1, targets).sum()
+        gradients, = torch.autograd.grad(score, activations)
+
+    probabilities = F.softmax(logits.detach(), dim=1)
+    activations = activations.detach()
+
+    # Grad-CAM : poids = moyenne spatiale des gradients, carte = ReLU(somme pondérée des activations)
+    weights = gradients.mean(dim=(2, 3), keepdim=True)
+    cams = F.relu((weights * activations).sum(dim=1))
+
+    # Normalisation min-max par image, puis mise à la taille de l'entrée
+    flat = cams.flatten(1)
+    cams = cams - flat.min(dim=1).values.view(-1, 1, 1)
+    cams = cams / (1e-7 + cams.flatten(1).max(dim=1).values.view(-1, 1, 1))
+    cams = F.interpolate(cams.unsqueeze(1), size=batch.shape[-2:], mode="bilinear", align_corners=False)
+
+    return probabilities, cams.squeeze(1).cpu().numpy()
@@ -0,0 +1,182 @@
+import io
+import os
+import math
+import time
+import functools
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+from torchvision.transforms import functional as TF
+
+from utils import is_array_blurry
+
+# Côté court après redimensionnement, puis taille du recadrage central (entrée du modèle)
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+
+# Décodage JPEG à résolution réduite (mise à l'échelle dans le domaine DCT).
+# Le contrôle du flou ne dépend pas de ce mode : il porte toujours sur l'image ramenée au
+# côté court du pré-traitement (256 px), que l'on parte de l'image complète ou de sa version
+# réduite par draft().
+FAST_DECODE = os.environ.get("PLANTDOC_FAST_DECODE", "1") == "1"
+
+# Le seuil de flou est exprimé à la résolution d'origine (utils.is_image_blurry) ; réduire une
+# image augmente la variance du Laplacien. Sur l'image de travail, le seuil est donc multiplié
+# par (côté court d'origine / côté court de travail) ** BLUR_SCALE_EXPONENT.
+# Exposant calibré par `python check_decode_parity.py --upscale 8` (accord avec la référence).
+BLUR_SCALE_EXPONENT = float(os.environ.get("PLANTDOC_BLUR_SCALE_EXPONENT", "2.0"))
+
+@functools.lru_cache(maxsize=None)
+def get_preprocess(resize: int = RESIZE_SIZE, crop: int = CROP_SIZE):
+    """Pré-traitement d'évaluation pour une taille d'entrée donnée (ex: 183/160 pour un modèle distillé)."""
+    return transforms.Compose([
+        transforms.Resize(resize),
+        transforms.CenterCrop(crop),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+
+# Pré-traitement identique à l'entraînement (sans data-augmentation)
+preprocess = get_preprocess(RESIZE_SIZE, CROP_SIZE)
+
+
+def open_image(image_bytes: bytes, fast: bool = FAST_DECODE, resize: int = RESIZE_SIZE) -> Image.Image:
+    """
+    Décode les bytes d'un upload en image PIL RGB.
+
+    En mode rapide, un JPEG est décodé directement à l'échelle 1/2, 1/4 ou 1/8
+    (la plus petite dont le côté court reste >= `resize`) grâce à `draft()` :
+    libjpeg saute une partie de l'IDCT, ce qui réduit le temps de décodage et la
+    mémoire d'une photo de téléphone de 12 MP. `Resize` termine ensuite le travail.
+    """
+    return _open_image(image_bytes, fast, resize)[0]
+
+
+def _open_image(image_bytes, fast, resize):
+    """open_image() et la taille d'origine de l'image (avant draft())."""
+    image = Image.open(io.BytesIO(image_bytes))
+    original_size = image.size
+    if fast and image.format == "JPEG":
+        width, height = image.size
+        scale = resize / min(width, height)
+        if scale <= 0.5:
+            # draft() choisit la plus forte réduction qui garde au moins cette taille
+            image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+    return image.convert("RGB"), original_size
+
+
+def blur_threshold_at(threshold: float, scale: float, exponent: float = BLUR_SCALE_EXPONENT) -> float:
+    """Seuil de flou (réglé à la résolution d'origine) pour une image réduite d'un facteur `scale` >= 1."""
+    return threshold * max(scale, 1.0) ** exponent
+
+
+class DecodedImage:
+    """
+    Upload décodé une seule fois puis partagé par toutes les étapes d'une requête :
+    contrôle du flou (tableau RGB uint8), classification (tenseur 3x224x224)
+    et superposition Grad-CAM (RGB float 224x224). Toutes partent de la même image
+    de travail, ramenée au côté court `resize` (un seul redimensionnement).
+
+    Les dérivés sont calculés à la demande puis mis en cache sur l'objet, et la durée
+    de chaque étape est notée dans `timings` (secondes), y compris dans un autre processus.
+    `input_size` = (resize, crop) du modèle servi, (RESIZE_SIZE, CROP_SIZE) par défaut.
+    """
+
+    def __init__(self, image: Image.Image, input_size=None, original_size=None):
+        self.image = image
+        self.original_size = tuple(original_size or image.size) # Avant draft() : échelle du seuil de flou
+        self.input_size = tuple(input_size or (RESIZE_SIZE, CROP_SIZE))
+        self.blurry = None
+        self._working = None
+        self._rgb = None
+        self._tensor = None
+        self._overlay = None
+        self.timings = {}
+
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes, input_size=None, fast: bool = FAST_DECODE):
+        start = time.perf_counter()
+        resize = input_size[0] if input_size else RESIZE_SIZE
+        image, original_size = _open_image(image_bytes, fast, resize)
+        decoded = cls(image, input_size, original_size)
+        decoded.timings["decode"] = time.perf_counter() - start
+        return decoded
+
+    @property
+    def working(self) -> Image.Image:
+        """
+        Image ramenée au côté court `resize`, exactement comme le Resize du pré-traitement.
+        Même taille quel que soit le décodage (draft() garde un côté court >= `resize`) :
+        le contrôle du flou donne la même réponse en mode rapide et en décodage complet.
+        """
+        if self._working is None:
+            resize = self.input_size[0]
+            self._working = TF.resize(self.image, resize) if min(self.image.size) > resize else self.image
+        return self._working
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Image de travail en RGB uint8 (HxWx3), voir `working`."""
+        if self._rgb is None:
+            self._rgb = np.asarray(self.working)
+        return self._rgb
+
+    @property
+    def tensor(self):
+        """Tenseur normalisé 3xCxC (224 par défaut) prêt pour le modèle."""
+        if self._tensor is None:
+            start = time.perf_counter()
+            self._tensor = get_preprocess(*self.input_size)(self.working)
+            self.timings["preprocess"] = time.perf_counter() - start
+        return self._tensor
+
+    @property
+    def overlay(self) -> np.ndarray:
+        """Image RGB float32 dans [0, 1] à la taille de l'entrée du modèle, pour show_cam_on_image."""
+        if self._overlay is None:
+            crop = self.input_size[1]
+            self._overlay = np.float32(self.working.resize((crop, crop))) / 255
+        return self._overlay
+
+    @property
+    def scale(self) -> float:
+        """Facteur de réduction entre l'image d'origine et l'image de travail (côtés courts)."""
+        return min(self.original_size) / min(self.working.size)
+
+    def is_blurry(self, threshold: float = 100.0) -> bool:
+        """`threshold` est le seuil à la résolution d'origine, ajusté à celle de l'image de travail."""
+        if self.blurry is None:
+            start = time.perf_counter()
+            self.blurry = is_array_blurry(self.rgb, blur_threshold_at(threshold, self.scale))
+            self.timings["blur_check"] = time.perf_counter() - start
+        return self.blurry
+
+    def __getstate__(self):
+        # Le tableau RGB complet se recalcule depuis l'image : inutile de le copier entre processus.
+        # Une fois le tenseur (et la superposition) calculés, ou l'image jugée floue, l'image PIL
+        # elle-même ne sert plus : on ne renvoie pas ses pixels (~36 Mo pour un PNG de 12 MP).
+        state = self.__dict__.copy()
+        state["_rgb"] = None
+        if self._tensor is not None or self.blurry:
+            state["image"] = None
+            state["_working"] = None
+        return state
+
+
+# Fonction définie au niveau du module pour pouvoir être exécutée
+# dans le pool de processus (voir execution.py).
+
+def decode_upload(image_bytes: bytes, blur_threshold: float = None, with_overlay: bool = False,
+                  input_size=None) -> DecodedImage:
+    """
+    Décode un upload et prépare d'un coup tout ce dont la requête aura besoin.
+    Si `blur_threshold` est fourni, le contrôle du flou est fait et le tenseur
+    n'est calculé que pour une image nette.
+    """
+    decoded = DecodedImage.from_bytes(image_bytes, input_size)
+    if blur_threshold is not None and decoded.is_blurry(blur_threshold):
+        return decoded
+    decoded.tensor
+    if with_overlay:
+        decoded.overlay
+    return decoded
@@ -0,0 +1,322 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from sessions import PROMPT_TOKEN_BUDGET, estimate_tokens
+
+# ==========================================
+# CLIENT LLM DU CHATBOT (/chat)
+# ==========================================
+# Un seul client par processus, créé au démarrage de l'API :
+#   - backend Gemini asynchrone (generate_content_async) : le canal gRPC du SDK est ouvert
+#     une fois puis réutilisé, la boucle d'événements n'est jamais bloquée par un aller-retour
+#   - délai max par appel (attente du limiteur comprise) et nombre d'appels simultanés borné
+#   - cache des réponses à TTL, indexé par la question normalisée (casse, accents, ponctuation) :
+#     "Comment traiter le mildiou ?" et "comment traiter le Mildiou" partagent la même réponse
+#   - backend "local" : réponse simulée sans réseau, pour les tests de charge (bench_api.py)
+#   - streaming (/chat/stream) : les morceaux de texte sont relayés dès leur arrivée ; le délai
+#     s'applique alors à l'attente de chaque morceau, et la réponse complète rejoint le cache
+#   - sessions (sessions.py) : dernier diagnostic et historique borné ajoutés à la conversation ;
+#     le prompt système, construit une fois, est passé en `system_instruction` du modèle
+#     (préfixe identique d'une requête à l'autre) ; son nombre de tokens est compté une fois, en
+#     tâche de fond à la première question et avec un délai max (estimation locale en attendant),
+#     puis déduit du budget de tokens du prompt laissé à l'historique (sessions.PROMPT_TOKEN_BUDGET).
+#     Une question posée dans une session avec contexte ne passe pas par le cache.
+# Backend choisi par PLANTDOC_LLM_BACKEND (gemini, local).
+
+LLM_BACKEND = os.environ.get("PLANTDOC_LLM_BACKEND", "gemini")
+LLM_MODEL = os.environ.get("PLANTDOC_LLM_MODEL", "gemini-2.5-flash") # La clé API ne supporte que les derniers modèles
+LLM_TIMEOUT_S = float(os.environ.get("PLANTDOC_LLM_TIMEOUT_S", "20"))
+COUNT_TOKENS_TIMEOUT_S = float(os.environ.get("PLANTDOC_LLM_COUNT_TOKENS_TIMEOUT_S", "5"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("PLANTDOC_LLM_MAX_CONCURRENCY", "8"))
+LLM_CACHE_SIZE = int(os.environ.get("PLANTDOC_LLM_CACHE_SIZE", "512")) # 0 = désactivé
+LLM_CACHE_TTL_S = float(os.environ.get("PLANTDOC_LLM_CACHE_TTL_S", "3600"))
+LOCAL_LATENCY_MS = float(os.environ.get("PLANTDOC_LLM_LOCAL_LATENCY_MS", "50"))
+LOCAL_TOKEN_MS = float(os.environ.get("PLANTDOC_LLM_LOCAL_TOKEN_MS", "15")) # Délai entre deux morceaux en streaming
+
+# Le System Prompt pour forcer l'IA à rester dans son rôle
+SYSTEM_PROMPT = (
+    "Tu es 'Dr Plant', un expert agronome et botaniste. "
+    "Ton but est d'aider les utilisateurs avec leurs plantes de manière chaleureuse, courte et concise ("
+    "maximum 3 phrases). N'utilise jamais de markdown complexe, garde le texte pur. "
+    "Si la question ne concerne pas du tout la nature, les plantes ou l'agriculture, dis poliment que tu n'es qu'un expert végétal."
+)
+
+
+def build_contents(message: str, session=None, system_tokens=0):
+    """
+    Conversation envoyée au LLM (le prompt système, de `system_tokens` tokens, est à part) :
+    historique de la session dans ce qui reste du budget de tokens du prompt, puis la question ;
+    le dernier diagnostic précède le premier message.
+    """
+    contents = []
+    context = session.diagnosis_context() if session is not None else None
+    if session is not None:
+        budget = PROMPT_TOKEN_BUDGET - system_tokens - estimate_tokens(message)
+        if context:
+            budget -= estimate_tokens(context)
+        for question, answer in session.history(max(budget, 0)):
+            contents.append({"role": "user", "parts": [question]})
+            contents.append({"role": "model", "parts": [answer]})
+    contents.append({"role": "user", "parts": [message]})
+    if context:
+        contents[0]["parts"].insert(0, context)
+    return contents
+
+
+def clean_text(text: str) -> str:
+    # Nettoyage basique du markdown ; caractère par caractère, donc applicable morceau par morceau
+    return text.replace('*', '')
+
+
+def normalize_question(message: str) -> str:
+    """Clé de cache : minuscules, sans accents ni ponctuation, espaces réduits."""
+    text = unicodedata.normalize("NFKD", message.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+class GeminiBackend:
+    """
+    Google Gemini : le SDK (import lent) et le modèle sont créés une fois, à la première connexion,
+    toujours hors de la boucle d'événements (préchauffage ou première question, sous verrou).
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name=LLM_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.system_tokens = estimate_tokens(SYSTEM_PROMPT) # Remplacé par le compte exact (count_tokens)
+        self._model = None
+        self._lock = threading.Lock()
+        self._count_task = None
+
+    def connect(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is not None:
+                return self._model # Connecté entre-temps par un autre thread
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            # Aucun appel réseau ici : connect() fait partie du préchauffage, donc de /ready
+            self._model = genai.GenerativeModel(self.model_name, system_instruction=SYSTEM_PROMPT)
+        return self._model
+
+    async def _count_system_tokens(self):
+        import google.generativeai as genai
+        loop = asyncio.get_running_loop()
+        count = lambda: genai.GenerativeModel(self.model_name).count_tokens(SYSTEM_PROMPT).total_tokens
+        try:
+            self.system_tokens = await asyncio.wait_for(loop.run_in_executor(None, count), COUNT_TOKENS_TIMEOUT_S)
+        except Exception as e:
+            print(f"Info : comptage des tokens du prompt système indisponible ({e!r}), estimation conservée.")
+
+    async def _connected(self):
+        model = self._model
+        if model is None:
+            model = await asyncio.get_running_loop().run_in_executor(None, self.connect)
+        if self._count_task is None:
+            # Compte exact à la première question, en tâche de fond : la réponse ne l'attend pas
+            self._count_task = asyncio.create_task(self._count_system_tokens())
+        return model
+
+    async def generate(self, contents):
+        model = await self._connected()
+        response = await model.generate_content_async(contents)
+        return response.text
+
+    async def stream(self, contents):
+        model = await self._connected()
+        response = await model.generate_content_async(contents, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+class LocalBackend:
+    """Remplaçant hors ligne : latence simulée et réponse fixe (tests de charge, développement sans clé)."""
+
+    name = "local"
+    RESPONSE = "Réponse simulée du *Dr Plant*."
+
+    def __init__(self, latency_ms=LOCAL_LATENCY_MS, token_ms=LOCAL_TOKEN_MS):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.system_tokens = estimate_tokens(SYSTEM_PROMPT)
+
+    def connect(self):
+        pass
+
+    async def generate(self, contents):
+        await asyncio.sleep(self.latency_ms / 1000.0) # Latence d'un aller-retour LLM
+        return self.RESPONSE
+
+    async def stream(self, contents):
+        await asyncio.sleep(self.latency_ms / 1000.0) # Délai avant le premier morceau
+        for i, word in enumerate(self.RESPONSE.split(" ")):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000.0)
+            yield word if i == 0 else f" {word}"
+
+
+BACKENDS = {"gemini": GeminiBackend, "local": LocalBackend}
+
+
+class ChatClient:
+    """Appels LLM bornés (délai, concurrence) avec cache TTL des réponses par question normalisée."""
+
+    def __init__(self, backend, timeout_s=LLM_TIMEOUT_S, max_concurrency=LLM_MAX_CONCURRENCY,
+                 cache_size=LLM_CACHE_SIZE, cache_ttl_s=LLM_CACHE_TTL_S, on_first_token=None):
+        self.backend = backend
+        self.timeout_s = timeout_s
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self.cache_ttl_s = cache_ttl_s
+        self.on_first_token = on_first_token # on_first_token(secondes) : ex. histogramme Prometheus
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._cache = OrderedDict() # question normalisée -> (expiration, réponse)
+        self._in_flight = 0
+
+        # Compteurs (lus par /stats)
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def ask(self, message: str, session=None) -> str:
+        """
+        Réponse nettoyée à `message`, dans le contexte de `session` (l'appelant enregistre l'échange,
+        voir SessionStore.add_turn) ; lève asyncio.TimeoutError ou l'erreur du backend.
+        """
+        key = self._cache_key(message, session)
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        try:
+            text = await asyncio.wait_for(self._generate(build_contents(message, session, self.backend.system_tokens)), self.timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        text = clean_text(text)
+        self._cache_put(key, text)
+        return text
+
+    async def stream(self, message: str, session=None):
+        """
+        Morceaux nettoyés de la réponse, relayés dès leur arrivée (un seul morceau si elle est en cache).
+        Lève asyncio.TimeoutError si le limiteur ou un morceau se fait attendre plus de `timeout_s`.
+        """
+        key = self._cache_key(message, session)
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.hits += 1
+            yield cached
+            return
+        self.misses += 1
+
+        start = time.perf_counter()
+        parts = []
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout_s)
+            self._in_flight += 1
+            chunks = self.backend.stream(build_contents(message, session, self.backend.system_tokens))
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout_s)
+                    except StopAsyncIteration:
+                        break
+                    text = clean_text(chunk or "")
+                    if not text:
+                        continue
+                    if not parts and self.on_first_token is not None:
+                        self.on_first_token(time.perf_counter() - start)
+                    parts.append(text)
+                    yield text
+            finally:
+                # Aussi à la déconnexion du client : la requête au LLM est abandonnée
+                self._in_flight -= 1
+                self._semaphore.release()
+                await chunks.aclose()
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        self._cache_put(key, "".join(parts))
+
+    @staticmethod
+    def _cache_key(message, session):
+        # La réponse dépend du contexte de la session : pas de cache partagé dans ce cas
+        return None if session is not None and session.has_context else normalize_question(message)
+
+    async def _generate(self, contents):
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                return await self.backend.generate(contents)
+            finally:
+                self._in_flight -= 1
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return text
+
+    def _cache_put(self, key, text):
+        if key is None or self.cache_size <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl_s, text)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "system_prompt_tokens": self.backend.system_tokens,
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "cache_entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+def create_client(backend_name=LLM_BACKEND, api_key=None, on_first_token=None):
+    """
+    Client du backend `backend_name`, ou None si Gemini est choisi sans GEMINI_API_KEY
+    (l'API répond alors par un message de démonstration).
+    """
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Backend LLM inconnu '{backend_name}'. Choix possibles : {', '.join(BACKENDS)}")
+    if backend_name == "gemini":
+        api_key = api_key if api_key is not None else os.environ.get("GEMINI_API_KEY", "")
+        if not api_key:
+            return None
+        return ChatClient(GeminiBackend(api_key), on_first_token=on_first_token)
+    return ChatClient(BACKENDS[backend_name](), on_first_token=on_first_token)
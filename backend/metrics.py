@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ==========================================
+# MÉTRIQUES (format texte Prometheus, sans dépendance)
+# ==========================================
+# Compteurs et histogrammes légers (un verrou par métrique, quelques opérations par
+# observation), exposés sur /metrics. Les durées d'étapes d'une requête peuvent aussi
+# être renvoyées dans un en-tête `Server-Timing` (PLANTDOC_SERVER_TIMING=1).
+
+SERVER_TIMING = os.environ.get("PLANTDOC_SERVER_TIMING", "0") == "1"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        `collector()` renvoie des métriques calculées au moment du scrape (ex: stats du cache).
+        Sans effet si `collector` est déjà enregistré (ex: load_model() appelé une seconde fois).
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for collector in self._collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "plantdoc_stage_seconds", "Durée de chaque étape du traitement d'une requête.", ["endpoint", "stage"]))
+PREDICTIONS = REGISTRY.register(Counter(
+    "plantdoc_predictions_total", "Diagnostics renvoyés, par statut et classe prédite.",
+    ["endpoint", "status", "predicted_class"]))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "plantdoc_inference_batch_size", "Nombre d'images par passe forward.", ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "plantdoc_model_load_seconds", "Durée du chargement du modèle au démarrage."))
+WARMUP_SECONDS = REGISTRY.register(Gauge(
+    "plantdoc_warmup_seconds", "Durée du préchauffage (passes factices) avant que /ready réponde 200."))
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "plantdoc_chat_requests_total", "Réponses de /chat par statut (success, timeout, error).", ["status"]))
+CHAT_TTFT_SECONDS = REGISTRY.register(Histogram(
+    "plantdoc_chat_time_to_first_token_seconds",
+    "Délai avant le premier morceau de réponse du LLM sur /chat/stream (hors réponses en cache).",
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)))
+CASCADE_IMAGES = REGISTRY.register(Counter(
+    "plantdoc_cascade_images_total", "Images classées par la cascade, par étage final (fast ou escalated).",
+    ["stage"]))
+
+
+# --- Durées par requête (pour Server-Timing) ---
+_request_timings = contextvars.ContextVar("plantdoc_request_timings", default=None)
+
+
+def record_stage(endpoint, stage, seconds):
+    STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def stage(endpoint, name):
+    """Mesure la durée du bloc comme étape `name` de `endpoint`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(endpoint, name, time.perf_counter() - start)
+
+
+class ServerTimingMiddleware:
+    """
+    Middleware ASGI : collecte les étapes de la requête et les ajoute dans l'en-tête
+    `Server-Timing` (durées en ms), lisible par le frontend via l'API Performance.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                entries = [f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in timings]
+                entries.append(f"total;dur={(time.perf_counter() - start) * 1000.0:.2f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode("latin-1")))
+                headers.append((b"timing-allow-origin", b"*"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
@@ -0,0 +1,242 @@
+import os
+import time
+import pickle
+import torch
+import torch.nn as nn
+from torchvision import models
+from torchvision.models.mobilenetv2 import InvertedResidual
+
+from imaging import RESIZE_SIZE, CROP_SIZE
+from backends import fuse_conv_bn
+from cache import model_version
+
+# Chemins par défaut (relatifs au dossier backend)
+MODEL_PATH = "plantdoc_mobilenetv2.pth"
+CLASSES_PATH = "classes.txt"
+
+# Artefact versionné exporté par train.py et train_improved.py : poids + classes + pré-traitement,
+# chargé en une seule lecture. Prioritaire sur le couple MODEL_PATH / CLASSES_PATH.
+# Chaque artefact note l'empreinte du fichier de poids dont il est dérivé (`source_version`) :
+#   - artefact par défaut, exporté depuis MODEL_PATH : s'il ne correspond plus à MODEL_PATH
+#     (poids réentraînés sans export), il est périmé et MODEL_PATH + CLASSES_PATH sont servis
+#   - artefact choisi par PLANTDOC_ARTIFACT (élève distillé, modèle élagué) : toujours servi,
+#     avec un avertissement si sa source a changé depuis l'export
+DEFAULT_ARTIFACT_PATH = "plantdoc_model.pt"
+ARTIFACT_PATH = os.environ.get("PLANTDOC_ARTIFACT", DEFAULT_ARTIFACT_PATH)
+ARTIFACT_FORMAT = "plantdoc-artifact"
+ARTIFACT_VERSION = 1
+
+# Lecture des poids en mémoire mappée (torch.load(mmap=True)) : les pages ne sont lues qu'à
+# l'usage et partagées avec le cache disque de l'OS, au lieu d'une copie complète en RAM
+MMAP_WEIGHTS = os.environ.get("PLANTDOC_MMAP_WEIGHTS", "1") == "1"
+
+# Pré-traitement attendu par le modèle (identique à imaging.preprocess)
+PREPROCESS_META = {
+    "resize": RESIZE_SIZE,
+    "crop": CROP_SIZE,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+# Fallback pour la démo si non entraîné
+DEFAULT_CLASSES = ["Tomato_healthy", "Tomato_Late_blight", "Tomato_Early_blight", "Potato_healthy", "Potato_Late_blight", "Tomato_Leaf_Mold"]
+
+def load_classes(classes_path: str = CLASSES_PATH) -> list:
+    """Lit la liste des classes écrite par l'entraînement (une par ligne)."""
+    if os.path.exists(classes_path):
+        with open(classes_path, "r") as f:
+            return [line.strip() for line in f.readlines()]
+    print("Info : Utilisation des classes par défaut.")
+    return list(DEFAULT_CLASSES)
+
+# Architectures servables (toutes exposent .features puis .classifier, comme l'attend gradcam.py)
+ARCHITECTURES = ("mobilenet_v2", "mobilenet_v3_small")
+
+def build_model(num_classes: int, arch: str = "mobilenet_v2", weights=None, hidden_widths=None, fused=False,
+                **arch_params):
+    """
+    Architecture `arch` avec un classifieur à `num_classes` sorties (sans poids par défaut).
+    `arch_params` : ex. width_mult=0.5 pour un MobileNetV2 réduit.
+    `hidden_widths` / `fused` : structure d'un MobileNetV2 élagué puis fusionné par prune.py.
+    """
+    if arch == "mobilenet_v2":
+        model = models.mobilenet_v2(weights=weights, **arch_params)
+        model.classifier[1] = torch.nn.Linear(model.last_channel, num_classes)
+        if hidden_widths is not None:
+            prune_hidden_channels(model, [torch.arange(width) for width in hidden_widths])
+        if fused:
+            model = fuse_conv_bn(model)
+    elif arch == "mobilenet_v3_small":
+        model = models.mobilenet_v3_small(weights=weights, **arch_params)
+        model.classifier[3] = torch.nn.Linear(model.classifier[3].in_features, num_classes)
+    else:
+        raise ValueError(f"Architecture inconnue '{arch}'. Choix possibles : {', '.join(ARCHITECTURES)}")
+    return model
+
+# --- Élagage structuré des blocs inverted-residual (voir prune.py) ---
+
+def expansion_blocks(model):
+    """Blocs MobileNetV2 avec couche d'expansion : conv 1x1 -> depthwise 3x3 -> projection 1x1."""
+    return [block for block in model.features if isinstance(block, InvertedResidual) and len(block.conv) == 4]
+
+def _slice_conv(conv, out_idx=None, in_idx=None):
+    weight = conv.weight.data
+    if out_idx is not None:
+        weight = weight[out_idx]
+    depthwise = conv.groups > 1 and conv.groups == conv.in_channels
+    if in_idx is not None and not depthwise:
+        weight = weight[:, in_idx]
+    out_channels = weight.shape[0]
+    in_channels = out_channels if depthwise else weight.shape[1]
+    sliced = nn.Conv2d(in_channels, out_channels, conv.kernel_size, conv.stride, conv.padding,
+                       groups=out_channels if depthwise else 1, bias=conv.bias is not None)
+    sliced.weight.data.copy_(weight)
+    if conv.bias is not None:
+        sliced.bias.data.copy_(conv.bias.data[out_idx] if out_idx is not None else conv.bias.data)
+    return sliced
+
+def _slice_bn(bn, idx):
+    sliced = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum)
+    for name in ("weight", "bias", "running_mean", "running_var"):
+        getattr(sliced, name).data.copy_(getattr(bn, name).data[idx])
+    return sliced
+
+def prune_hidden_channels(model, keep):
+    """
+    Ne garde, dans chaque bloc d'expansion, que les canaux cachés d'indices `keep[i]` :
+    sorties de l'expansion (+ BN), depthwise (+ BN) et entrées de la projection.
+    Les dimensions entre blocs (donc les connexions résiduelles) ne changent pas.
+    """
+    for block, idx in zip(expansion_blocks(model), keep):
+        expand, depthwise = block.conv[0], block.conv[1]
+        expand[0] = _slice_conv(expand[0], out_idx=idx)
+        expand[1] = _slice_bn(expand[1], idx)
+        depthwise[0] = _slice_conv(depthwise[0], out_idx=idx)
+        depthwise[1] = _slice_bn(depthwise[1], idx)
+        block.conv[2] = _slice_conv(block.conv[2], in_idx=idx)
+    return model
+
+def hidden_widths(model):
+    return [block.conv[0][0].out_channels for block in expansion_blocks(model)]
+
+def read_weights(path: str, device=torch.device("cpu")):
+    """torch.load en mémoire mappée si possible (fichiers au format zip, torch >= 2.1), sinon lecture complète."""
+    if MMAP_WEIGHTS and torch.device(device).type == "cpu":
+        try:
+            return torch.load(path, map_location=device, mmap=True, weights_only=True)
+        except (TypeError, RuntimeError, pickle.UnpicklingError) as e:
+            print(f"Info : lecture mmap impossible pour '{path}' ({e}), lecture complète.")
+    return torch.load(path, map_location=device)
+
+def instantiate(build, state_dict, device=torch.device("cpu")):
+    """
+    Construit le modèle sur le device 'meta' (aucune initialisation aléatoire des poids, qui
+    seraient aussitôt écrasés) puis y attache directement les tenseurs lus (assign=True).
+    """
+    try:
+        with torch.device("meta"):
+            model = build()
+        model.load_state_dict(state_dict, assign=True)
+        model.requires_grad_(True) # Grad-CAM dérive les activations : les poids doivent rester dans le graphe
+    except (TypeError, RuntimeError, AttributeError):
+        model = build()
+        model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval() # Mode inférence
+    return model
+
+def load_trained_model(num_classes: int, model_path: str = MODEL_PATH, device=torch.device("cpu")):
+    """Construit le modèle, charge les poids entraînés (si disponibles) et le passe en mode inférence."""
+    if not os.path.exists(model_path):
+        print("ATTENTION : Fichier de poids '.pth' non trouvé. Le modèle fera des prédictions aléatoires.")
+        model = build_model(num_classes).to(device)
+        model.eval()
+        return model
+    model = instantiate(lambda: build_model(num_classes), read_weights(model_path, device), device)
+    print(f"Modèle chargé avec succès sur {device}.")
+    return model
+
+def save_atomic(obj, path: str):
+    """torch.save dans un fichier temporaire puis renommage : jamais de fichier à moitié écrit."""
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def artifact_path_for(weights_path: str) -> str:
+    """Artefact exporté à côté d'un fichier de poids (ex: runs/a/best.pth -> runs/a/plantdoc_model.pt)."""
+    return os.path.join(os.path.dirname(weights_path), DEFAULT_ARTIFACT_PATH)
+
+def save_artifact(path: str, state_dict, classes: list, arch: str = "mobilenet_v2", arch_params=None,
+                  preprocess=None, source_path=None, **metadata):
+    """
+    Exporte un artefact autonome : poids, classes, architecture et pré-traitement.
+    `source_path` : fichier de poids dont l'artefact est dérivé (empreinte vérifiée au chargement).
+    """
+    if source_path:
+        metadata.update(source=source_path, source_version=model_version(source_path))
+    artifact = {
+        "format": ARTIFACT_FORMAT,
+        "format_version": ARTIFACT_VERSION,
+        "arch": arch,
+        "arch_params": dict(arch_params or {}),
+        "classes": list(classes),
+        "preprocess": dict(preprocess or PREPROCESS_META),
+        "state_dict": state_dict,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "metadata": metadata,
+    }
+    save_atomic(artifact, path)
+    return artifact
+
+def load_artifact(path: str, device=torch.device("cpu")):
+    """Lit un artefact exporté par save_artifact(). Renvoie (modèle en mode inférence, classes, artefact)."""
+    artifact = read_weights(path, device)
+    if not isinstance(artifact, dict) or artifact.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"'{path}' n'est pas un artefact PlantDoc.")
+    if artifact["format_version"] > ARTIFACT_VERSION:
+        raise ValueError(f"Artefact '{path}' en version {artifact['format_version']}, non supportée par ce code.")
+
+    model = instantiate(lambda: build_model(len(artifact["classes"]), artifact["arch"], **artifact.get("arch_params", {})),
+                        artifact["state_dict"], device)
+    print(f"Artefact '{path}' chargé ({artifact['arch']} {artifact.get('arch_params') or ''}, "
+          f"entrée {artifact['preprocess']['crop']} px, {len(artifact['classes'])} classes, {artifact['created']}).")
+    return model, artifact["classes"], artifact
+
+def _source_changed(artifact, source_path=None):
+    """
+    L'artefact ne correspond-il plus à sa source (`source_path`, par défaut celle notée à l'export) ?
+    None si on ne peut pas le savoir (source absente ou non notée).
+    """
+    metadata = artifact.get("metadata", {})
+    source_path = source_path or metadata.get("source")
+    if not source_path or not os.path.exists(source_path) or "source_version" not in metadata:
+        return None
+    return model_version(source_path) != metadata["source_version"]
+
+def load_serving_model(device=torch.device("cpu"), artifact_path: str = ARTIFACT_PATH,
+                       model_path: str = MODEL_PATH, classes_path: str = CLASSES_PATH):
+    """
+    Modèle servi par l'API : l'artefact s'il existe, sinon les poids + classes.txt historiques.
+    L'artefact par défaut est ignoré s'il est périmé par rapport à `model_path` (voir ARTIFACT_PATH).
+    Renvoie (modèle, classes, chemin du fichier de poids lu pour la version du cache,
+    métadonnées de pré-traitement {resize, crop, mean, std}).
+    """
+    if artifact_path and os.path.exists(artifact_path):
+        model, classes, artifact = load_artifact(artifact_path, device)
+        if os.path.abspath(artifact_path) != os.path.abspath(DEFAULT_ARTIFACT_PATH):
+            # Artefact choisi explicitement : jamais remplacé par un autre modèle
+            if _source_changed(artifact):
+                print(f"ATTENTION : '{artifact['metadata']['source']}' a changé depuis l'export de "
+                      f"'{artifact_path}' ; artefact servi tel quel, réexportez-le si besoin.")
+            return model, classes, artifact_path, artifact["preprocess"]
+
+        stale = _source_changed(artifact, model_path)
+        if stale is None and "source_version" not in artifact.get("metadata", {}):
+            # Artefact exporté avant l'empreinte de sa source : comparaison des dates
+            stale = os.path.exists(model_path) and os.path.getmtime(model_path) > os.path.getmtime(artifact_path)
+        if not stale:
+            return model, classes, artifact_path, artifact["preprocess"]
+        print(f"ATTENTION : l'artefact '{artifact_path}' ne correspond plus à '{model_path}' (périmé), "
+              f"chargement de '{model_path}' + '{classes_path}'.")
+    classes = load_classes(classes_path)
+    return load_trained_model(len(classes), model_path, device), classes, model_path, dict(PREPROCESS_META)
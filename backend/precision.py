@@ -0,0 +1,44 @@
+import os
+import torch
+
+# ==========================================
+# PRÉCISION MIXTE bfloat16 (CPU)
+# ==========================================
+# Les Xeon récents (AVX512-BF16, AMX) et les EPYC Zen 4 calculent les convolutions et
+# les matmuls en bf16 bien plus vite qu'en fp32. L'autocast garde en fp32 les opérations
+# sensibles (softmax, pertes, réductions) ; aucun GradScaler n'est nécessaire en bf16.
+#
+# PLANTDOC_BF16 = auto (défaut : activé si le CPU le supporte nativement) | 1 | 0
+
+BF16_MODE = os.environ.get("PLANTDOC_BF16", "auto")
+
+# Drapeaux /proc/cpuinfo indiquant un support matériel du bf16
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def cpu_supports_bf16():
+    """Vrai si le CPU expose une unité bf16 native (Linux : /proc/cpuinfo)."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    return any(flag in flags for flag in BF16_CPU_FLAGS)
+    except OSError:
+        pass
+    return False
+
+
+def use_bf16(mode=None):
+    """Résout le mode ('auto', '1', '0') en booléen."""
+    mode = str(BF16_MODE if mode is None else mode).lower()
+    if mode in ("1", "true", "on"):
+        return True
+    if mode in ("0", "false", "off"):
+        return False
+    return cpu_supports_bf16()
+
+
+def autocast(enabled):
+    """Contexte d'autocast CPU bf16 (sans effet si `enabled` est faux)."""
+    return torch.autocast("cpu", dtype=torch.bfloat16, enabled=enabled)
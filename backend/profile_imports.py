@@ -0,0 +1,86 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Profil du démarrage à froid de l'API, chaque mesure dans un processus neuf :
+#   1. `python -X importtime -c "import api"` : temps d'import cumulé par paquet de premier niveau
+#   2. load_model() (lecture des poids, backend, cascade) puis préchauffage (voir api._warm_up)
+# Usage : python profile_imports.py --top 15 --output startup_report.json
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\| (\s*)(\S+)")
+
+def import_times(module="api"):
+    """Temps d'import cumulé (s) par paquet de premier niveau, plus le total de `import module`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Échec de `import {module}` :\n{result.stderr[-2000:]}")
+
+    packages = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Les enfants précèdent leur parent, deux espaces par niveau : on garde les imports directs
+        # du module (leur temps cumulé inclut leurs dépendances), pas ceux de site.py avant lui
+        if indent == 0:
+            if name == module:
+                total = cumulative_us / 1e6
+                break
+            packages.clear()
+        elif indent == 2:
+            packages[name.split(".")[0]] += cumulative_us / 1e6
+    return total, dict(packages)
+
+STARTUP_CODE = """
+import time, json
+start = time.perf_counter()
+import api
+imported = time.perf_counter()
+api.load_model()
+loaded = time.perf_counter()
+sample = api._synthetic_jpeg()
+api._warm_up_sync(sample)
+warm = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "load_model_s": loaded - imported, "warmup_s": warm - loaded}))
+"""
+
+def startup_times():
+    """Import de l'API, load_model() et préchauffage mesurés dans un processus neuf."""
+    result = subprocess.run([sys.executable, "-c", STARTUP_CODE], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Échec du démarrage :\n{result.stderr[-2000:]}")
+    return {name: round(seconds, 3) for name, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profil du démarrage à froid de l'API (imports, chargement, préchauffage)")
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--top", type=int, default=15, help="Nombre de paquets affichés")
+    parser.add_argument("--skip-startup", action="store_true", help="Imports seulement, sans charger le modèle")
+    parser.add_argument("--output", default=None, help="Rapport JSON optionnel")
+    args = parser.parse_args()
+
+    total, packages = import_times(args.module)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    print(f"=== import {args.module} : {total * 1000:.0f} ms ===")
+    for name, seconds in ranked[:args.top]:
+        print(f"  {name:<28} {seconds * 1000:8.1f} ms")
+
+    report = {"import_total_s": round(total, 3), "packages_s": {name: round(s, 4) for name, s in ranked}}
+    if not args.skip_startup:
+        report["startup"] = startup_times()
+        s = report["startup"]
+        print(f"\nImport {s['import_s'] * 1000:.0f} ms + load_model {s['load_model_s'] * 1000:.0f} ms "
+              f"+ préchauffage {s['warmup_s'] * 1000:.0f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Rapport écrit dans {args.output}")
@@ -0,0 +1,173 @@
+import os
+import sys
+import copy
+import json
+import math
+import time
+import argparse
+import subprocess
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+import train_improved
+from shards import get_shard_loaders
+from modeling import load_serving_model, save_artifact, expansion_blocks, prune_hidden_channels, hidden_widths
+from backends import EXPORT_DIR, fuse_conv_bn, load_backend
+from export_models import measure_latency
+
+# ==========================================
+# ÉLAGAGE STRUCTURÉ + FUSION CONV-BN
+# ==========================================
+# Pour chaque niveau d'élagage (fraction des canaux cachés retirés dans les blocs
+# inverted-residual) :
+#   1. importance des canaux = |gamma| de la BN d'expansion x |gamma| de la BN depthwise
+#      (network slimming) ; on garde les plus importants, par multiples de 8 (SIMD)
+#   2. court fine-tuning de tout le réseau sur data/train
+#   3. fusion Conv-BN, puis export d'un artefact (largeurs cachées + drapeau `fused`)
+#      chargeable par l'API : PLANTDOC_ARTIFACT=exports/plantdoc_pruned_50.pt
+# Rapport : FLOPs, paramètres, taille du fichier, chargement à froid, latence CPU, Top-1.
+#
+# Usage : python prune.py --levels 0.25 0.5 0.75 --finetune-epochs 2
+
+PRUNE_LEVELS = [0.25, 0.5]
+FINETUNE_EPOCHS = 2
+FINETUNE_LR = 1e-4
+CHANNEL_MULTIPLE = 8
+
+def channel_importance(block):
+    expand_bn, depthwise_bn = block.conv[0][1], block.conv[1][1]
+    return expand_bn.weight.detach().abs() * depthwise_bn.weight.detach().abs()
+
+def select_channels(model, level):
+    """Indices (triés) des canaux cachés conservés dans chaque bloc d'expansion."""
+    keep = []
+    for block in expansion_blocks(model):
+        scores = channel_importance(block)
+        width = len(scores)
+        kept = max(CHANNEL_MULTIPLE, int(math.ceil(width * (1 - level) / CHANNEL_MULTIPLE)) * CHANNEL_MULTIPLE)
+        keep.append(scores.topk(min(kept, width)).indices.sort().values)
+    return keep
+
+def count_flops(model, input_size):
+    """Multiplications-additions (MACs) d'une passe sur une image, via des hooks sur Conv2d et Linear."""
+    macs = [0]
+
+    def conv_hook(module, inputs, output):
+        kernel = module.kernel_size[0] * module.kernel_size[1] * (module.in_channels // module.groups)
+        macs[0] += output.numel() * kernel
+
+    def linear_hook(module, inputs, output):
+        macs[0] += output.numel() * module.in_features
+
+    handles = [m.register_forward_hook(conv_hook) for m in model.modules() if isinstance(m, nn.Conv2d)]
+    handles += [m.register_forward_hook(linear_hook) for m in model.modules() if isinstance(m, nn.Linear)]
+    with torch.inference_mode():
+        model.eval()(torch.randn(1, 3, input_size, input_size))
+    for handle in handles:
+        handle.remove()
+    return macs[0]
+
+def cold_load_seconds(path):
+    """Chargement de l'artefact dans un processus neuf (torch déjà importé, comme au démarrage de l'API)."""
+    code = ("import time, modeling; start = time.perf_counter(); "
+            f"modeling.load_artifact({path!r}); print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+def finetune(model, dataloaders, epochs, lr):
+    """Quelques époques sur tout le réseau pour récupérer la précision perdue à l'élagage."""
+    for param in model.parameters():
+        param.requires_grad = True
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+    for epoch in range(epochs):
+        model.train()
+        for inputs, labels in dataloaders['train']:
+            optimizer.zero_grad()
+            criterion(model(inputs), labels).backward()
+            optimizer.step()
+        print(f"  fine-tuning {epoch + 1}/{epochs} : V-Acc {validate(model, dataloaders['val']):.4f}")
+    return model.eval()
+
+def validate(model, loader):
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.inference_mode():
+        for inputs, labels in loader:
+            correct += int((model(inputs).argmax(dim=1) == labels).sum())
+            total += labels.numel()
+    return correct / max(total, 1)
+
+def measure(name, model, path, val_acc, input_size):
+    backend = load_backend("eager", model)
+    result = {
+        "path": path,
+        "hidden_channels": sum(hidden_widths(model)),
+        "gmacs": round(count_flops(model, input_size) / 1e9, 3),
+        "params_m": round(sum(p.numel() for p in model.parameters()) / 1e6, 3),
+        "file_mb": round(os.path.getsize(path) / 1e6, 2),
+        "cold_load_s": round(cold_load_seconds(path), 3),
+        "latency_ms_b1": round(measure_latency(backend, 1, input_size=input_size), 2),
+        "latency_ms_b8": round(measure_latency(backend, 8, input_size=input_size), 2),
+        "top1": round(val_acc, 4),
+    }
+    print(f"[{name:<10}] {result['gmacs']:.3f} GMACs  {result['params_m']:.2f} M params  {result['file_mb']:.1f} Mo  "
+          f"charg. {result['cold_load_s'] * 1000:.0f} ms  b1 {result['latency_ms_b1']:.2f} ms  "
+          f"b8 {result['latency_ms_b8']:.2f} ms  Top-1 {result['top1'] * 100:.2f}%")
+    return result
+
+def prune_and_export(levels, finetune_epochs, lr, export_dir, shard_dir=None):
+    os.makedirs(export_dir, exist_ok=True)
+    base_model, classes, base_path, meta = load_serving_model()
+    if shard_dir:
+        dataloaders, class_names = get_shard_loaders(shard_dir, train_improved.BATCH_SIZE)
+    else:
+        dataloaders, class_names = train_improved.get_data_loaders()
+    if class_names != classes:
+        raise ValueError(f"Classes du dataset {class_names} différentes de celles du modèle {classes}")
+    input_size = meta["crop"]
+
+    results = {}
+    # Référence : modèle actuel, non élagué puis seulement fusionné
+    base_acc = validate(base_model, dataloaders['val'])
+    for name, fused in [("baseline", False), ("fused", True)]:
+        path = os.path.join(export_dir, f"plantdoc_{name}.pt")
+        model = fuse_conv_bn(base_model) if fused else base_model
+        save_artifact(path, model.state_dict(), classes, "mobilenet_v2",
+                      {"fused": True} if fused else {}, meta, source_path=base_path, val_acc=base_acc)
+        results[name] = measure(name, model, path, base_acc, input_size)
+
+    for level in levels:
+        name = f"pruned_{int(level * 100)}"
+        print(f"\n=== Élagage {level * 100:.0f}% des canaux cachés ===")
+        model = prune_hidden_channels(copy.deepcopy(base_model), select_channels(base_model, level))
+        model = finetune(model, dataloaders, finetune_epochs, lr)
+        val_acc = validate(model, dataloaders['val'])
+        fused = fuse_conv_bn(model)
+        path = os.path.join(export_dir, f"plantdoc_{name}.pt")
+        save_artifact(path, fused.state_dict(), classes, "mobilenet_v2",
+                      {"hidden_widths": hidden_widths(model), "fused": True}, meta,
+                      val_acc=val_acc, prune_level=level, finetune_epochs=finetune_epochs, source_path=base_path)
+        results[name] = measure(name, fused, path, val_acc, input_size)
+        results[name]["prune_level"] = level
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Élagage structuré + fusion Conv-BN du modèle servi")
+    parser.add_argument("--levels", type=float, nargs="+", default=PRUNE_LEVELS, help="Fractions de canaux retirés")
+    parser.add_argument("--finetune-epochs", type=int, default=FINETUNE_EPOCHS)
+    parser.add_argument("--lr", type=float, default=FINETUNE_LR)
+    parser.add_argument("--shards", default=None, help="Dossier de shards (voir shards.py)")
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    parser.add_argument("--output", default=None, help="Rapport JSON (défaut : <export-dir>/prune_report.json)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = prune_and_export(args.levels, args.finetune_epochs, args.lr, args.export_dir, args.shards)
+    output = args.output or os.path.join(args.export_dir, "prune_report.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nRapport écrit dans {output} ({time.perf_counter() - start:.0f}s)")
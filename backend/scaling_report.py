@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# ==========================================
+# RAPPORT DE MISE À L'ÉCHELLE (entraînement distribué CPU)
+# ==========================================
+# Lance train_improved.py via torchrun avec 1, 2, 4 puis 8 processus sur cette machine,
+# relève le débit d'entraînement (img/s, hors première époque de chauffe si possible)
+# et calcule accélération et efficacité par rapport à 1 processus.
+# Usage : python scaling_report.py --procs 1 2 4 8 --epochs 2 --shards shards --output scaling.json
+
+def run_training(nproc, epochs, shard_dir):
+    with tempfile.TemporaryDirectory() as tmp:
+        timing_path = os.path.join(tmp, "timing.json")
+        cmd = [sys.executable, "-m", "torch.distributed.run", "--standalone", f"--nproc_per_node={nproc}",
+               "train_improved.py", "--epochs", str(epochs),
+               "--output", os.path.join(tmp, "model.pth"), "--timing-output", timing_path,
+               "--checkpoint", "", "--artifact", "", "--patience", "0"]
+        if shard_dir:
+            cmd += ["--shards", shard_dir]
+        print(f"\n$ {' '.join(cmd)}")
+        subprocess.run(cmd, check=True)
+        with open(timing_path, "r") as f:
+            return json.load(f)
+
+def summarize(timing):
+    epochs = timing["epochs"]
+    measured = epochs[1:] or epochs # la première époque inclut la chauffe (workers, caches)
+    seconds = sum(e["seconds"] for e in measured) / len(measured)
+    images_per_sec = sum(e["images_per_sec"] for e in measured) / len(measured)
+    return {"epoch_seconds": round(seconds, 2), "images_per_sec": round(images_per_sec, 1),
+            "best_val_acc": round(timing["best_val_acc"], 4)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Débit de train_improved.py selon le nombre de processus")
+    parser.add_argument("--procs", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--shards", default=None, help="Dossier de shards (voir shards.py)")
+    parser.add_argument("--output", default="scaling_report.json")
+    args = parser.parse_args()
+
+    results = {}
+    for nproc in args.procs:
+        results[nproc] = summarize(run_training(nproc, args.epochs, args.shards))
+
+    base_procs = args.procs[0]
+    baseline = results[base_procs]["images_per_sec"]
+    print(f"\n{'proc':>4} {'s/époque':>9} {'img/s':>9} {'accél.':>7} {'effic.':>7} {'V-Acc':>7}")
+    for nproc, r in results.items():
+        r["speedup"] = round(r["images_per_sec"] / baseline, 2)
+        r["efficiency"] = round(r["speedup"] * base_procs / nproc, 2)
+        print(f"{nproc:>4} {r['epoch_seconds']:>9.1f} {r['images_per_sec']:>9.1f} "
+              f"x{r['speedup']:>6.2f} {r['efficiency'] * 100:>6.0f}% {r['best_val_acc']:>7.4f}")
+
+    with open(args.output, "w") as f:
+        json.dump({"cpu_count": os.cpu_count(), "epochs": args.epochs, "shards": args.shards,
+                   "processes": results}, f, indent=2)
+    print(f"\nRapport écrit dans {args.output}")
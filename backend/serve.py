@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+
+# ==========================================
+# LANCEUR PRÉ-FORK (production multi-workers)
+# ==========================================
+# `uvicorn api:app --workers N` fait charger le modèle par chaque processus (N copies des poids)
+# et chaque worker lance autant de threads torch que de cœurs (sur-souscription).
+# Ici le parent lit les poids une seule fois, les place en mémoire partagée (share_memory_),
+# ouvre le socket d'écoute, puis forke N workers qui servent tous ce socket :
+#   - poids et backends partagés : les workers n'en ont aucune copie privée
+#   - cœurs répartis : PLANTDOC_THREAD_WORKERS x PLANTDOC_TORCH_THREADS par worker,
+#     avec épinglage optionnel des workers sur des cœurs distincts (--affinity)
+#   - le parent relance un worker mort (délai doublé à chaque échec rapproché, abandon après
+#     PLANTDOC_MAX_RESTARTS échecs : code de sortie 1) et affiche régulièrement RSS et PSS par worker
+# Pools de threads, batchers, cache SQLite et préchauffage restent propres à chaque worker
+# (créés au démarrage d'uvicorn, après le fork). Les sessions ONNX Runtime aussi : leurs
+# threads ne survivent pas à un fork.
+# Les sessions du chatbot, elles, doivent être vues par tous les workers (diagnostic sur l'un,
+# question sur l'autre) : avec plus d'un worker, PLANTDOC_SESSION_DB vaut par défaut SESSION_DB.
+#
+# Usage : python serve.py --workers 4 --port 8000
+
+CPU_COUNT = os.cpu_count() or 1
+WORKERS = int(os.environ.get("PLANTDOC_WORKERS", "2"))
+REPORT_INTERVAL_S = float(os.environ.get("PLANTDOC_MEMORY_REPORT_S", "60"))
+MAX_RESTARTS = int(os.environ.get("PLANTDOC_MAX_RESTARTS", "5")) # Relances successives d'un même worker
+RESTART_BACKOFF_S = 1.0 # Premier délai de relance, doublé à chaque nouvel échec (max RESTART_BACKOFF_MAX_S)
+RESTART_BACKOFF_MAX_S = 60.0
+STABLE_UPTIME_S = 60.0 # Un worker resté en vie plus longtemps remet son compteur d'échecs à zéro
+SESSION_DB = "sessions.db" # Base SQLite des sessions partagée par les workers (voir sessions.py)
+
+
+def core_budget(workers, cpu_count=CPU_COUNT):
+    """Cœurs par worker, puis threads d'exécution x threads torch par worker (sans sur-souscription)."""
+    cores = max(1, cpu_count // workers)
+    thread_workers = min(2, cores)
+    return cores, thread_workers, max(1, cores // thread_workers)
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def share_weights(api):
+    """Place les tenseurs chargés en mémoire partagée : une seule copie physique pour tous les workers."""
+    modules = {}
+    for module in (api.model, api.fast_model, getattr(api.backend, "module", None)):
+        if module is not None:
+            modules[id(module)] = module # backend eager : même module que api.model
+    shared = 0
+    for module in modules.values():
+        if not hasattr(module, "share_memory"):
+            continue # ex: module TorchScript quantifié : reste partagé en copy-on-write
+        module.share_memory()
+        shared += sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+    return shared / 1e6
+
+
+def run_worker(sock, index, cores, host, port, log_level):
+    """Corps d'un worker forké : épinglage éventuel, puis uvicorn sur le socket hérité."""
+    import uvicorn
+    import api
+
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    config = uvicorn.Config(api.app, host=host, port=port, log_level=log_level, lifespan="on")
+    server = uvicorn.Server(config)
+    print(f"[worker {index}] pid {os.getpid()}" + (f", cœurs {sorted(cores)}" if cores is not None else ""))
+    server.run(sockets=[sock])
+
+
+def memory_report(workers):
+    from utils import get_rss_mb, get_pss_mb
+
+    rows = [("parent", os.getpid())] + [(f"worker {i}", pid) for i, pid in sorted(workers.items())]
+    total_rss = 0.0
+    total_pss = 0.0
+    lines = []
+    for name, pid in rows:
+        rss, pss = get_rss_mb(pid), get_pss_mb(pid)
+        total_rss += rss
+        total_pss += pss
+        lines.append(f"  {name:<10} pid {pid:<7} RSS {rss:8.1f} Mo  PSS {pss:8.1f} Mo")
+    print("=== Mémoire ===\n" + "\n".join(lines) +
+          f"\n  {'total':<18} RSS {total_rss:8.1f} Mo  PSS {total_pss:8.1f} Mo (empreinte réelle)")
+
+
+def serve(workers, host, port, affinity, report_interval, log_level):
+    cores, thread_workers, torch_threads = core_budget(workers)
+    # Avant l'import d'api/execution : chaque worker lit son propre budget de threads
+    os.environ["PLANTDOC_THREAD_WORKERS"] = str(thread_workers)
+    os.environ["PLANTDOC_TORCH_THREADS"] = str(torch_threads)
+    if workers > 1 and not os.environ.get("PLANTDOC_SESSION_DB"):
+        os.environ["PLANTDOC_SESSION_DB"] = SESSION_DB
+        print(f"Sessions du chatbot partagées entre workers : '{SESSION_DB}' (PLANTDOC_SESSION_DB).")
+
+    import torch
+    # Le parent ne lance aucun pool de threads (OpenMP compris) : un fork ne copie que le thread appelant
+    torch.set_num_threads(1)
+    import api
+
+    start = time.perf_counter()
+    api.load_weights()
+    if api.INFERENCE_BACKEND != "onnx":
+        api.build_backends()
+    shared_mb = share_weights(api)
+    print(f"Poids chargés en {time.perf_counter() - start:.2f}s ({shared_mb:.1f} Mo en mémoire partagée). "
+          f"{workers} workers x {thread_workers} threads x {torch_threads} threads torch.")
+
+    sock = bind_socket(host, port)
+    available = sorted(os.sched_getaffinity(0))
+
+    def fork_worker(index):
+        worker_cores = None
+        if affinity:
+            worker_cores = set(available[(index * cores) % len(available):][:cores]) or set(available)
+        sys.stdout.flush() # Sinon le tampon du parent serait réécrit par chaque worker
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(sock, index, worker_cores, host, port, log_level)
+            except BaseException as e:
+                print(f"[worker {index}] arrêt sur erreur : {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        return pid
+
+    children = {i: fork_worker(i) for i in range(workers)} # index -> pid (None : relance en attente)
+    started = {i: time.monotonic() for i in range(workers)}
+    failures = {i: 0 for i in range(workers)}
+    restart_at = {} # index -> instant de la prochaine relance
+    print(f"API en écoute sur http://{host}:{port} (parent pid {os.getpid()})")
+
+    stopping = False
+    exit_code = 0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.monotonic() + min(report_interval, 30) if report_interval > 0 else None
+    while not stopping:
+        now = time.monotonic()
+        for index, when in list(restart_at.items()):
+            if now >= when:
+                del restart_at[index]
+                children[index] = fork_worker(index)
+                started[index] = time.monotonic()
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            if not restart_at:
+                break
+            pid = 0 # Tous les workers attendent leur relance
+        if pid:
+            index = next((i for i, child in children.items() if child == pid), None)
+            if index is not None:
+                children[index] = None
+                if time.monotonic() - started[index] > STABLE_UPTIME_S:
+                    failures[index] = 0
+                failures[index] += 1
+                if failures[index] > MAX_RESTARTS:
+                    # Ex: erreur au démarrage du worker : inutile de forker en boucle
+                    print(f"[worker {index}] pid {pid} terminé (statut {status}) : {MAX_RESTARTS} relances "
+                          f"successives en échec, arrêt du serveur.")
+                    exit_code = 1
+                    break
+                delay = min(RESTART_BACKOFF_S * 2 ** (failures[index] - 1), RESTART_BACKOFF_MAX_S)
+                print(f"[worker {index}] pid {pid} terminé (statut {status}), relance dans {delay:g}s "
+                      f"({failures[index]}/{MAX_RESTARTS}).")
+                restart_at[index] = time.monotonic() + delay
+            continue
+        if next_report is not None and time.monotonic() >= next_report:
+            memory_report({i: child for i, child in children.items() if child is not None})
+            next_report = time.monotonic() + report_interval
+        time.sleep(0.5)
+
+    print("Arrêt des workers...")
+    alive = [pid for pid in children.values() if pid is not None]
+    for pid in alive:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in alive:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur pré-fork : poids partagés entre N workers uvicorn")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--affinity", action="store_true", help="Épingle chaque worker sur ses propres cœurs")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL_S,
+                        help="Secondes entre deux rapports mémoire (0 = désactivé)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    sys.exit(serve(args.workers, args.host, args.port, args.affinity, args.report_interval, args.log_level))
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+# ==========================================
+# SESSIONS DU CHATBOT (diagnostic + historique)
+# ==========================================
+# /predict et /diagnose renvoient un `session_id` quand le client en demande une (`session=true`)
+# ou en fournit une ; le frontend le renvoie avec ses messages /chat.
+# Le serveur garde pour chaque session le dernier diagnostic (classe, confiance, conseils de
+# get_advice) et les derniers échanges : l'utilisateur n'a ni à tout reformuler, ni à renvoyer la photo.
+# Chaque prompt (système + diagnostic + historique + question) tient dans PROMPT_TOKEN_BUDGET :
+# l'historique envoyé au LLM garde les échanges les plus récents qui tiennent dans le reste.
+# Sessions en mémoire du processus, LRU bornée et expirées après inactivité ; avec plusieurs workers
+# (serve.py), base SQLite partagée PLANTDOC_SESSION_DB : une question peut arriver sur un autre
+# worker que le diagnostic, chaque modification y est donc écrite aussitôt, colonne par colonne
+# (un échange ne réécrit pas le diagnostic enregistré entre-temps par un autre worker).
+# Les méthodes du store font des entrées/sorties : l'API les appelle via execution.run_in_thread.
+
+SESSION_DB_PATH = os.environ.get("PLANTDOC_SESSION_DB", "") # "" = sessions en mémoire du processus
+SESSION_MAX = int(os.environ.get("PLANTDOC_SESSION_MAX", "10000"))
+SESSION_TTL_S = float(os.environ.get("PLANTDOC_SESSION_TTL_S", "3600"))
+HISTORY_MAX_TURNS = int(os.environ.get("PLANTDOC_CHAT_HISTORY_TURNS", "20")) # Échanges conservés par session
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PLANTDOC_CHAT_PROMPT_TOKENS", "1280")) # Tokens par prompt, système compris
+CHARS_PER_TOKEN = 4 # Estimation pour le français, sans appel réseau
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.diagnosis = None
+        self.turns = deque(maxlen=HISTORY_MAX_TURNS) # (question, réponse, tokens estimés)
+        self.updated = time.time()
+
+    @property
+    def has_context(self):
+        return self.diagnosis is not None or bool(self.turns)
+
+    def add_turn(self, question, answer):
+        self.turns.append((question, answer, estimate_tokens(question) + estimate_tokens(answer)))
+
+    def history(self, token_budget=PROMPT_TOKEN_BUDGET):
+        """Échanges les plus récents tenant dans `token_budget`, dans l'ordre chronologique."""
+        kept = []
+        used = 0
+        for question, answer, tokens in reversed(self.turns):
+            if used + tokens > token_budget:
+                break
+            kept.append((question, answer))
+            used += tokens
+        return kept[::-1]
+
+    def diagnosis_context(self):
+        """Résumé du dernier diagnostic, placé en tête de la conversation envoyée au LLM."""
+        d = self.diagnosis
+        if d is None:
+            return None
+        text = f"Dernier diagnostic de la photo de l'utilisateur : {d['class'].replace('_', ' ')} ({d['confidence']:.0f}% de confiance"
+        text += ", incertain)." if d["status"] == "uncertain" else ")."
+        if d.get("advice"):
+            text += " Conseils déjà donnés : " + " ".join(d["advice"])
+        return text
+
+
+class SessionStore:
+    """
+    Sessions indexées par identifiant aléatoire, bornées à `max_sessions` (les moins récentes
+    sortent d'abord), expirées après `ttl_s`. En mémoire, ou dans la base SQLite `db_path`
+    partagée par les workers (connexion ouverte dans chaque processus, après le fork).
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl_s=SESSION_TTL_S, db_path=SESSION_DB_PATH):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.db_path = db_path or None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._writes = 0
+        self.db_errors = 0
+
+    def get(self, session_id):
+        """Session existante et non expirée, ou None."""
+        if not session_id:
+            return None
+        with self._lock:
+            if self.db_path:
+                return self._load(session_id)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.updated > self.ttl_s:
+                del self._sessions[session_id]
+                return None
+            session.updated = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id=None):
+        session = self.get(session_id)
+        if session is not None:
+            return session
+        session = Session(uuid.uuid4().hex)
+        if self.db_path:
+            return session # Écrite à sa première modification (diagnostic ou échange)
+        with self._lock:
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def record_diagnosis(self, session_id, response):
+        """
+        Mémorise le diagnostic d'une réponse de /predict ou /diagnose (succès ou incertain)
+        et renvoie l'identifiant de la session ; None pour une erreur (image floue, illisible).
+        """
+        status = response.get("status")
+        if status not in ("success", "uncertain"):
+            return None
+        session = self.get_or_create(session_id)
+        if status == "success":
+            best_class, confidence, advice = response["primary_diagnosis"], response["confidence"], response.get("advice")
+        else:
+            top = response["top_predictions"][0]
+            best_class, confidence, advice = top["class"], top["confidence"], None
+        session.diagnosis = {"class": best_class, "confidence": confidence, "status": status, "advice": advice}
+        if self.db_path:
+            self._write(
+                "INSERT INTO sessions (id, diagnosis, turns, updated) VALUES (?, ?, '[]', ?) "
+                "ON CONFLICT(id) DO UPDATE SET diagnosis = excluded.diagnosis, updated = excluded.updated",
+                (session.id, json.dumps(session.diagnosis), time.time()),
+            )
+        return session.id
+
+    def add_turn(self, session, question, answer):
+        """
+        Ajoute un échange à la session. En mode SQLite, lecture-modification-écriture de la seule
+        colonne `turns` dans une transaction : les échanges d'un autre worker ne sont pas perdus.
+        """
+        if not self.db_path:
+            with self._lock:
+                session.add_turn(question, answer)
+                session.updated = time.time()
+            return
+        session.add_turn(question, answer)
+
+        def append(db):
+            row = db.execute("SELECT turns FROM sessions WHERE id = ?", (session.id,)).fetchone()
+            turns = json.loads(row[0] or "[]") if row is not None else []
+            turns = (turns + [list(session.turns[-1])])[-HISTORY_MAX_TURNS:]
+            db.execute(
+                "INSERT INTO sessions (id, diagnosis, turns, updated) VALUES (?, NULL, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET turns = excluded.turns, updated = excluded.updated",
+                (session.id, json.dumps(turns), time.time()),
+            )
+
+        self._write(append)
+
+    def _write(self, statement, params=()):
+        """
+        Une écriture (requête, ou fonction recevant la connexion) dans une transaction IMMEDIATE.
+        Une erreur est journalisée, pas levée : la réponse est servie, seul l'historique est manqué.
+        """
+        with self._lock:
+            db = None
+            try:
+                db = self._connection()
+                db.execute("BEGIN IMMEDIATE") # Verrou d'écriture pris avant la lecture éventuelle
+                if callable(statement):
+                    statement(db)
+                else:
+                    db.execute(statement, params)
+                # Bornes : sessions expirées et les moins récentes au-delà de max_sessions, retirées régulièrement
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl_s,))
+                    db.execute(
+                        "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                        (self.max_sessions,),
+                    )
+                db.commit()
+            except sqlite3.Error as e:
+                # Ex: "database is locked" au-delà du délai d'attente
+                self.db_errors += 1
+                if db is not None and db.in_transaction:
+                    db.rollback()
+                print(f"Sessions : écriture ignorée ({e}).")
+
+    def _connection(self):
+        # Une connexion par processus : celle du parent ne doit pas être réutilisée après un fork
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+            self._db_pid = os.getpid()
+            self._db.execute("PRAGMA journal_mode=WAL") # Lectures d'un worker pendant l'écriture d'un autre
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, diagnosis TEXT, turns TEXT, updated REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _load(self, session_id):
+        try:
+            row = self._connection().execute(
+                "SELECT diagnosis, turns, updated FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.db_errors += 1
+            print(f"Sessions : lecture ignorée ({e}).")
+            return None
+        if row is None:
+            return None
+        diagnosis, turns, updated = row
+        if time.time() - updated > self.ttl_s:
+            return None # Supprimée au prochain nettoyage
+        session = Session(session_id)
+        session.diagnosis = json.loads(diagnosis) if diagnosis else None
+        session.turns.extend(tuple(turn) for turn in json.loads(turns or "[]"))
+        session.updated = updated
+        return session
+
+    def stats(self):
+        with self._lock:
+            stats = {"backend": "sqlite" if self.db_path else "memory", "max_sessions": self.max_sessions, "ttl_s": self.ttl_s}
+            if not self.db_path:
+                stats["sessions"] = len(self._sessions)
+                return stats
+            try:
+                stats["sessions"] = self._connection().execute(
+                    "SELECT COUNT(*) FROM sessions WHERE updated >= ?", (time.time() - self.ttl_s,)
+                ).fetchone()[0]
+            except sqlite3.Error as e:
+                self.db_errors += 1
+                print(f"Sessions : comptage ignoré ({e}).")
+            stats["db_errors"] = self.db_errors
+            return stats
@@ -0,0 +1,336 @@
+import os
+import json
+import math
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision import datasets
+from torch.utils.data import Dataset
+
+from imaging import open_image, RESIZE_SIZE, CROP_SIZE
+
+# ==========================================
+# SHARDS D'ENTRAÎNEMENT PRÉ-DÉCODÉS (uint8, 256 px)
+# ==========================================
+# Chaque split (data/train, data/val) est décodé une seule fois puis écrit dans
+#   <out>/<split>_images.npy  : memmap uint8 N x 256 x 256 x 3 (recadrage central carré)
+#   <out>/<split>_labels.npy  : indices de classe (int64)
+#   <out>/meta.json           : classes, tailles, taille d'image
+# ShardLoader lit ces tableaux sans copie et applique la data-augmentation de
+# train_improved.py par lots, directement sur des tenseurs (une seule passe grid_sample).
+#
+# Usage :
+#   python shards.py pack --data-dir data --out shards
+#   python shards.py bench --data-dir data --out shards --batches 50
+#   python train_improved.py --shards shards
+
+SHARD_DIR = 'shards'
+SHARD_SIZE = RESIZE_SIZE
+META_FILE = 'meta.json'
+
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def _to_square(image, size=SHARD_SIZE):
+    """Redimensionne le côté court à `size` puis recadre au centre (comme Resize + CenterCrop)."""
+    width, height = image.size
+    scale = size / min(width, height)
+    image = image.resize((max(size, round(width * scale)), max(size, round(height * scale))))
+    left = (image.width - size) // 2
+    top = (image.height - size) // 2
+    return np.asarray(image.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def pack_split(src_dir, out_dir, split, size=SHARD_SIZE):
+    folder = datasets.ImageFolder(src_dir)
+    n = len(folder.samples)
+    images = np.lib.format.open_memmap(os.path.join(out_dir, f'{split}_images.npy'), mode='w+',
+                                       dtype=np.uint8, shape=(n, size, size, 3))
+    labels = np.empty(n, dtype=np.int64)
+
+    start = time.perf_counter()
+    for i, (path, label) in enumerate(folder.samples):
+        with open(path, 'rb') as f:
+            images[i] = _to_square(open_image(f.read()), size)
+        labels[i] = label
+        if (i + 1) % 1000 == 0:
+            print(f"  {split}: {i + 1}/{n} images")
+    images.flush()
+    np.save(os.path.join(out_dir, f'{split}_labels.npy'), labels)
+    print(f"{split}: {n} images empaquetées en {time.perf_counter() - start:.1f}s "
+          f"({images.nbytes / 1e6:.0f} Mo)")
+    return folder.classes, n
+
+
+def pack(data_dir, out_dir=SHARD_DIR, size=SHARD_SIZE):
+    """Décode data/train et data/val une seule fois vers des memmaps uint8."""
+    os.makedirs(out_dir, exist_ok=True)
+    meta = {"size": size, "splits": {}}
+    for split in ['train', 'val']:
+        classes, n = pack_split(os.path.join(data_dir, split), out_dir, split, size)
+        meta["classes"] = classes
+        meta["splits"][split] = n
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class ShardDataset(Dataset):
+    """
+    Split empaqueté, mappé en mémoire (copy-on-write : les tranches deviennent des
+    tenseurs sans copie). `dataset[i]` renvoie (uint8 HxWx3, label) ; l'augmentation
+    se fait par lots dans ShardLoader.
+    """
+
+    def __init__(self, shard_dir, split):
+        with open(os.path.join(shard_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.classes = meta["classes"]
+        self.size = meta["size"]
+        self.images = np.load(os.path.join(shard_dir, f'{split}_images.npy'), mmap_mode='c')
+        self.labels = torch.from_numpy(np.load(os.path.join(shard_dir, f'{split}_labels.npy')))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return torch.from_numpy(self.images[idx]), int(self.labels[idx])
+
+
+# --- Augmentations par lot (équivalentes à celles de train_improved.py) ---
+
+def _random_affine(batch_size, scale=(0.7, 1.0), ratio=(3 / 4, 4 / 3), degrees=45.0):
+    """
+    Matrices Bx2x3 pour affine_grid combinant RandomResizedCrop, flips horizontal/vertical
+    et RandomRotation : une seule interpolation par image au lieu de trois.
+    """
+    area = torch.empty(batch_size).uniform_(*scale)
+    log_ratio = torch.empty(batch_size).uniform_(math.log(ratio[0]), math.log(ratio[1]))
+    aspect = torch.exp(log_ratio)
+    w = torch.sqrt(area * aspect).clamp(max=1.0) # fraction de la largeur source
+    h = torch.sqrt(area / aspect).clamp(max=1.0)
+    cx = (torch.rand(batch_size) * 2 - 1) * (1 - w) # centre du recadrage en coordonnées [-1, 1]
+    cy = (torch.rand(batch_size) * 2 - 1) * (1 - h)
+
+    angle = torch.empty(batch_size).uniform_(-degrees, degrees) * math.pi / 180.0
+    flip_x = 1.0 - 2.0 * (torch.rand(batch_size) < 0.5).float()
+    flip_y = 1.0 - 2.0 * (torch.rand(batch_size) < 0.5).float()
+    cos, sin = torch.cos(angle), torch.sin(angle)
+
+    theta = torch.zeros(batch_size, 2, 3)
+    theta[:, 0, 0] = w * flip_x * cos
+    theta[:, 0, 1] = -w * flip_x * sin
+    theta[:, 1, 0] = h * flip_y * sin
+    theta[:, 1, 1] = h * flip_y * cos
+    theta[:, 0, 2] = cx
+    theta[:, 1, 2] = cy
+    return theta
+
+
+def _grayscale(x):
+    return (0.299 * x[:, 0:1] + 0.587 * x[:, 1:2] + 0.114 * x[:, 2:3])
+
+
+def _per_sample(batch_size, low, high):
+    return torch.empty(batch_size, 1, 1, 1).uniform_(low, high)
+
+
+def _color_jitter(x, brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1):
+    b = x.shape[0]
+    x = (x * _per_sample(b, 1 - brightness, 1 + brightness)).clamp_(0, 1)
+    mean = _grayscale(x).mean(dim=(2, 3), keepdim=True)
+    factor = _per_sample(b, 1 - contrast, 1 + contrast)
+    x = (factor * x + (1 - factor) * mean).clamp_(0, 1)
+    factor = _per_sample(b, 1 - saturation, 1 + saturation)
+    x = (factor * x + (1 - factor) * _grayscale(x)).clamp_(0, 1)
+
+    # Teinte : rotation de la chrominance dans l'espace YIQ (approximation linéaire du décalage HSV)
+    angle = torch.empty(b).uniform_(-hue, hue) * 2 * math.pi
+    yiq = torch.tensor([[0.299, 0.587, 0.114], [0.596, -0.274, -0.322], [0.211, -0.523, 0.312]])
+    rgb = torch.linalg.inv(yiq)
+    rotation = torch.zeros(b, 3, 3)
+    rotation[:, 0, 0] = 1.0
+    rotation[:, 1, 1] = torch.cos(angle)
+    rotation[:, 1, 2] = -torch.sin(angle)
+    rotation[:, 2, 1] = torch.sin(angle)
+    rotation[:, 2, 2] = torch.cos(angle)
+    matrix = rgb @ rotation @ yiq # B x 3 x 3
+    return torch.einsum('bij,bjhw->bihw', matrix, x).clamp_(0, 1)
+
+
+def _gaussian_blur(x, sigma=(0.1, 2.0)):
+    """GaussianBlur(kernel_size=3) avec un sigma par image : convolution séparable groupée."""
+    b, c, height, width = x.shape
+    s = torch.empty(b).uniform_(*sigma)
+    kernel = torch.exp(-torch.tensor([-1.0, 0.0, 1.0]) ** 2 / (2 * s[:, None] ** 2))
+    kernel = (kernel / kernel.sum(dim=1, keepdim=True)).repeat_interleave(c, dim=0) # (B*C) x 3
+    x = F.pad(x.reshape(1, b * c, height, width), (1, 1, 1, 1), mode='reflect')
+    x = F.conv2d(x, kernel.view(b * c, 1, 1, 3), groups=b * c)
+    x = F.conv2d(x, kernel.view(b * c, 1, 3, 1), groups=b * c)
+    return x.view(b, c, height, width)
+
+
+def augment_batch(images, crop_size=CROP_SIZE):
+    """uint8 BxHxWx3 -> float Bx3xCxC augmenté et normalisé."""
+    x = images.permute(0, 3, 1, 2).float().div_(255.0)
+    grid = F.affine_grid(_random_affine(x.shape[0]), (x.shape[0], 3, crop_size, crop_size), align_corners=False)
+    x = F.grid_sample(x, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+    x = _gaussian_blur(_color_jitter(x))
+    return ((x - MEAN) / STD).contiguous()
+
+
+def center_batch(images, crop_size=CROP_SIZE):
+    """uint8 BxHxWx3 -> float Bx3xCxC recadré au centre et normalisé (validation)."""
+    offset = (images.shape[1] - crop_size) // 2
+    x = images[:, offset:offset + crop_size, offset:offset + crop_size]
+    x = x.permute(0, 3, 1, 2).float().div_(255.0)
+    return ((x - MEAN) / STD).contiguous()
+
+
+class ShardLoader:
+    """
+    Remplaçant de DataLoader pour un ShardDataset : tire des lots d'indices, lit les images
+    uint8 d'un bloc puis les transforme en lot. Un thread prépare les `prefetch` lots suivants
+    (les opérations torch libèrent le GIL) pendant que le modèle calcule.
+    """
+
+    def __init__(self, dataset, batch_size=32, shuffle=False, augment=False, prefetch=2, sampler=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augment = augment
+        self.prefetch = prefetch
+        self.sampler = sampler # ex: DistributedSampler (entraînement multi-processus)
+
+    def __len__(self):
+        n = len(self.sampler) if self.sampler is not None else len(self.dataset)
+        return math.ceil(n / self.batch_size)
+
+    def _batches(self):
+        n = len(self.dataset)
+        if self.sampler is not None:
+            order = torch.tensor(list(self.sampler), dtype=torch.long).split(self.batch_size)
+        elif self.shuffle:
+            order = torch.randperm(n).split(self.batch_size)
+        else:
+            order = [slice(i, min(i + self.batch_size, n)) for i in range(0, n, self.batch_size)]
+        for idx in order:
+            if isinstance(idx, slice):
+                images = torch.from_numpy(self.dataset.images[idx]) # tranche contiguë : aucune copie
+                labels = self.dataset.labels[idx]
+            else:
+                idx = idx.sort().values # lecture du memmap dans l'ordre du fichier
+                images = torch.from_numpy(self.dataset.images[idx.numpy()])
+                labels = self.dataset.labels[idx]
+            yield (augment_batch(images) if self.augment else center_batch(images)), labels
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            yield from self._batches()
+            return
+
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # Attente bornée : le producteur s'arrête si le consommateur a abandonné l'itération
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for batch in self._batches():
+                    if not put(batch):
+                        return
+            except BaseException as e:
+                put(e) # Relancée dans le thread consommateur
+            else:
+                put(done)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            # Aussi sur break, exception ou générateur fermé avant la fin
+            stop.set()
+            thread.join()
+
+
+def get_shard_loaders(shard_dir=SHARD_DIR, batch_size=32, samplers=None):
+    """Mêmes sorties que train_improved.get_data_loaders(), à partir des shards."""
+    train = ShardDataset(shard_dir, 'train')
+    val = ShardDataset(shard_dir, 'val')
+    samplers = samplers(train, val) if samplers else (None, None)
+    dataloaders = {
+        'train': ShardLoader(train, batch_size, shuffle=True, augment=True, sampler=samplers[0]),
+        'val': ShardLoader(val, batch_size, shuffle=False, augment=False, sampler=samplers[1]),
+    }
+    return dataloaders, train.classes
+
+
+def measure_throughput(loader, batches, warmup=3):
+    """Images/s en sortie du loader (sans modèle), après quelques lots de chauffe."""
+    images = 0
+    start = None
+    for i, (inputs, _) in enumerate(loader):
+        if i == warmup:
+            start = time.perf_counter()
+        if i >= warmup:
+            images += inputs.shape[0]
+        if i + 1 >= warmup + batches:
+            break
+    elapsed = time.perf_counter() - start if start else 0.0
+    return images / elapsed if elapsed else 0.0
+
+
+def bench(data_dir, shard_dir, batches, batch_size):
+    import train_improved
+
+    train_improved.DATA_DIR = data_dir
+    train_improved.BATCH_SIZE = batch_size
+    folder_loaders, _ = train_improved.get_data_loaders()
+    shard_loaders, _ = get_shard_loaders(shard_dir, batch_size)
+
+    results = {}
+    for name, loaders in [("imagefolder", folder_loaders), ("shards", shard_loaders)]:
+        results[name] = {phase: round(measure_throughput(loaders[phase], batches), 1) for phase in ['train', 'val']}
+        print(f"[{name:<11}] train {results[name]['train']:8.1f} img/s   val {results[name]['val']:8.1f} img/s")
+    for phase in ['train', 'val']:
+        speedup = results["shards"][phase] / max(results["imagefolder"][phase], 1e-9)
+        print(f"Accélération {phase} : x{speedup:.1f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shards uint8 pré-décodés pour l'entraînement")
+    parser.add_argument("command", choices=["pack", "bench"])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--out", default=SHARD_DIR)
+    parser.add_argument("--size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--batches", type=int, default=50, help="Lots mesurés par loader (bench)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        meta = pack(args.data_dir, args.out, args.size)
+        print(f"Shards écrits dans '{args.out}' : {meta['splits']}")
+    else:
+        bench(args.data_dir, args.out, args.batches, args.batch_size)
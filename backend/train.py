@@ -1,10 +1,18 @@
 import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
 from torchvision import datasets, transforms, models
 from torch.utils.data import DataLoader
 
+from modeling import ARTIFACT_PATH, save_artifact
+
 # ==========================================
 # CONFIGURATION (MVP 48h - 5 classes cibles)
 # ==========================================
@@ -14,17 +22,28 @@ EPOCHS = 10
 LEARNING_RATE = 0.001
 NUM_CLASSES = 5
 
-def train_model():
+# Mode "cache de features" : le backbone gelé ne tourne qu'une fois (K vues augmentées par image),
+# puis seul le classifieur est entraîné sur les vecteurs 1280-d stockés dans un memmap sur disque.
+FEATURE_CACHE_DIR = 'feature_cache'
+FEATURE_VIEWS = 5
+HEAD_EPOCHS = 30
+FEATURE_DIM = 1280 # model.last_channel de MobileNetV2
+
+def export_artifact(class_names, model_path='plantdoc_mobilenetv2.pth', artifact_path=ARTIFACT_PATH, **metadata):
     """
-    Pipeline de préparation et d'entraînement avec PyTorch (MobileNetV2).
-    Utilise le Transfer Learning pour un prototypage rapide et léger.
+    Exporte aussi l'artefact lu en priorité par l'API : sans lui, un ancien artefact resterait servi
+    (et la version du cache de résultats ne changerait pas) malgré les nouveaux poids.
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"=== Entraînement sur {device} ===")
+    if not os.path.exists(model_path):
+        return
+    save_artifact(artifact_path, torch.load(model_path, map_location="cpu"), class_names, source_path=model_path,
+                  **metadata)
+    print(f"Artefact exporté : '{artifact_path}'.")
 
+def get_data_transforms():
     # 1. Pré-traitement et Data Augmentation
     # MobileNetV2 attend des images RGB de taille 224x224 normalisées
-    data_transforms = {
+    return {
         'train': transforms.Compose([
             transforms.RandomResizedCrop(224), # Resize & Crop
             transforms.RandomHorizontalFlip(), # Flip
@@ -41,6 +60,16 @@ def train_model():
         ]),
     }
 
+def train_model():
+    """
+    Pipeline de préparation et d'entraînement avec PyTorch (MobileNetV2).
+    Utilise le Transfer Learning pour un prototypage rapide et léger.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"=== Entraînement sur {device} ===")
+
+    data_transforms = get_data_transforms()
+
     # Charger les datasets
     try:
         image_datasets = {x: datasets.ImageFolder(os.path.join(DATA_DIR, x), data_transforms[x]) 
@@ -119,6 +148,160 @@ def train_model():
     # Sauvegarder la liste des classes pour y accéder depuis l'API
     with open("classes.txt", "w") as f:
         f.write("\n".join(class_names))
+    export_artifact(class_names, val_acc=float(best_acc), epochs=EPOCHS)
+
+# ==========================================
+# MODE CACHE DE FEATURES (backbone gelé calculé une seule fois)
+# ==========================================
+
+def _feature_cache_meta(class_names, views, backbone):
+    return {"classes": class_names, "views": views, "feature_dim": FEATURE_DIM, "backbone": _weights_hash(backbone)}
+
+def _weights_hash(module):
+    """Empreinte des poids du backbone : des poids pré-entraînés différents invalident le cache."""
+    digest = hashlib.sha256()
+    for name, tensor in module.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def _extract_split(backbone, dataset, views, path, device):
+    """Passe `views` fois sur le dataset (augmentations différentes) et écrit les features dans un memmap."""
+    n = len(dataset) * views
+    features = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=np.float32, shape=(n, FEATURE_DIM))
+    labels = np.empty(n, dtype=np.int64)
+    loader = DataLoader(dataset, batch_size=BATCH_SIZE * 2, shuffle=False, num_workers=4)
+
+    offset = 0
+    for view in range(views):
+        start = time.perf_counter()
+        for inputs, targets in loader:
+            with torch.inference_mode():
+                pooled = F.adaptive_avg_pool2d(backbone(inputs.to(device)), 1).flatten(1)
+            features[offset:offset + len(targets)] = pooled.cpu().numpy()
+            labels[offset:offset + len(targets)] = targets.numpy()
+            offset += len(targets)
+        print(f"  {os.path.basename(path)} vue {view + 1}/{views} : {time.perf_counter() - start:.1f}s")
+
+    features.flush()
+    np.save(path + '_labels.npy', labels)
+
+def precompute_features(cache_dir=FEATURE_CACHE_DIR, views=FEATURE_VIEWS):
+    """
+    Calcule (ou réutilise) les features 1280-d du backbone gelé :
+    `views` vues augmentées par image d'entraînement, une vue centrée pour la validation.
+    Renvoie ({'train': (X, y), 'val': (X, y)}, class_names), X étant mappé depuis le disque.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    data_transforms = get_data_transforms()
+    image_datasets = {x: datasets.ImageFolder(os.path.join(DATA_DIR, x), data_transforms[x])
+                      for x in ['train', 'val']}
+    class_names = image_datasets['train'].classes
+
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    backbone = models.mobilenet_v2(pretrained=True).features.to(device).eval()
+    meta = _feature_cache_meta(class_names, views, backbone)
+    sizes = {x: len(image_datasets[x]) for x in ['train', 'val']}
+    meta["sizes"] = sizes
+
+    cached = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            cached = json.load(f)
+
+    if cached != meta:
+        print(f"=== Extraction des features sur {device} ({views} vues/image) ===")
+        start = time.perf_counter()
+        _extract_split(backbone, image_datasets['train'], views, os.path.join(cache_dir, 'train'), device)
+        _extract_split(backbone, image_datasets['val'], 1, os.path.join(cache_dir, 'val'), device)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        print(f"Features écrites dans '{cache_dir}' en {time.perf_counter() - start:.1f}s")
+    else:
+        print(f"Cache de features réutilisé ('{cache_dir}', {views} vues/image)")
+
+    # mmap_mode='c' (copie à l'écriture) : tableau inscriptible pour torch.from_numpy, fichier jamais modifié
+    splits = {x: (np.load(os.path.join(cache_dir, f'{x}.npy'), mmap_mode='c'),
+                  np.load(os.path.join(cache_dir, f'{x}_labels.npy')))
+              for x in ['train', 'val']}
+    return splits, class_names
+
+def train_head_from_cache(splits, num_classes, lr=LEARNING_RATE, epochs=HEAD_EPOCHS, seed=0):
+    """Entraîne le classifieur (Dropout + Linear, comme MobileNetV2) sur les features en cache."""
+    torch.manual_seed(seed)
+    # Vue zéro-copie sur le memmap : rien n'est rechargé entre les époques
+    x_train, y_train = (torch.from_numpy(np.asarray(a)) for a in splits['train'])
+    x_val, y_val = (torch.from_numpy(np.asarray(a)) for a in splits['val'])
+
+    head = nn.Sequential(nn.Dropout(0.2), nn.Linear(FEATURE_DIM, num_classes))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=lr)
+
+    best_acc = 0.0
+    best_state = None
+    for epoch in range(epochs):
+        head.train()
+        for idx in torch.randperm(len(y_train)).split(BATCH_SIZE):
+            optimizer.zero_grad()
+            loss = criterion(head(x_train[idx]), y_train[idx])
+            loss.backward()
+            optimizer.step()
+
+        head.eval()
+        with torch.no_grad():
+            val_acc = float((head(x_val).argmax(dim=1) == y_val).float().mean())
+        if val_acc > best_acc or best_state is None:
+            best_acc = val_acc
+            best_state = {k: v.clone() for k, v in head.state_dict().items()}
+
+    head.load_state_dict(best_state)
+    return head, best_acc
+
+def train_from_feature_cache(views=FEATURE_VIEWS, epochs=HEAD_EPOCHS, learning_rates=(LEARNING_RATE,),
+                             cache_dir=FEATURE_CACHE_DIR):
+    """
+    Variante rapide de train_model() : même modèle final (backbone ImageNet gelé + nouveau classifieur),
+    mais l'extraction des features n'a lieu qu'une fois. Plusieurs `learning_rates` = balayage du classifieur.
+    """
+    try:
+        splits, class_names = precompute_features(cache_dir, views)
+    except FileNotFoundError:
+        print("Erreur: Le dossier 'data/train' ou 'data/val' est introuvable.")
+        return
+
+    best = None
+    for lr in learning_rates:
+        start = time.perf_counter()
+        head, acc = train_head_from_cache(splits, len(class_names), lr=lr, epochs=epochs)
+        elapsed = time.perf_counter() - start
+        print(f"lr={lr:<8g} V-Acc {acc:.4f}  ({epochs} époques en {elapsed:.2f}s, {elapsed / epochs * 1000:.0f} ms/époque)")
+        if best is None or acc > best[1]:
+            best = (lr, acc, head)
+
+    lr, best_acc, head = best
+    # Réassembler un MobileNetV2 complet : le fichier reste compatible avec l'API
+    model = models.mobilenet_v2(pretrained=True)
+    model.classifier[1] = nn.Linear(model.last_channel, len(class_names))
+    model.classifier.load_state_dict(head.state_dict())
+    torch.save(model.state_dict(), 'plantdoc_mobilenetv2.pth')
+    print(f"Meilleur lr={lr:g}, V-Acc: {best_acc:.4f}. Modèle sauvegardé ('plantdoc_mobilenetv2.pth').")
+
+    with open("classes.txt", "w") as f:
+        f.write("\n".join(class_names))
+    export_artifact(class_names, val_acc=float(best_acc), head_epochs=epochs, lr=lr, feature_views=views)
 
 if __name__ == '__main__':
-    train_model()
+    parser = argparse.ArgumentParser(description="Entraînement du classifieur MobileNetV2 (backbone gelé)")
+    parser.add_argument("--feature-cache", action="store_true",
+                        help="Extrait les features une fois (memmap) puis entraîne seulement le classifieur")
+    parser.add_argument("--cache-dir", default=FEATURE_CACHE_DIR)
+    parser.add_argument("--views", type=int, default=FEATURE_VIEWS, help="Vues augmentées par image d'entraînement")
+    parser.add_argument("--head-epochs", type=int, default=HEAD_EPOCHS)
+    parser.add_argument("--lr", type=float, nargs='+', default=[LEARNING_RATE], help="Un ou plusieurs lr (balayage)")
+    args = parser.parse_args()
+
+    if args.feature_cache:
+        train_from_feature_cache(args.views, args.head_epochs, args.lr, args.cache_dir)
+    else:
+        train_model()
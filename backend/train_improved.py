@@ -1,9 +1,20 @@
 import os
+import json
+import time
+import random
+import argparse
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from torchvision import datasets, transforms, models
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from shards import get_shard_loaders
+from precision import BF16_MODE, use_bf16, autocast
+from modeling import artifact_path_for, save_atomic, save_artifact
 
 # ==========================================
 # CONFIGURATION AMÉLIORÉE (Modèle plus robuste)
@@ -13,8 +24,41 @@ BATCH_SIZE = 32
 EPOCHS = 15  # On augmente un peu le temps d'entraînement
 LEARNING_RATE = 0.0005 # Learning rate plus petit pour le fine-tuning
 UNFREEZE_BLOCKS = 3 # Nombre de blocs convolutifs à dégeler à la fin de MobileNetV2
+MODEL_OUTPUT = 'plantdoc_mobilenetv2.pth'
+
+# Reprise et arrêt anticipé : un checkpoint complet est écrit (atomiquement) à chaque époque,
+# l'entraînement s'arrête après EARLY_STOPPING_PATIENCE époques sans progrès de la V-Acc (0 = jamais).
+CHECKPOINT_PATH = 'checkpoint_improved.pt'
+EARLY_STOPPING_PATIENCE = 5
+
+# Mode distribué (CPU) : lancé par torchrun, un processus par groupe de cœurs, gradients
+# moyennés par all-reduce (gloo). BATCH_SIZE est la taille de lot de chaque processus.
+#   torchrun --standalone --nproc_per_node=4 train_improved.py
+#   torchrun --nnodes=2 --node_rank=0 --master_addr=10.0.0.1 --nproc_per_node=4 train_improved.py
+DIST_BACKEND = os.environ.get("PLANTDOC_DIST_BACKEND", "gloo")
+
+def setup_distributed():
+    """Initialise le groupe de processus si lancé par torchrun. Renvoie (rank, world_size)."""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return 0, 1
+    dist.init_process_group(DIST_BACKEND)
+    # Partager les cœurs de la machine entre les processus locaux (sinon sur-souscription)
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", str(world_size)))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), world_size
+
+def distributed_samplers(rank, world_size):
+    """
+    Échantillonneurs par rang : DistributedSampler (mélangé) pour l'entraînement, découpage
+    strié sans doublon pour la validation afin que les métriques agrégées soient exactes.
+    """
+    def build(train_dataset, val_dataset):
+        train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        return train_sampler, list(range(rank, len(val_dataset), world_size))
+    return build
 
-def get_data_loaders():
+def get_data_loaders(samplers=None):
     # 1. Pré-traitement et Data Augmentation PLUS ROBUSTE pour les vraies photos
     train_transforms = transforms.Compose([
         transforms.RandomResizedCrop(224, scale=(0.7, 1.0)), # Simulation de zoom
@@ -39,30 +83,88 @@ def get_data_loaders():
         'val': datasets.ImageFolder(os.path.join(DATA_DIR, 'val'), val_transforms)
     }
     
+    train_sampler, val_sampler = samplers(image_datasets['train'], image_datasets['val']) if samplers else (None, None)
     dataloaders = {
-        'train': DataLoader(image_datasets['train'], batch_size=BATCH_SIZE, shuffle=True, num_workers=2),
-        'val': DataLoader(image_datasets['val'], batch_size=BATCH_SIZE, shuffle=False, num_workers=2)
+        'train': DataLoader(image_datasets['train'], batch_size=BATCH_SIZE, shuffle=train_sampler is None,
+                            sampler=train_sampler, num_workers=2),
+        'val': DataLoader(image_datasets['val'], batch_size=BATCH_SIZE, shuffle=False,
+                          sampler=val_sampler, num_workers=2)
     }
     
     return dataloaders, image_datasets['train'].classes
 
-def train_model():
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"=== Entraînement Avancé sur {device} ===")
+def save_checkpoint(path, epoch, model, optimizer, scheduler, best_acc, stale_epochs, class_names):
+    save_atomic({
+        "epoch": epoch,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "best_acc": best_acc,
+        "stale_epochs": stale_epochs,
+        "classes": class_names,
+        "rng": {"torch": torch.get_rng_state(), "python": random.getstate()},
+    }, path)
 
+def read_checkpoint(path, rank, world_size):
+    """
+    Checkpoint lu par le rang 0 (le seul à les écrire) puis diffusé aux autres rangs : sans système
+    de fichiers partagé, chaque rang reprend quand même à la même époque. None s'il n'existe pas.
+    """
+    checkpoint = None
+    if rank == 0 and path and os.path.exists(path):
+        checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if world_size > 1:
+        received = [checkpoint]
+        dist.broadcast_object_list(received, src=0)
+        checkpoint = received[0]
+    return checkpoint
+
+def load_checkpoint(checkpoint, path, model, optimizer, scheduler, class_names):
+    """Restaure l'état complet ; renvoie (époque suivante, best_acc, époques sans progrès)."""
+    if checkpoint["classes"] != class_names:
+        raise ValueError(f"Le checkpoint '{path}' a été entraîné sur d'autres classes : {checkpoint['classes']}")
+    model.load_state_dict(checkpoint["model"])
+    optimizer.load_state_dict(checkpoint["optimizer"])
+    scheduler.load_state_dict(checkpoint["scheduler"])
+    torch.set_rng_state(checkpoint["rng"]["torch"])
+    random.setstate(checkpoint["rng"]["python"])
+    return checkpoint["epoch"] + 1, checkpoint["best_acc"], checkpoint["stale_epochs"]
+
+def train_model(shard_dir=None, epochs=EPOCHS, output_path=MODEL_OUTPUT, timing_output=None, bf16=BF16_MODE,
+                resume=False, patience=EARLY_STOPPING_PATIENCE, checkpoint_path=CHECKPOINT_PATH,
+                artifact_path=None):
+    rank, world_size = setup_distributed()
+    is_main = rank == 0
+    device = torch.device("cuda" if torch.cuda.is_available() and world_size == 1 else "cpu")
+    if is_main:
+        print(f"=== Entraînement Avancé sur {device} ({world_size} processus, lot global {BATCH_SIZE * world_size}) ===")
+    # Précision mixte bf16 (forward + backward des blocs dégelés), poids et optimiseur restent en fp32
+    bf16 = use_bf16(bf16) and device.type == "cpu"
+    if is_main and bf16:
+        print("Précision mixte bfloat16 activée (autocast CPU).")
+
+    samplers = distributed_samplers(rank, world_size) if world_size > 1 else None
     try:
-        dataloaders, class_names = get_data_loaders()
+        if shard_dir:
+            # Images pré-décodées (python shards.py pack) : augmentation par lots sur tenseurs
+            dataloaders, class_names = get_shard_loaders(shard_dir, BATCH_SIZE, samplers)
+        else:
+            dataloaders, class_names = get_data_loaders(samplers)
         num_classes = len(class_names)
-        print(f"Classes détectées: {class_names}")
+        if is_main:
+            print(f"Classes détectées: {class_names}")
     except FileNotFoundError:
         print("Erreur: Le dossier 'data/train' ou 'data/val' est introuvable.")
+        if world_size > 1:
+            dist.destroy_process_group()
         return
 
     # 2. Modèle Transfer Learning (MobileNetV2)
     # weights=models.MobileNet_V2_Weights.DEFAULT est la nouvelle syntaxe recommandée
     try:
         model = models.mobilenet_v2(weights=models.MobileNet_V2_Weights.DEFAULT)
-        print("Poids ImageNet chargés par défaut pour le Transfer Learning.")
+        if is_main:
+            print("Poids ImageNet chargés par défaut pour le Transfer Learning.")
     except Exception:
         model = models.mobilenet_v2(pretrained=True)
     
@@ -78,8 +180,14 @@ def train_model():
                 param.requires_grad = True
                 
     # Remplacer et dégeler le classifieur final
+    if world_size > 1:
+        torch.manual_seed(0) # Même initialisation du classifieur sur tous les rangs
     model.classifier[1] = nn.Linear(model.last_channel, num_classes)
     model = model.to(device)
+    net = model
+    if world_size > 1:
+        # All-reduce des gradients pendant le backward (seuls les paramètres dégelés sont concernés)
+        net = DistributedDataParallel(model)
 
     # 4. Optimiseur et Loss
     criterion = nn.CrossEntropyLoss()
@@ -89,56 +197,132 @@ def train_model():
     # Scheduler pour réduire le learning rate si le modèle stagne
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
 
-    # 5. Boucle d'entraînement
+    # 5. Boucle d'entraînement (éventuellement reprise depuis le dernier checkpoint)
     best_acc = 0.0
+    stale_epochs = 0
+    start_epoch = 0
+    epoch_timings = []
+    checkpoint = read_checkpoint(checkpoint_path, rank, world_size) if resume else None
+    if checkpoint is not None:
+        start_epoch, best_acc, stale_epochs = load_checkpoint(checkpoint, checkpoint_path, model, optimizer,
+                                                              scheduler, class_names)
+        del checkpoint
+        if is_main:
+            print(f"Reprise depuis '{checkpoint_path}' à l'époque {start_epoch + 1} (meilleure V-Acc {best_acc:.4f}).")
+    elif resume and is_main:
+        print(f"Aucun checkpoint '{checkpoint_path}' : entraînement depuis les poids ImageNet.")
+    epoch = start_epoch - 1 # Dernière époque terminée (si la reprise est déjà au bout)
 
-    for epoch in range(EPOCHS):
-        print(f'\nEpoch {epoch+1}/{EPOCHS}')
-        print('-' * 10)
+    for epoch in range(start_epoch, epochs):
+        if is_main:
+            print(f'\nEpoch {epoch+1}/{epochs}')
+            print('-' * 10)
+        sampler = getattr(dataloaders['train'], 'sampler', None)
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch) # Nouveau mélange à chaque époque, identique sur tous les rangs
 
         for phase in ['train', 'val']:
             if phase == 'train':
-                model.train()
+                net.train()
             else:
-                model.eval()
+                net.eval()
 
             running_loss = 0.0
             running_corrects = 0
+            seen = 0
+            phase_start = time.perf_counter()
 
             for inputs, labels in dataloaders[phase]:
                 inputs, labels = inputs.to(device), labels.to(device)
                 optimizer.zero_grad()
 
                 with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model(inputs)
+                    # Forward sous autocast, backward en dehors (recommandation PyTorch)
+                    with autocast(bf16):
+                        # Validation sur le module local : pas de synchronisation DDP inutile
+                        outputs = net(inputs) if phase == 'train' else model(inputs)
+                        loss = criterion(outputs, labels)
                     _, preds = torch.max(outputs, 1)
-                    loss = criterion(outputs, labels)
 
                     if phase == 'train':
                         loss.backward()
                         optimizer.step()
 
                 running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                running_corrects += torch.sum(preds == labels.data).item()
+                seen += inputs.size(0)
+
+            # Agrégation des sommes de tous les rangs (moyennes sur le dataset complet)
+            totals = torch.tensor([running_loss, running_corrects, seen], dtype=torch.float64)
+            if world_size > 1:
+                dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+            running_loss, running_corrects, seen = totals.tolist()
+            elapsed = time.perf_counter() - phase_start
+
+            epoch_loss = running_loss / seen
+            epoch_acc = running_corrects / seen
 
-            epoch_loss = running_loss / len(dataloaders[phase].dataset)
-            epoch_acc = running_corrects.double() / len(dataloaders[phase].dataset)
+            if is_main:
+                print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} ({seen / elapsed:.1f} img/s)')
+            if phase == 'train':
+                epoch_timings.append({"epoch": epoch + 1, "seconds": elapsed, "images_per_sec": seen / elapsed})
 
-            print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
-            
             if phase == 'val':
-                scheduler.step(epoch_acc) # Ajuster le LR basé sur la précision de validation
-                
-                # Sauvegarder uniquement si on bat le record
+                scheduler.step(epoch_acc) # Ajuster le LR basé sur la précision de validation (identique sur tous les rangs)
+
+                # Sauvegarder uniquement si on bat le record (rang 0 seulement)
                 if epoch_acc > best_acc:
                     best_acc = epoch_acc
-                    torch.save(model.state_dict(), 'plantdoc_mobilenetv2.pth')
-                    print(f"🌟 Nouveau meilleur modèle sauvegardé ! (Précision: {best_acc:.4f})")
+                    stale_epochs = 0
+                    if is_main:
+                        save_atomic(model.state_dict(), output_path)
+                        print(f"🌟 Nouveau meilleur modèle sauvegardé ! (Précision: {best_acc:.4f})")
+                else:
+                    stale_epochs += 1
 
-    print(f"\n✅ Entraînement terminé. Meilleure V-Acc: {best_acc:.4f}.")
-    
-    with open("classes.txt", "w") as f:
-        f.write("\n".join(class_names))
+        if is_main and checkpoint_path:
+            save_checkpoint(checkpoint_path, epoch, model, optimizer, scheduler, best_acc, stale_epochs, class_names)
+
+        # V-Acc agrégée : tous les rangs prennent la même décision
+        if patience and stale_epochs >= patience:
+            if is_main:
+                print(f"Arrêt anticipé : pas de progrès depuis {patience} époques.")
+            break
+
+    if is_main:
+        print(f"\n✅ Entraînement terminé. Meilleure V-Acc: {best_acc:.4f}.")
+
+        with open("classes.txt", "w") as f:
+            f.write("\n".join(class_names))
+
+        # Artefact versionné : meilleurs poids + classes + pré-traitement, lu en une fois par l'API
+        if artifact_path is None:
+            artifact_path = artifact_path_for(output_path)
+        if artifact_path and os.path.exists(output_path):
+            save_artifact(artifact_path, torch.load(output_path, map_location="cpu"), class_names,
+                          source_path=output_path, val_acc=best_acc, epochs=epoch + 1, unfreeze_blocks=UNFREEZE_BLOCKS)
+            print(f"Artefact exporté : '{artifact_path}'.")
+
+        if timing_output:
+            with open(timing_output, "w") as f:
+                json.dump({"world_size": world_size, "batch_size_per_process": BATCH_SIZE, "bf16": bf16,
+                           "best_val_acc": best_acc, "epochs": epoch_timings}, f, indent=2)
+
+    if world_size > 1:
+        dist.destroy_process_group()
 
 if __name__ == '__main__':
-    train_model()
+    parser = argparse.ArgumentParser(description="Fine-tuning partiel de MobileNetV2")
+    parser.add_argument("--shards", default=None, help="Dossier de shards uint8 (voir shards.py) au lieu d'ImageFolder")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--output", default=MODEL_OUTPUT, help="Fichier des meilleurs poids")
+    parser.add_argument("--timing-output", default=None, help="JSON des durées par époque (voir scaling_report.py)")
+    parser.add_argument("--bf16", default=BF16_MODE, choices=["auto", "1", "0"], help="Précision mixte bfloat16")
+    parser.add_argument("--resume", action="store_true", help="Reprend depuis le dernier checkpoint")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Checkpoint par époque ('' = désactivé)")
+    parser.add_argument("--patience", type=int, default=EARLY_STOPPING_PATIENCE, help="Arrêt anticipé (0 = désactivé)")
+    parser.add_argument("--artifact", default=None,
+                        help="Artefact exporté en fin d'entraînement (défaut : à côté de --output, '' = aucun)")
+    args = parser.parse_args()
+    train_model(args.shards, args.epochs, args.output, args.timing_output, args.bf16,
+                args.resume, args.patience, args.checkpoint, args.artifact)
@@ -0,0 +1,101 @@
+import os
+import json
+import argparse
+import torch
+import torch.nn.functional as F
+from torchvision import datasets
+from torch.utils.data import DataLoader
+
+from imaging import get_preprocess
+from modeling import load_serving_model, load_artifact
+from backends import load_backend
+from cascade import resize_batch, full_probabilities
+from export_models import measure_latency
+
+# Règle le seuil de la cascade (cascade.py) sur data/val : les probabilités du modèle rapide
+# et du modèle complet (avec et sans TTA) sont calculées une fois, puis chaque seuil est simulé.
+# Coût moyen estimé par image = latence du modèle rapide + taux d'escalade x latence du complet.
+# Recommande le seuil le moins coûteux dont la précision reste à `--tolerance` du modèle complet.
+# Usage : python tune_cascade.py --fast plantdoc_student.pt --data-dir data/val --output cascade.json
+
+THRESHOLDS = [round(0.5 + 0.01 * i, 2) for i in range(50)]
+
+def collect(fast_backend, fast_size, full_backend, loader, to_model_idx):
+    fast, full, full_tta, labels = [], [], [], []
+    for inputs, targets in loader:
+        fast.append(F.softmax(fast_backend(resize_batch(inputs, fast_size)).float(), dim=1))
+        plain = full_probabilities(full_backend, inputs)
+        full.append(plain)
+        full_tta.append((plain + F.softmax(full_backend(torch.flip(inputs, dims=[3])).float(), dim=1)) / 2)
+        labels.append(to_model_idx[targets])
+    return torch.cat(fast), torch.cat(full), torch.cat(full_tta), torch.cat(labels)
+
+def simulate(fast, full, labels, threshold):
+    unsure = fast.max(dim=1).values < threshold
+    preds = torch.where(unsure, full.argmax(dim=1), fast.argmax(dim=1))
+    return float((preds == labels).float().mean()), float(unsure.float().mean())
+
+def tune(fast_path, data_dir, tolerance, batch_size=8):
+    full_model, classes, full_path, meta = load_serving_model()
+    fast_model, fast_classes, artifact = load_artifact(fast_path)
+    if fast_classes != classes:
+        raise ValueError(f"Classes du modèle rapide {fast_classes} différentes de celles du modèle complet {classes}")
+    fast_size = artifact["preprocess"]["crop"]
+    fast_backend = load_backend("eager", fast_model)
+    full_backend = load_backend("eager", full_model)
+
+    dataset = datasets.ImageFolder(data_dir, get_preprocess(meta["resize"], meta["crop"]))
+    to_model_idx = torch.tensor([classes.index(c) for c in dataset.classes])
+    loader = DataLoader(dataset, batch_size=64, shuffle=False, num_workers=2)
+    fast, full, full_tta, labels = collect(fast_backend, fast_size, full_backend, loader, to_model_idx)
+
+    # Latence par image à la taille de lot du micro-batching (la TTA double la passe complète)
+    t_fast = measure_latency(fast_backend, batch_size, input_size=fast_size) / batch_size
+    t_full = measure_latency(full_backend, batch_size, input_size=meta["crop"]) / batch_size
+    full_acc = float((full.argmax(dim=1) == labels).float().mean())
+    print(f"=== Cascade sur {len(labels)} images ===")
+    print(f"Rapide : Top-1 {float((fast.argmax(dim=1) == labels).float().mean()) * 100:.2f}%  {t_fast:.2f} ms/img")
+    print(f"Complet: Top-1 {full_acc * 100:.2f}%  {t_full:.2f} ms/img  "
+          f"(TTA : {float((full_tta.argmax(dim=1) == labels).float().mean()) * 100:.2f}%)")
+
+    sweep = []
+    for tta, full_probs in [(False, full), (True, full_tta)]:
+        escalation_cost = t_full * (2 if tta else 1)
+        for threshold in THRESHOLDS:
+            accuracy, escalation = simulate(fast, full_probs, labels, threshold)
+            sweep.append({
+                "threshold": threshold,
+                "tta": tta,
+                "top1": round(accuracy, 4),
+                "escalation_rate": round(escalation, 4),
+                "cost_ms_per_image": round(t_fast + escalation * escalation_cost, 3),
+            })
+
+    eligible = [r for r in sweep if r["top1"] >= full_acc - tolerance]
+    best = min(eligible, key=lambda r: r["cost_ms_per_image"]) if eligible else None
+    if best:
+        print(f"\n=> PLANTDOC_CASCADE_THRESHOLD={best['threshold']} PLANTDOC_CASCADE_TTA={int(best['tta'])} : "
+              f"Top-1 {best['top1'] * 100:.2f}%, escalade {best['escalation_rate'] * 100:.1f}%, "
+              f"{best['cost_ms_per_image']:.2f} ms/img (x{t_full / best['cost_ms_per_image']:.1f} vs complet)")
+    else:
+        print(f"\nAucun seuil ne reste à {tolerance * 100:.1f} pt du modèle complet.")
+
+    return {
+        "fast": fast_path, "full": full_path, "images": len(labels), "tolerance": tolerance,
+        "full_top1": round(full_acc, 4), "fast_ms_per_image": round(t_fast, 3), "full_ms_per_image": round(t_full, 3),
+        "recommended": best, "sweep": sweep,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Réglage du seuil de la cascade modèle rapide / modèle complet")
+    parser.add_argument("--fast", default=os.environ.get("PLANTDOC_CASCADE_ARTIFACT") or "plantdoc_student.pt")
+    parser.add_argument("--data-dir", default="data/val")
+    parser.add_argument("--tolerance", type=float, default=0.005, help="Perte de Top-1 acceptée vs modèle complet")
+    parser.add_argument("--batch-size", type=int, default=8, help="Taille de lot des mesures de latence")
+    parser.add_argument("--output", default="cascade_report.json")
+    args = parser.parse_args()
+
+    results = tune(args.fast, args.data_dir, args.tolerance, args.batch_size)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Rapport écrit dans {args.output}")
@@ -1,12 +1,60 @@
-import cv2
 import numpy as np
 
+# cv2 est importé à la demande : son chargement (~100-200 ms) ne pèse pas sur le démarrage de l'API
+
+def get_rss_mb(pid="self") -> float:
+    """Mémoire résidente (RSS) d'un processus en Mo, lue dans /proc (Linux) ; 0 si indisponible."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+def get_pss_mb(pid="self") -> float:
+    """
+    Mémoire proportionnelle (PSS) en Mo : chaque page partagée est divisée entre les processus qui la
+    partagent, la somme sur les workers forkés est donc la vraie empreinte. 0 si indisponible.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+def laplacian_variance(rgb: np.ndarray) -> float:
+    """
+    Estime la netteté d'une image RGB uint8 (HxWx3) par la variance du Laplacien.
+    Plus la valeur est basse, plus l'image est floue.
+    """
+    import cv2
+    # Convertir en niveaux de gris
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+def is_array_blurry(rgb: np.ndarray, threshold: float = 100.0) -> bool:
+    """
+    Variante de `is_image_blurry` pour une image déjà décodée (évite un second décodage).
+    """
+    try:
+        # Si la variance est inférieure au seuil, l'image est considérée comme floue
+        return laplacian_variance(rgb) < threshold
+    except Exception as e:
+        print(f"Erreur lors de l'analyse du flou : {e}")
+        return True # En cas d'erreur, on rejette par prudence
+
 def is_image_blurry(image_bytes: bytes, threshold: float = 100.0) -> bool:
     """
     Vérifie si une image est trop floue pour être analysée.
     Utilise la variance du Laplacien pour estimer la netteté.
     """
     try:
+        import cv2
         # Convertir les bytes de l'image en tableau numpy
         nparr = np.frombuffer(image_bytes, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -14,14 +62,7 @@ def is_image_blurry(image_bytes: bytes, threshold: float = 100.0) -> bool:
         if image is None:
             return True
         
-        # Convertir en niveaux de gris
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Calculer la variance du Laplacien
-        variance = cv2.Laplacian(gray, cv2.CV_64F).var()
-        
-        # Si la variance est inférieure au seuil, l'image est considérée comme floue
-        return variance < threshold
+        return is_array_blurry(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), threshold)
     except Exception as e:
         print(f"Erreur lors de l'analyse du flou : {e}")
         return True # En cas d'erreur, on rejette par prudence
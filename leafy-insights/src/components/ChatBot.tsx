@@ -1,6 +1,7 @@
 import React, { useState, useRef, useEffect } from "react";
 import { MessageCircle, X, Send, Leaf } from "lucide-react";
 import { cn } from "@/lib/utils";
+import { getSessionId, saveSessionId } from "@/lib/session";
 
 type Message = {
     id: string;
@@ -37,22 +38,52 @@ const ChatBot = () => {
         setInput("");
         setIsTyping(true);
 
+        const botId = (Date.now() + 1).toString();
+        const errorText = "Désolé, je rencontre un problème de connexion avec mon cerveau.";
+        const appendToBot = (delta: string) => {
+            setIsTyping(false);
+            setMessages((prev) =>
+                prev.some((m) => m.id === botId)
+                    ? prev.map((m) => (m.id === botId ? { ...m, text: m.text + delta } : m))
+                    : [...prev, { id: botId, sender: "bot", text: delta }]
+            );
+        };
+
         try {
-            const response = await fetch("http://127.0.0.1:8000/chat", {
+            // Réponse en streaming (Server-Sent Events) : le texte s'affiche au fil de la génération
+            const response = await fetch("http://127.0.0.1:8000/chat/stream", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ message: userMsg.text }),
+                body: JSON.stringify({ message: userMsg.text, session_id: getSessionId() }),
             });
+            if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
 
-            const data = await response.json();
-
-            const botMsg: Message = {
-                id: (Date.now() + 1).toString(),
-                sender: "bot",
-                text: data.status === "success" ? data.response : "Désolé, je rencontre un problème de connexion avec mon cerveau.",
-            };
-
-            setMessages((prev) => [...prev, botMsg]);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let received = false;
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split("\n\n");
+                buffer = events.pop() ?? "";
+                for (const event of events) {
+                    const dataLine = event.split("\n").find((line) => line.startsWith("data: "));
+                    if (!dataLine) continue;
+                    const data = JSON.parse(dataLine.slice(6));
+                    if (event.startsWith("event: done")) {
+                        saveSessionId(data.session_id);
+                    } else if (event.startsWith("event: error")) {
+                        appendToBot(received ? ` ${errorText}` : errorText);
+                        received = true;
+                    } else if (typeof data.delta === "string") {
+                        appendToBot(data.delta);
+                        received = true;
+                    }
+                }
+            }
+            if (!received) appendToBot(errorText);
         } catch (error) {
             setMessages((prev) => [
                 ...prev,
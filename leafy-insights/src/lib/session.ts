@@ -0,0 +1,12 @@
+// Session du chatbot côté serveur : demandée à /predict (?session=true), puis renvoyée par /predict
+// et /chat, elle porte le dernier diagnostic et l'historique de la conversation
+// (pas besoin de renvoyer la photo au chatbot).
+const SESSION_KEY = "plantdoc_session_id";
+
+export function getSessionId(): string | null {
+  return sessionStorage.getItem(SESSION_KEY);
+}
+
+export function saveSessionId(sessionId?: string | null) {
+  if (sessionId) sessionStorage.setItem(SESSION_KEY, sessionId);
+}
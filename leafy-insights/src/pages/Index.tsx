@@ -6,6 +6,7 @@ import ResultCard from "@/components/ResultCard";
 import { getRandomResult } from "@/data/mockData";
 import type { DiagnosticResult } from "@/data/mockData";
 import diseasesData from "@/data/diseases_db.json";
+import { getSessionId, saveSessionId } from "@/lib/session";
 
 type AppState = "upload" | "scanning" | "result";
 
@@ -35,8 +36,11 @@ const Index = () => {
       const formData = new FormData();
       formData.append("file", file);
 
-      // Fetch prediction
-      const response = await fetch("http://127.0.0.1:8000/predict", {
+      // Diagnostic du modèle servi (micro-batching, backend optimisé), affiché dès sa réception
+      // Le diagnostic est mémorisé dans la session du chatbot
+      const sessionId = getSessionId();
+      const url = "http://127.0.0.1:8000/predict" + (sessionId ? `?session_id=${encodeURIComponent(sessionId)}` : "?session=true");
+      const response = await fetch(url, {
         method: "POST",
         body: formData,
       });
@@ -46,19 +50,22 @@ const Index = () => {
       }
 
       const data = await response.json();
+      saveSessionId(data.session_id);
 
-      // Fetch explainability heatmap in background (non-blocking)
-      fetch("http://127.0.0.1:8000/explain", {
-        method: "POST",
-        body: formData,
-      })
-        .then((res) => res.json())
-        .then((explainData) => {
-          if (explainData.status === "success") {
-            setHeatmapUrl(explainData.heatmap_base64);
-          }
+      // Heatmap Grad-CAM en arrière-plan (non bloquant) : le serveur réutilise la prédiction en cache
+      if (data.status !== "error") {
+        fetch("http://127.0.0.1:8000/explain", {
+          method: "POST",
+          body: formData,
         })
-        .catch(console.error);
+          .then((res) => res.json())
+          .then((explainData) => {
+            if (explainData.status === "success") {
+              setHeatmapUrl(explainData.heatmap_base64);
+            }
+          })
+          .catch(console.error);
+      }
 
       if (data.status === "error" || data.status === "uncertain") {
         setResult({